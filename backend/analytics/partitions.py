@@ -0,0 +1,106 @@
+'''
+Monthly partition maintenance for the raw analytics table (V0018).
+
+maintain() makes sure partitions exist up to PARTITIONS_AHEAD months ahead
+and, when ANALYTICS_RETENTION_MONTHS is set, drops whole partitions older
+than the retention window instead of DELETE-ing rows. Each process runs it
+at most once per MAINTENANCE_INTERVAL seconds; rows that arrive before their
+month's partition exists land in analytics_default and are moved when the
+partition is created, so ingestion never depends on this running on time.
+The rollup tables keep the history of dropped months.
+
+    python partitions.py [--from YYYY-MM-DD]
+'''
+import argparse
+import os
+import threading
+import time
+from datetime import date
+from typing import Any, Optional, Tuple
+
+import psycopg2
+
+from timing import log_event
+
+PARTITIONS_AHEAD = int(os.environ.get('ANALYTICS_PARTITIONS_AHEAD', '2'))
+# 0 keeps every month
+RETENTION_MONTHS = int(os.environ.get('ANALYTICS_RETENTION_MONTHS', '0'))
+MAINTENANCE_INTERVAL = float(os.environ.get('ANALYTICS_PARTITION_CHECK_INTERVAL', '21600'))
+# DDL on the parent waits for running inserts; give up quickly and retry on the next run
+LOCK_TIMEOUT = '2s'
+RETRY_AFTER = 300
+
+_lock = threading.Lock()
+_last_run: Optional[float] = None
+
+
+def add_months(day: date, months: int) -> date:
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def retention_start(today: Optional[date] = None) -> Optional[date]:
+    '''First day still kept in the raw table, None when nothing is dropped'''
+    if RETENTION_MONTHS <= 0:
+        return None
+    return add_months((today or date.today()).replace(day=1), -RETENTION_MONTHS)
+
+
+def ensure(conn: Any, from_day: date, to_day: date) -> int:
+    '''Creates the monthly partitions covering [from_day, to_day]; the caller commits'''
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT analytics_ensure_partitions(%s, %s)', (from_day, to_day))
+        return cursor.fetchone()[0]
+
+
+def run(conn: Any) -> Tuple[int, int]:
+    '''(partitions created, partitions dropped), committed'''
+    today = date.today()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+        created = ensure(conn, today, add_months(today.replace(day=1), PARTITIONS_AHEAD))
+        dropped = 0
+        if RETENTION_MONTHS > 0:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT analytics_drop_partitions(%s)', (RETENTION_MONTHS,))
+                dropped = cursor.fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return created, dropped
+
+
+def maintain(conn: Any) -> None:
+    '''Runs partition maintenance if this process has not done so recently; never raises'''
+    global _last_run
+    now = time.monotonic()
+    with _lock:
+        if _last_run is not None and now - _last_run < MAINTENANCE_INTERVAL:
+            return
+        _last_run = now
+    try:
+        created, dropped = run(conn)
+        if created or dropped:
+            log_event('analytics_partitions', created=created, dropped=dropped)
+    except psycopg2.Error as e:
+        # Retried on a later invocation; inserts keep going to existing or default partitions
+        log_event('analytics_partitions_failed', error=e)
+        with _lock:
+            _last_run = now - MAINTENANCE_INTERVAL + RETRY_AFTER
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create upcoming and drop expired analytics partitions')
+    parser.add_argument('--from', dest='from_day', type=date.fromisoformat,
+                        help='also create partitions back to this date')
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        if args.from_day:
+            ensure(connection, args.from_day, date.today())
+        print('created=%d dropped=%d' % run(connection))
+    finally:
+        connection.close()
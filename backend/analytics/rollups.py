@@ -0,0 +1,337 @@
+'''
+Incrementally maintained rollups behind the analytics dashboard.
+
+apply_visits() runs in the same transaction as the raw INSERT. It only
+bumps counters (hourly/daily per-path, per-day totals, all-time per-path)
+and records (day, visitor) pairs, so concurrent ingests never queue on a
+shared row or rewrite a sketch. Those count human traffic only; bots go
+into the per-day user-agent rollup and nowhere else.
+
+fold_visitors() merges one batch of pending visitor pairs into the per-day
+and all-time HyperLogLog sketches. Requests never fold: the buffered
+flusher calls maintain() after a write, at most once per
+ANALYTICS_VISITOR_FOLD_INTERVAL seconds, and in sync ingest mode the
+scheduled `--fold` run below does it. Readers merge the pairs not folded
+yet for the days they show, so unique counts do not lag. rebuild() is the
+compaction job: it classifies visits stored without a user-agent class,
+recomputes rollups from the raw analytics table, rebuilds sketches,
+prunes old hourly buckets and folds every pending pair.
+
+    python rollups.py [--since YYYY-MM-DD]
+    python rollups.py --fold
+'''
+import argparse
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from typing import Any, Dict, Optional, Sequence, Set, Tuple
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+import partitions
+from hll import HyperLogLog
+from timing import log_event
+from useragent import BOT, classify
+
+HOURLY_RETENTION_DAYS = int(os.environ.get('ANALYTICS_HOURLY_RETENTION_DAYS', '30'))
+FOLD_INTERVAL = float(os.environ.get('ANALYTICS_VISITOR_FOLD_INTERVAL', '60'))
+FOLD_BATCH = 50000
+# pg_try_advisory_xact_lock key: one folder at a time across processes
+FOLD_LOCK_KEY = 0x616e6c76
+
+_fold_lock = threading.Lock()
+_last_fold: Optional[float] = None
+
+# (visited_at, page_path, visitor_ip, ua_device, ua_os, ua_browser) as stored in analytics
+IngestedVisit = Tuple[datetime, str, str, int, int, int]
+
+UPSERT_HOURLY = '''
+    INSERT INTO analytics_hourly AS t (hour, page_path, visits) VALUES %s
+    ON CONFLICT (hour, page_path) DO UPDATE SET visits = t.visits + EXCLUDED.visits
+'''
+UPSERT_DAILY = '''
+    INSERT INTO analytics_daily AS t (day, page_path, visits) VALUES %s
+    ON CONFLICT (day, page_path) DO UPDATE SET visits = t.visits + EXCLUDED.visits
+'''
+UPSERT_DAY_TOTALS = '''
+    INSERT INTO analytics_daily_totals AS t (day, visits) VALUES %s
+    ON CONFLICT (day) DO UPDATE SET visits = t.visits + EXCLUDED.visits
+'''
+UPSERT_DAY_SUPPRESSED = '''
+    INSERT INTO analytics_daily_totals AS t (day, suppressed) VALUES (CURRENT_DATE, %s)
+    ON CONFLICT (day) DO UPDATE SET suppressed = t.suppressed + EXCLUDED.suppressed
+'''
+INSERT_DAY_VISITORS = '''
+    INSERT INTO analytics_daily_visitors (day, visitor) VALUES %s
+    ON CONFLICT DO NOTHING
+'''
+UPSERT_PATH_TOTALS = '''
+    INSERT INTO analytics_path_totals AS t (page_path, visits) VALUES %s
+    ON CONFLICT (page_path) DO UPDATE SET visits = t.visits + EXCLUDED.visits
+'''
+UPSERT_UA_DAILY = '''
+    INSERT INTO analytics_ua_daily AS t (day, device, os, browser, visits) VALUES %s
+    ON CONFLICT (day, device, os, browser) DO UPDATE SET visits = t.visits + EXCLUDED.visits
+'''
+
+
+def apply_visits(cursor: Any, visits: Sequence[IngestedVisit], suppressed: int = 0) -> None:
+    '''
+    Adds freshly inserted visits to the user-agent rollup and, bots left out,
+    to every other rollup, plus the hits suppressed by dedup since the last
+    write to today's totals; the caller commits. Only counter upserts and
+    visitor pair inserts run here, sketches are left to fold_visitors().
+    '''
+    user_agents = Counter((visit[0].date(),) + tuple(visit[3:]) for visit in visits)
+    if user_agents:
+        execute_values(cursor, UPSERT_UA_DAILY, sorted(k + (n,) for k, n in user_agents.items()))
+
+    # Bots stop at the user-agent rollup; every headline figure is human traffic
+    visits = [visit for visit in visits if visit[3] != BOT]
+
+    hourly: Counter = Counter()
+    daily: Counter = Counter()
+    paths: Counter = Counter()
+    day_visits: Counter = Counter()
+    day_visitors: Set[Tuple[date, str]] = set()
+
+    for visited_at, page_path, visitor_ip, *_ in visits:
+        day = visited_at.date()
+        hourly[(visited_at.replace(minute=0, second=0, microsecond=0), page_path)] += 1
+        daily[(day, page_path)] += 1
+        paths[page_path] += 1
+        day_visits[day] += 1
+        day_visitors.add((day, visitor_ip or 'unknown'))
+
+    # Keys are sorted so concurrent ingests lock rollup rows in the same order.
+    # Visitor pairs go first: fold_visitors() deletes pairs before it locks
+    # day totals, so both take their locks in the same order.
+    if visits:
+        execute_values(cursor, INSERT_DAY_VISITORS, sorted(day_visitors))
+        execute_values(cursor, UPSERT_HOURLY, sorted((k[0], k[1], n) for k, n in hourly.items()))
+        execute_values(cursor, UPSERT_DAILY, sorted((k[0], k[1], n) for k, n in daily.items()))
+        execute_values(cursor, UPSERT_DAY_TOTALS, sorted(day_visits.items()))
+        execute_values(cursor, UPSERT_PATH_TOTALS, sorted(paths.items()))
+    if suppressed:
+        cursor.execute(UPSERT_DAY_SUPPRESSED, (suppressed,))
+
+
+def fold_visitors(conn: Any, batch_size: int = FOLD_BATCH) -> int:
+    '''
+    Merges at most batch_size pending (day, visitor) pairs into the per-day
+    and all-time sketches, deletes them and commits; returns the number of
+    pairs folded. A concurrent caller skips instead of queueing.
+    '''
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_xact_lock(%s)', (FOLD_LOCK_KEY,))
+        if not cursor.fetchone()[0]:
+            conn.rollback()
+            return 0
+        cursor.execute('''
+            DELETE FROM analytics_daily_visitors
+            WHERE (day, visitor) IN (
+                SELECT day, visitor FROM analytics_daily_visitors ORDER BY day, visitor LIMIT %s
+            )
+            RETURNING day, visitor
+        ''', (batch_size,))
+        rows = cursor.fetchall()
+        if not rows:
+            conn.rollback()
+            return 0
+
+        by_day: Dict[date, Set[str]] = defaultdict(set)
+        for day, visitor in rows:
+            by_day[day].add(visitor)
+
+        for day in sorted(by_day):
+            cursor.execute('SELECT visitors FROM analytics_daily_totals WHERE day = %s FOR UPDATE', (day,))
+            row = cursor.fetchone()
+            sketch = HyperLogLog.from_bytes(row[0]) if row and row[0] is not None else HyperLogLog()
+            sketch.update(by_day[day])
+            cursor.execute('''
+                INSERT INTO analytics_daily_totals AS t (day, visitors) VALUES (%s, %s)
+                ON CONFLICT (day) DO UPDATE SET visitors = EXCLUDED.visitors
+            ''', (day, psycopg2.Binary(sketch.to_bytes())))
+
+        cursor.execute('SELECT visitors FROM analytics_totals WHERE id = 1 FOR UPDATE')
+        data = cursor.fetchone()[0]
+        total = HyperLogLog.from_bytes(data) if data is not None else HyperLogLog()
+        total.update(visitor for _, visitor in rows)
+        cursor.execute('UPDATE analytics_totals SET visitors = %s WHERE id = 1',
+                       (psycopg2.Binary(total.to_bytes()),))
+    conn.commit()
+    return len(rows)
+
+
+def fold_all(conn: Any) -> int:
+    '''Folds batches until no pairs are pending; for the offline jobs only'''
+    folded = 0
+    while True:
+        batch = fold_visitors(conn)
+        folded += batch
+        if batch < FOLD_BATCH:
+            return folded
+
+
+def maintain(conn: Any) -> None:
+    '''
+    Folds one batch of pending visitors if this process has not done so
+    recently; never raises. Called by the buffered flusher after it commits.
+    '''
+    global _last_fold
+    now = time.monotonic()
+    with _fold_lock:
+        if _last_fold is not None and now - _last_fold < FOLD_INTERVAL:
+            return
+        _last_fold = now
+    try:
+        folded = fold_visitors(conn)
+        if folded:
+            log_event('analytics_visitors_folded', pairs=folded)
+    except Exception as e:
+        conn.rollback()
+        # Pending pairs stay in the table and are still counted by reads
+        log_event('analytics_visitors_fold_failed', error=e)
+
+
+def classify_stored(conn: Any, start: datetime) -> int:
+    '''
+    Sets the user-agent class of visits since start that have none. The
+    distinct user agents are classified in Python and applied with one
+    UPDATE joined against a temp table; the caller commits.
+    '''
+    classes = []
+    with conn.cursor(name='analytics_ua_backfill') as stream:
+        stream.itersize = 10000
+        stream.execute('''
+            SELECT DISTINCT COALESCE(user_agent, '')
+            FROM analytics WHERE visited_at >= %s AND ua_device IS NULL
+        ''', (start,))
+        for (user_agent,) in stream:
+            classes.append((user_agent,) + classify(user_agent))
+    if not classes:
+        return 0
+
+    with conn.cursor() as cursor:
+        cursor.execute('''
+            CREATE TEMP TABLE analytics_ua_classes (
+                user_agent TEXT PRIMARY KEY, device SMALLINT, os SMALLINT, browser SMALLINT
+            ) ON COMMIT DROP
+        ''')
+        execute_values(cursor, 'INSERT INTO analytics_ua_classes VALUES %s', classes, page_size=1000)
+        cursor.execute('''
+            UPDATE analytics AS a
+            SET ua_device = c.device, ua_os = c.os, ua_browser = c.browser
+            FROM analytics_ua_classes AS c
+            WHERE c.user_agent = COALESCE(a.user_agent, '') AND a.visited_at >= %s AND a.ua_device IS NULL
+        ''', (start,))
+        return cursor.rowcount
+
+
+def rebuild(conn: Any, since: Optional[date] = None) -> None:
+    '''
+    Recomputes rollups for days >= since (everything when since is None) from
+    the raw analytics table, refreshes the all-time rows and folds pending
+    visitor pairs. Visits stored
+    before V0020 are classified first, once per distinct user agent. Days older
+    than the raw table's retention are never rebuilt: their partitions are
+    gone and the rollups are the only copy left.
+    '''
+    kept_from = partitions.retention_start()
+    if kept_from is not None and (since is None or since < kept_from):
+        since = kept_from
+    start = datetime.combine(since or date.min, datetime.min.time())
+    classify_stored(conn, start)
+
+    with conn.cursor() as cursor:
+        cursor.execute('DELETE FROM analytics_ua_daily WHERE day >= %s', (start.date(),))
+        cursor.execute('''
+            INSERT INTO analytics_ua_daily (day, device, os, browser, visits)
+            SELECT visited_at::date, ua_device, ua_os, ua_browser, COUNT(*)
+            FROM analytics WHERE visited_at >= %s
+            GROUP BY 1, 2, 3, 4
+        ''', (start,))
+
+        cursor.execute('DELETE FROM analytics_hourly WHERE hour >= %s', (start,))
+        cursor.execute('DELETE FROM analytics_daily WHERE day >= %s', (start.date(),))
+        # Rows stay for their suppressed counts, which exist only here
+        cursor.execute('UPDATE analytics_daily_totals SET visits = 0, visitors = NULL WHERE day >= %s',
+                       (start.date(),))
+
+        cursor.execute('''
+            INSERT INTO analytics_hourly (hour, page_path, visits)
+            SELECT date_trunc('hour', visited_at), COALESCE(page_path, '/'), COUNT(*)
+            FROM analytics WHERE visited_at >= %s AND ua_device <> %s
+            GROUP BY 1, 2
+        ''', (start, BOT))
+        cursor.execute('''
+            INSERT INTO analytics_daily (day, page_path, visits)
+            SELECT visited_at::date, COALESCE(page_path, '/'), COUNT(*)
+            FROM analytics WHERE visited_at >= %s AND ua_device <> %s
+            GROUP BY 1, 2
+        ''', (start, BOT))
+        cursor.execute('''
+            INSERT INTO analytics_daily_totals AS t (day, visits)
+            SELECT day, SUM(visits) FROM analytics_daily WHERE day >= %s GROUP BY day
+            ON CONFLICT (day) DO UPDATE SET visits = EXCLUDED.visits
+        ''', (start.date(),))
+
+    sketches: Dict[date, HyperLogLog] = defaultdict(HyperLogLog)
+    with conn.cursor(name='analytics_rollup_rebuild') as stream:
+        stream.itersize = 10000
+        stream.execute('''
+            SELECT DISTINCT visited_at::date, COALESCE(visitor_ip, 'unknown')
+            FROM analytics WHERE visited_at >= %s AND ua_device <> %s
+        ''', (start, BOT))
+        for day, visitor_ip in stream:
+            sketches[day].add(visitor_ip)
+
+    with conn.cursor() as cursor:
+        execute_values(
+            cursor,
+            'UPDATE analytics_daily_totals AS t SET visitors = v.visitors FROM (VALUES %s) AS v(day, visitors) WHERE t.day = v.day',
+            [(day, psycopg2.Binary(sketch.to_bytes())) for day, sketch in sketches.items()],
+            template='(%s::date, %s::bytea)'
+        )
+
+        cursor.execute('DELETE FROM analytics_path_totals')
+        cursor.execute('''
+            INSERT INTO analytics_path_totals (page_path, visits)
+            SELECT page_path, SUM(visits) FROM analytics_daily GROUP BY page_path
+        ''')
+
+        # Merging is idempotent, so re-merging rebuilt days into the total is safe
+        total = HyperLogLog()
+        cursor.execute('SELECT visitors FROM analytics_daily_totals WHERE visitors IS NOT NULL')
+        for (data,) in cursor.fetchall():
+            total.merge(HyperLogLog.from_bytes(data))
+        cursor.execute('UPDATE analytics_totals SET visitors = %s WHERE id = 1',
+                       (psycopg2.Binary(total.to_bytes()),))
+
+        cursor.execute(
+            "DELETE FROM analytics_hourly WHERE hour < NOW() - %s * INTERVAL '1 day'",
+            (HOURLY_RETENTION_DAYS,)
+        )
+    conn.commit()
+    # Pairs ingested meanwhile, or older than since, still have to reach the sketches
+    fold_all(conn)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild analytics rollups from the raw analytics table')
+    parser.add_argument('--since', type=date.fromisoformat, help='only rebuild days starting from this date')
+    parser.add_argument('--fold', action='store_true',
+                        help='only fold pending visitor pairs into the sketches (schedule it in sync ingest mode)')
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        if args.fold:
+            print('folded=%d' % fold_all(connection))
+        else:
+            rebuild(connection, args.since)
+    finally:
+        connection.close()
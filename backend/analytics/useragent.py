@@ -0,0 +1,109 @@
+'''
+User-agent classification for the analytics function.
+
+Each visit is stored with three SMALLINT codes (ua_device, ua_os,
+ua_browser, V0020) so breakdowns group on integers instead of re-parsing
+user_agent text. The codes are positions in the tuples below: only ever
+append to them, existing rows keep their numbers.
+
+Visitors send a handful of distinct user-agent strings over and over, so
+classify() is memoized with a bounded LRU cache (ANALYTICS_UA_CACHE_SIZE
+entries) and the regexes run once per distinct string per process.
+'''
+import os
+import re
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+UA_CACHE_SIZE = int(os.environ.get('ANALYTICS_UA_CACHE_SIZE', '4096'))
+# Longer strings are cut before classifying so cache entries stay small
+UA_MAX_LENGTH = 512
+
+DEVICES = ('unknown', 'desktop', 'mobile', 'tablet', 'bot')
+OPERATING_SYSTEMS = ('unknown', 'windows', 'macos', 'ios', 'android', 'linux', 'chromeos')
+BROWSERS = ('other', 'chrome', 'safari', 'firefox', 'edge', 'opera', 'yandex', 'samsung')
+
+UNKNOWN = 0
+BOT = DEVICES.index('bot')
+
+# (device, os, browser) codes
+UAClass = Tuple[int, int, int]
+
+BOT_PATTERN = re.compile(
+    r'(?:bot|crawler|spider)\b|crawl|slurp|mediapartners|facebookexternalhit|preview|headless|phantomjs'
+    r'|lighthouse|pingdom|uptime|monitor|python-requests|python-urllib|aiohttp|curl/|wget|go-http-client'
+    r'|okhttp|java/|axios|node-fetch|scrapy|httpclient',
+    re.IGNORECASE
+)
+
+# First match wins, so more specific patterns go before the ones they contain
+OS_PATTERNS = (
+    (re.compile(r'iPhone|iPad|iPod'), OPERATING_SYSTEMS.index('ios')),
+    (re.compile(r'Android'), OPERATING_SYSTEMS.index('android')),
+    (re.compile(r'Windows'), OPERATING_SYSTEMS.index('windows')),
+    (re.compile(r'CrOS'), OPERATING_SYSTEMS.index('chromeos')),
+    (re.compile(r'Mac OS X|Macintosh'), OPERATING_SYSTEMS.index('macos')),
+    (re.compile(r'Linux|X11'), OPERATING_SYSTEMS.index('linux')),
+)
+# Chromium-based browsers also say "Chrome", and Chrome also says "Safari"
+BROWSER_PATTERNS = (
+    (re.compile(r'Edg(?:e|A|iOS)?/'), BROWSERS.index('edge')),
+    (re.compile(r'OPR/|Opera'), BROWSERS.index('opera')),
+    (re.compile(r'YaBrowser/'), BROWSERS.index('yandex')),
+    (re.compile(r'SamsungBrowser/'), BROWSERS.index('samsung')),
+    (re.compile(r'Firefox/|FxiOS/'), BROWSERS.index('firefox')),
+    (re.compile(r'Chrome/|CriOS/'), BROWSERS.index('chrome')),
+    (re.compile(r'Safari/'), BROWSERS.index('safari')),
+)
+TABLET_PATTERN = re.compile(r'iPad|Tablet|Android(?!.*Mobile)')
+MOBILE_PATTERN = re.compile(r'Mobi|iPhone|iPod|Android')
+
+
+def _first_match(patterns: Tuple[Tuple[re.Pattern, int], ...], user_agent: str) -> int:
+    for pattern, code in patterns:
+        if pattern.search(user_agent):
+            return code
+    return UNKNOWN
+
+
+@lru_cache(maxsize=UA_CACHE_SIZE)
+def _classify(user_agent: str) -> UAClass:
+    os_code = _first_match(OS_PATTERNS, user_agent)
+    browser = _first_match(BROWSER_PATTERNS, user_agent)
+    if BOT_PATTERN.search(user_agent):
+        device = BOT
+    elif TABLET_PATTERN.search(user_agent):
+        device = DEVICES.index('tablet')
+    elif MOBILE_PATTERN.search(user_agent):
+        device = DEVICES.index('mobile')
+    elif os_code != UNKNOWN:
+        device = DEVICES.index('desktop')
+    else:
+        device = UNKNOWN
+    return device, os_code, browser
+
+
+def classify(user_agent: str) -> UAClass:
+    '''(device, os, browser) codes; identity without a user agent is unknown, not a bot'''
+    if not user_agent or user_agent == 'unknown':
+        return UNKNOWN, UNKNOWN, UNKNOWN
+    return _classify(user_agent[:UA_MAX_LENGTH])
+
+
+def cache_info() -> Dict[str, int]:
+    info = _classify.cache_info()
+    return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'max_size': info.maxsize}
+
+
+def label(names: Tuple[str, ...], code: int) -> str:
+    # Codes written by a newer deploy than this one are reported as unknown
+    return names[code] if 0 <= code < len(names) else names[UNKNOWN]
+
+
+def breakdown(names: Tuple[str, ...], counts: Dict[int, int]) -> List[Dict[str, object]]:
+    '''[{name, count}] by count, grouped by code before labelling'''
+    merged: Dict[str, int] = {}
+    for code, count in counts.items():
+        name = label(names, code)
+        merged[name] = merged.get(name, 0) + count
+    return [{'name': name, 'count': count} for name, count in sorted(merged.items(), key=lambda item: -item[1])]
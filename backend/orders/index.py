@@ -1,9 +1,751 @@
+import base64
+import contextvars
+import hashlib
 import json
 import os
+import random
+import re
+import select
+import time
 import psycopg2
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 
+from db import PoolTimeout, get_pool
+from export import EXPORT_FORMATS, export_response, parse_date_range
+from serializer import RowSerializer, dumps, json_object
+from sync import DB_LOCAL_TIME, SYNC_OVERLAP_SECONDS, SyncExpired, changed_rows, deleted_since, parse_updated_since, sync_watermark
+from timing import span, traced
+
+COUNT_MODES = ('exact', 'estimate', 'none')
+
+
+def encode_page_cursor(created_at: str, order_id: int) -> str:
+    '''Непрозрачный cursor страницы: позиция (created_at, id) последней отданной заявки'''
+    raw = json.dumps([created_at, order_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_page_cursor(token: str) -> Tuple[str, int]:
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        created_at, order_id = json.loads(raw)
+        datetime.fromisoformat(created_at)
+        return created_at, int(order_id)
+    except (ValueError, TypeError):
+        raise ValueError('invalid page cursor')
+
+
+def planner_estimate(cursor: Any, where: str, params: List[Any]) -> int:
+    '''Число строк orders под условием where по оценке планировщика — EXPLAIN без выполнения'''
+    cursor.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM orders WHERE {where}", params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_orders(cursor: Any, mode: str, status_filter: Optional[str]) -> Optional[int]:
+    '''
+    exact — COUNT(*); estimate — оценка планировщика (pg_class.reltuples или EXPLAIN),
+    не читает таблицу; none — не считаем вовсе
+    '''
+    has_filter = bool(status_filter and status_filter != 'all')
+    
+    if mode == 'estimate':
+        if has_filter:
+            return planner_estimate(cursor, "status = %s", [status_filter])
+        
+        cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = 'orders'::regclass")
+        estimate = cursor.fetchone()[0]
+        # reltuples = -1, пока таблицу ни разу не анализировали
+        if estimate is not None and estimate >= 0:
+            return int(estimate)
+    
+    elif mode == 'none':
+        return None
+    
+    count_query = "SELECT COUNT(*) FROM orders"
+    count_params = []
+    if has_filter:
+        count_query += " WHERE status = %s"
+        count_params.append(status_filter)
+    
+    cursor.execute(count_query, count_params)
+    return cursor.fetchone()[0]
+
+
+VALID_STATUSES = ('new', 'confirmed', 'in_progress', 'completed', 'cancelled')
+BULK_MAX_IDS = int(os.environ.get('ORDERS_BULK_MAX_IDS', '500'))
+PATCH_RETURNING = 'id, status, estimated_price, admin_notes, cancellation_reason, updated_at'
+
+
+def parse_order_patch(body_data: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+    '''
+    SET-часть UPDATE из тела запроса: status, estimated_price, admin_notes,
+    cancellation_reason. Заметки и причину можно явно обнулить (ключ есть, значение null).
+    ValueError — нечего обновлять или некорректный статус.
+    '''
+    new_status = body_data.get('status')
+    estimated_price = body_data.get('estimated_price')
+    # Проверяем наличие полей в body_data, а не только их значение
+    has_admin_notes = 'admin_notes' in body_data
+    has_cancellation_reason = 'cancellation_reason' in body_data
+    
+    if not new_status and estimated_price is None and not has_admin_notes and not has_cancellation_reason:
+        raise ValueError('Необходимо указать данные для обновления')
+    if new_status and new_status not in VALID_STATUSES:
+        raise ValueError('Некорректный статус')
+    
+    update_fields = []
+    update_params = []
+    if new_status:
+        update_fields.append('status = %s')
+        update_params.append(new_status)
+    if estimated_price is not None:
+        update_fields.append('estimated_price = %s')
+        update_params.append(estimated_price)
+    if has_admin_notes:
+        update_fields.append('admin_notes = %s')
+        update_params.append(body_data.get('admin_notes'))
+    if has_cancellation_reason:
+        update_fields.append('cancellation_reason = %s')
+        update_params.append(body_data.get('cancellation_reason'))
+    update_fields.append('updated_at = CURRENT_TIMESTAMP')
+    return update_fields, update_params
+
+
+def parse_order_ids(raw: Any) -> List[int]:
+    '''Список id из JSON-массива или строки "1,2,3"; дубликаты убираются с сохранением порядка'''
+    if isinstance(raw, str):
+        raw = [part for part in raw.split(',') if part.strip()]
+    if not isinstance(raw, list) or not raw:
+        raise ValueError('Нужен непустой список ids')
+    try:
+        ids = list(dict.fromkeys(int(value) for value in raw))
+    except (TypeError, ValueError):
+        raise ValueError('ids должны быть целыми числами')
+    if len(ids) > BULK_MAX_IDS:
+        raise ValueError(f'Не более {BULK_MAX_IDS} заявок за один запрос')
+    return ids
+
+
+def patched_order(row: Tuple[Any, ...]) -> Dict[str, Any]:
+    return {
+        'id': row[0],
+        'status': row[1],
+        'estimated_price': float(row[2]) if row[2] is not None else None,
+        'admin_notes': row[3],
+        'cancellation_reason': row[4],
+        'updated_at': row[5].isoformat() if row[5] else None
+    }
+
+
+def bulk_update_orders(cursor: Any, patches: List[Tuple[List[int], Dict[str, Any]]]) -> Dict[int, Dict[str, Any]]:
+    '''
+    Применяет патчи [(ids, patch)] в текущей транзакции: одинаковые патчи
+    сливаются в один UPDATE ... WHERE id = ANY(%s). Возвращает обновлённые строки по id.
+    '''
+    groups: Dict[str, Tuple[List[str], List[Any], List[int]]] = {}
+    for ids, patch in patches:
+        update_fields, update_params = parse_order_patch(patch)
+        key = json.dumps([update_fields, update_params], sort_keys=True, default=str)
+        group = groups.setdefault(key, (update_fields, update_params, []))
+        group[2].extend(ids)
+    
+    updated: Dict[int, Dict[str, Any]] = {}
+    for update_fields, update_params, ids in groups.values():
+        cursor.execute(f"""
+            UPDATE orders
+            SET {', '.join(update_fields)}
+            WHERE id = ANY(%s)
+            RETURNING {PATCH_RETURNING}
+        """, update_params + [ids])
+        for row in cursor.fetchall():
+            updated[row[0]] = patched_order(row)
+    return updated
+
+
+ORDER_COLUMNS = """
+    id, client_name, client_phone, client_email, pet_name, pet_type,
+    pet_breed, pet_weight, pet_special_needs, service_type,
+    pickup_address, destination_address, preferred_date, preferred_time,
+    additional_services, comments, estimated_price, status,
+    admin_notes, cancellation_reason,
+    created_at, updated_at
+"""
+SEARCH_MIN_LENGTH = 2
+SEARCH_MAX_LENGTH = 100
+
+
+def escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def build_search(q: str) -> Tuple[str, List[Any], str, List[Any]]:
+    '''
+    (условие WHERE, параметры, выражение ранга, параметры) для поиска по q.
+    Слова ищутся префиксно по search_vector (GIN), подстрока — по адресам и
+    цифрам телефона (триграммы), имя клиента — ещё и с опечатками (similarity).
+    '''
+    words = re.findall(r'\w+', q.lower())
+    ts_query = ' & '.join(f'{word}:*' for word in words)
+    like = f'%{escape_like(q)}%'
+    digits = re.sub(r'\D', '', q)
+    
+    conditions = [
+        "search_vector @@ to_tsquery('simple', %s)",
+        "client_name %% %s",
+        "pickup_address ILIKE %s",
+        "destination_address ILIKE %s",
+    ]
+    params: List[Any] = [ts_query, q, like, like]
+    rank = "ts_rank_cd(search_vector, to_tsquery('simple', %s)) + similarity(client_name, %s)"
+    rank_params: List[Any] = [ts_query, q]
+    
+    if len(digits) >= 3:
+        conditions.append("client_phone_digits LIKE %s")
+        params.append(f'%{digits}%')
+        rank += " + CASE WHEN client_phone_digits LIKE %s THEN 1 ELSE 0 END"
+        rank_params.append(f'%{digits}%')
+    # Номер заявки целиком — самое точное совпадение
+    if q.isdigit() and len(q) <= 9:
+        conditions.append("id = %s")
+        params.append(int(q))
+        rank += " + CASE WHEN id = %s THEN 10 ELSE 0 END"
+        rank_params.append(int(q))
+    
+    return '(' + ' OR '.join(conditions) + ')', params, rank, rank_params
+
+
+def search_response(cursor: Any, q: str, status_filter: Optional[str], limit: int, offset: int,
+                    count_mode: str) -> Dict[str, Any]:
+    '''
+    Ранжированный поиск заявок с пагинацией limit/offset. total считается так
+    же, как для списка: exact — COUNT(*) по условию поиска, estimate — оценка
+    планировщика для того же условия (EXPLAIN, таблица не читается), none — нет
+    '''
+    if len(q) < SEARCH_MIN_LENGTH or len(q) > SEARCH_MAX_LENGTH or not re.search(r'\w', q):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': f'Длина запроса q — от {SEARCH_MIN_LENGTH} до {SEARCH_MAX_LENGTH} символов'})
+        }
+    
+    where, params, rank, rank_params = build_search(q)
+    if status_filter and status_filter != 'all':
+        where += " AND status = %s"
+        params.append(status_filter)
+    
+    total_count = None
+    if count_mode == 'estimate':
+        total_count = planner_estimate(cursor, where, params)
+    elif count_mode == 'exact':
+        cursor.execute(f"SELECT COUNT(*) FROM orders WHERE {where}", params)
+        total_count = cursor.fetchone()[0]
+    
+    cursor.execute(f"""
+        SELECT {ORDER_COLUMNS} FROM orders
+        WHERE {where}
+        ORDER BY {rank} DESC, created_at DESC, id DESC
+        LIMIT %s OFFSET %s
+    """, params + rank_params + [limit + 1, offset])
+    orders = cursor.fetchall()
+    serializer = RowSerializer.from_cursor(cursor)
+    
+    has_more = len(orders) > limit
+    with span('serialize'):
+        response_body = json_object('orders', serializer.to_json(orders[:limit]), {
+            'total': total_count,
+            'count': count_mode,
+            'limit': limit,
+            'offset': offset,
+            'next_cursor': None,
+            'next_offset': offset + limit if has_more else None,
+            'q': q
+        })
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'isBase64Encoded': False,
+        'body': response_body
+    }
+
+
+def export_orders(conn: Any, query_params: Dict[str, Any], export_format: str,
+                  status_filter: Optional[str]) -> Dict[str, Any]:
+    '''?export=csv|ndjson&from=&to=&status=&gzip=true — заявки по created_at в порядке создания'''
+    try:
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError('Параметр export должен быть csv или ndjson')
+        start, end = parse_date_range(query_params)
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': str(e)})
+        }
+    
+    conditions = []
+    params: List[Any] = []
+    if start:
+        conditions.append("created_at >= %s")
+        params.append(start)
+    if end:
+        conditions.append("created_at < %s")
+        params.append(end)
+    if status_filter and status_filter != 'all':
+        conditions.append("status = %s")
+        params.append(status_filter)
+    
+    query = f"SELECT {ORDER_COLUMNS} FROM orders"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY created_at, id"
+    
+    filename = '_'.join(['orders'] + [query_params[k] for k in ('from', 'to') if query_params.get(k)])
+    compress = (query_params.get('gzip') or '').lower() == 'true'
+    return export_response(conn, 'orders_export', query, params, export_format, compress, filename)
+
+
+def sync_orders(conn: Any, cursor: Any, raw_since: str) -> Dict[str, Any]:
+    '''?updated_since= — заявки, изменённые после прошлого опроса, и id удалённых'''
+    try:
+        since = parse_updated_since(raw_since)
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'Некорректный updated_since'})
+        }
+    try:
+        synced_at, deleted = deleted_since(conn, 'orders', since)
+        rows = changed_rows(cursor, 'orders', ORDER_COLUMNS, since)
+    except SyncExpired as e:
+        # Дельту отдать нельзя — клиент перезагружает список целиком
+        return {
+            'statusCode': 410,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': str(e)})
+        }
+    
+    with span('serialize'):
+        response_body = json_object('orders', RowSerializer.from_cursor(cursor).to_json(rows), {
+            'deleted': deleted,
+            'synced_at': synced_at.isoformat()
+        })
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'isBase64Encoded': False,
+        'body': response_body
+    }
+
+CHANGES_CHANNEL = 'orders_changes'
+CHANGES_WAIT_SECONDS = float(os.environ.get('ORDERS_CHANGES_WAIT', '25'))
+CHANGES_MAX_EVENTS = 200
+# Сколько уже отданных событий из окна перекрытия помнит cursor — он передаётся в URL
+CHANGES_MAX_SEEN = 50
+
+# Ключ события ленты: (updated_at, id)
+ChangeKey = Tuple[datetime, int]
+
+
+def change_event(order_id: int, status: Optional[str], created_at: Optional[datetime],
+                 updated_at: datetime) -> Dict[str, Any]:
+    '''Событие ленты — в том же виде, что payload notify_order_change() (V0021)'''
+    return {
+        'op': 'insert' if created_at == updated_at else 'update',
+        'id': order_id,
+        'status': status,
+        'at': updated_at.isoformat(timespec='microseconds')
+    }
+
+
+def encode_changes_cursor(since: datetime, after_id: int, seen: List[ChangeKey]) -> str:
+    '''
+    Непрозрачная позиция ленты: последнее отданное событие (updated_at, id) и
+    события из окна перекрытия до него, которые клиент уже получил
+    '''
+    pairs = [[order_id, at.isoformat(timespec='microseconds')] for at, order_id in seen]
+    raw = json.dumps([since.isoformat(timespec='microseconds'), after_id, pairs], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_changes_cursor(token: str) -> Tuple[datetime, int, set]:
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        since, after_id, seen = json.loads(raw)
+        return (
+            datetime.fromisoformat(since),
+            int(after_id or 0),
+            {(datetime.fromisoformat(at), int(order_id)) for order_id, at in seen}
+        )
+    except (ValueError, TypeError):
+        raise ValueError('invalid changes cursor')
+
+
+def wait_for_changes(conn: Any, timeout: float) -> int:
+    '''
+    Ждёт NOTIFY на соединении с активным LISTEN не дольше timeout секунд и
+    возвращает число пришедших уведомлений; с timeout=0 только забирает уже
+    пришедшие. Уведомление лишь будит опрос — события читаются из orders,
+    поэтому забираются все, сколько бы их ни было
+    '''
+    deadline = time.monotonic() + timeout
+    conn.poll()
+    with span('listen-wait'):
+        while not conn.notifies:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if select.select([conn], [], [], remaining)[0]:
+                conn.poll()
+    received = len(conn.notifies)
+    conn.notifies.clear()
+    return received
+
+
+def changes_page(rows: List[tuple], position: ChangeKey, seen: set,
+                 watermark: datetime) -> Tuple[List[Dict[str, Any]], ChangeKey, List[ChangeKey], bool]:
+    '''
+    Отбирает из строк выборки (по возрастанию (updated_at, id)) ещё не отданные
+    события. Позиция — последнее отданное событие; события, которые после
+    отдачи окажутся в окне перекрытия раньше updated_at позиции, запоминаются
+    в cursor. Страница обрывается на CHANGES_MAX_EVENTS событиях или когда
+    запомнить пришлось бы больше CHANGES_MAX_SEEN: остаток придёт следующим
+    опросом, окно не сокращается.
+    
+    (события, новая позиция, запомненные события, оборвана ли страница)
+    '''
+    window = {key for key in seen if key[0] > watermark}
+    events: List[Dict[str, Any]] = []
+    truncated = False
+    for order_id, status, created_at, updated_at in rows:
+        key = (updated_at, order_id)
+        if key in window:
+            continue
+        next_position = max(position, key)
+        held = window | {key} if updated_at > watermark else window
+        if len(events) == CHANGES_MAX_EVENTS or sum(1 for at, _ in held if at < next_position[0]) > CHANGES_MAX_SEEN:
+            truncated = True
+            break
+        events.append(change_event(order_id, status, created_at, updated_at))
+        position, window = next_position, held
+    # События с updated_at позиции отсекает сама позиция (updated_at, id)
+    return events, position, sorted(key for key in window if key[0] < position[0]), truncated
+
+
+def changes_response(conn: Any, query_params: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    ?view=changes&cursor=|since=&wait= — long-poll ленты изменений заявок:
+    insert и update заявок после позиции cursor (или since — synced_at из
+    dashboard для первого опроса). Сначала LISTEN, затем выборка из orders;
+    если она пуста — ожидание NOTIFY до wait секунд и повторная выборка.
+    Уведомление только будит запрос, поэтому события всегда одни и те же и
+    ни одно не теряется, сколько бы их ни пришло.
+    
+    updated_at — время начала транзакции, поэтому транзакция, закоммиченная
+    после выборки, может добавить строку с updated_at раньше позиции. Выборка
+    поэтому всегда перечитывает последние SYNC_OVERLAP_SECONDS (как synced_at
+    в sync.py), а cursor помнит уже отданные события из этого окна, чтобы не
+    присылать их снова. Если страница оборвана (truncated), cursor указывает
+    на последнее отданное событие и остаток придёт следующим опросом.
+    '''
+    try:
+        seen: set = set()
+        if query_params.get('cursor'):
+            since, after_id, seen = decode_changes_cursor(query_params['cursor'])
+        else:
+            since = parse_updated_since(query_params['since']) if query_params.get('since') else None
+            after_id = 0
+        wait = min(max(float(query_params.get('wait', CHANGES_WAIT_SECONDS)), 0.0), CHANGES_WAIT_SECONDS)
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'Некорректный cursor, since или wait'})
+        }
+    
+    deadline = time.monotonic() + wait
+    # Уведомления приходят только вне транзакции
+    conn.rollback()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as listen_cursor:
+            listen_cursor.execute(f"LISTEN {CHANGES_CHANNEL}")
+            # Всё, что закоммичено после LISTEN, разбудит ожидание; since — в поясе сессии, как updated_at
+            listen_cursor.execute(
+                f"SELECT COALESCE({DB_LOCAL_TIME}, LOCALTIMESTAMP)",
+                [since.isoformat() if since is not None else None]
+            )
+            position: ChangeKey = (listen_cursor.fetchone()[0], after_id)
+            
+            while True:
+                listen_cursor.execute(
+                    "SELECT LOCALTIMESTAMP - make_interval(secs => %s)", [SYNC_OVERLAP_SECONDS]
+                )
+                watermark = listen_cursor.fetchone()[0]
+                listen_cursor.execute("""
+                    SELECT id, status, created_at, updated_at FROM orders
+                    WHERE (updated_at, id) > (%s, %s) OR (updated_at > %s AND updated_at < %s)
+                    ORDER BY updated_at, id
+                    LIMIT %s
+                """, [position[0], position[1], watermark, position[0], CHANGES_MAX_EVENTS + len(seen) + 1])
+                events, position, seen, truncated = changes_page(listen_cursor.fetchall(), position, seen, watermark)
+                
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    break
+                if truncated:
+                    # Окно заполнено: ждём, пока самое старое событие из него выйдет
+                    time.sleep(min(remaining, (seen[0][0] - watermark).total_seconds() + 0.01))
+                elif not wait_for_changes(conn, remaining):
+                    break
+    finally:
+        # Соединение вернётся в пул — подписка не должна пережить запрос
+        if not conn.closed:
+            with conn.cursor() as unlisten_cursor:
+                unlisten_cursor.execute("UNLISTEN *")
+            conn.notifies.clear()
+            conn.autocommit = False
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'isBase64Encoded': False,
+        'body': json.dumps({
+            'events': events,
+            'cursor': encode_changes_cursor(position[0], position[1], seen),
+            'since': position[0].isoformat(),
+            'truncated': truncated
+        })
+    }
+
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# Доля новых ключей, при записи которых заодно удаляем пачку просроченных
+IDEMPOTENCY_PURGE_RATE = float(os.environ.get('IDEMPOTENCY_PURGE_RATE', '0.01'))
+IDEMPOTENCY_PURGE_BATCH = 1000
+
+
+def get_idempotency_key(event: Dict[str, Any]) -> Optional[str]:
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    key = (headers.get('idempotency-key') or '').strip()
+    if not key:
+        return None
+    if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH or not key.isprintable() or not key.isascii():
+        raise ValueError(f'Idempotency-Key должен быть ASCII-строкой до {IDEMPOTENCY_KEY_MAX_LENGTH} символов')
+    return key
+
+
+def request_fingerprint(body_data: Dict[str, Any]) -> str:
+    raw = json.dumps(body_data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def claim_idempotency_key(cursor: Any, key: str, request_hash: str) -> Optional[Tuple[str, Optional[int], Optional[str]]]:
+    '''
+    Занимает ключ в текущей транзакции. None — ключ наш (новый или просроченный),
+    иначе (request_hash, status_code, response_body) уже сохранённого запроса.
+    Одновременный дубль ждёт на уникальном индексе, пока первая транзакция не завершится,
+    и затем видит её сохранённый ответ — явных блокировок не нужно
+    '''
+    cursor.execute("""
+        INSERT INTO idempotency_keys (idempotency_key, request_hash, expires_at)
+        VALUES (%s, %s, CURRENT_TIMESTAMP + make_interval(hours => %s))
+        ON CONFLICT (idempotency_key) DO UPDATE
+        SET request_hash = EXCLUDED.request_hash, status_code = NULL, response_body = NULL,
+            created_at = CURRENT_TIMESTAMP, expires_at = EXCLUDED.expires_at
+        WHERE idempotency_keys.expires_at <= CURRENT_TIMESTAMP
+        RETURNING idempotency_key
+    """, [key, request_hash, IDEMPOTENCY_TTL_HOURS])
+    if cursor.fetchone():
+        if random.random() < IDEMPOTENCY_PURGE_RATE:
+            cursor.execute("""
+                DELETE FROM idempotency_keys WHERE idempotency_key IN (
+                    SELECT idempotency_key FROM idempotency_keys
+                    WHERE expires_at <= CURRENT_TIMESTAMP LIMIT %s
+                )
+            """, [IDEMPOTENCY_PURGE_BATCH])
+        return None
+
+    cursor.execute(
+        "SELECT request_hash, status_code, response_body FROM idempotency_keys WHERE idempotency_key = %s",
+        [key]
+    )
+    return cursor.fetchone()
+
+
+def replay_idempotent(stored: Tuple[str, Optional[int], Optional[str]], request_hash: str) -> Dict[str, Any]:
+    stored_hash, status_code, response_body = stored
+    if stored_hash != request_hash:
+        return {
+            'statusCode': 422,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'Idempotency-Key уже использован с другими данными заявки'})
+        }
+    if status_code is None:
+        return {
+            'statusCode': 409,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'Заявка с этим Idempotency-Key ещё обрабатывается'})
+        }
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'Idempotent-Replayed',
+            'Idempotent-Replayed': 'true'
+        },
+        'isBase64Encoded': False,
+        'body': response_body
+    }
+
+
+DASHBOARD_PASSENGERS_LIMIT = int(os.environ.get('DASHBOARD_PASSENGERS_LIMIT', '200'))
+REVIEW_COLUMNS = """
+    id, client_name, client_email, client_phone, rating, title, content,
+    service_type, trip_date, is_published, is_featured, moderator_notes,
+    admin_reply, reply_author, replied_at,
+    created_at, published_at, updated_at
+"""
+
+# Секции дашборда выполняются в отдельных потоках на соединениях из того же пула
+_dashboard_executor: Optional[ThreadPoolExecutor] = None
+
+
+def first_page(cursor: Any, query: str, limit: int) -> Tuple[str, Optional[str]]:
+    '''(JSON-массив первых limit строк, cursor следующей страницы) для запроса с ORDER BY created_at DESC, id DESC'''
+    cursor.execute(query + " LIMIT %s", [limit + 1])
+    rows = cursor.fetchall()
+    serializer = RowSerializer.from_cursor(cursor)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        # Формат cursor у галереи тот же, что у заявок: (created_at, id)
+        next_cursor = encode_page_cursor(last[serializer.columns.index('created_at')].isoformat(),
+                                         last[serializer.columns.index('id')])
+    with span('serialize'):
+        return serializer.to_json(rows), next_cursor
+
+
+def dashboard_orders(cursor: Any, limit: int) -> str:
+    items, next_cursor = first_page(
+        cursor, f"SELECT {ORDER_COLUMNS} FROM orders ORDER BY created_at DESC, id DESC", limit)
+    cursor.execute("SELECT COALESCE(status, 'new'), COUNT(*) FROM orders GROUP BY 1")
+    by_status = dict(cursor.fetchall())
+    return json_object('items', items, {
+        'total': sum(by_status.values()),
+        'by_status': by_status,
+        'next_cursor': next_cursor
+    })
+
+
+def dashboard_reviews(cursor: Any, limit: int) -> str:
+    # Отзывы листаются через offset, поэтому next_cursor им не нужен
+    items, _ = first_page(
+        cursor, f"SELECT {REVIEW_COLUMNS} FROM reviews ORDER BY created_at DESC, id DESC", limit)
+    cursor.execute("""
+        SELECT COUNT(*),
+               COUNT(*) FILTER (WHERE NOT is_published),
+               COUNT(*) FILTER (WHERE is_featured)
+        FROM reviews
+    """)
+    total, unpublished, featured = cursor.fetchone()
+    return json_object('items', items, {
+        'total': total,
+        'unpublished': unpublished,
+        'featured': featured
+    })
+
+
+def dashboard_passengers(cursor: Any, limit: int) -> str:
+    # Галерея в админке показывается целиком, поэтому страница крупнее; остальное — по next_cursor
+    items, next_cursor = first_page(cursor, """
+        SELECT id, pet_name, pet_type, photo_url, COALESCE(thumbnail_url, photo_url) AS thumbnail_url,
+               description, is_published, created_at
+        FROM passengers_gallery
+        ORDER BY created_at DESC, id DESC
+    """, max(limit, DASHBOARD_PASSENGERS_LIMIT))
+    cursor.execute("SELECT COUNT(*), COUNT(*) FILTER (WHERE NOT is_published) FROM passengers_gallery")
+    total, unpublished = cursor.fetchone()
+    return json_object('items', items, {
+        'total': total,
+        'unpublished': unpublished,
+        'next_cursor': next_cursor
+    })
+
+
+DASHBOARD_SECTIONS = (
+    ('orders', dashboard_orders),
+    ('reviews', dashboard_reviews),
+    ('passengers', dashboard_passengers),
+)
+
+
+def run_pooled(pool: Any, conn: Any, section: Any, limit: int) -> str:
+    try:
+        with conn.cursor() as cursor:
+            return section(cursor, limit)
+    finally:
+        conn.rollback()
+        pool.putconn(conn)
+
+
+def dashboard_response(pool: Any, cursor: Any, limit: int) -> Dict[str, Any]:
+    '''
+    ?view=dashboard — первая страница заявок, отзывов и галереи плюс счётчики
+    за один запрос к функции. Первая секция считается на соединении обработчика,
+    остальные параллельно на соединениях из пула. Соединение для секции берётся
+    без ожидания: если свободного нет, секция сразу считается последовательно
+    на соединении обработчика, а не ждёт DB_POOL_TIMEOUT.
+    '''
+    global _dashboard_executor
+    if _dashboard_executor is None:
+        _dashboard_executor = ThreadPoolExecutor(max_workers=len(DASHBOARD_SECTIONS) - 1,
+                                                 thread_name_prefix='dashboard')
+    
+    # Отметка для последующих ?updated_since= берётся до чтения секций
+    synced_at = sync_watermark(cursor.connection)
+    
+    # copy_context — чтобы спаны потоков попадали в трассировку этого вызова
+    futures = []
+    for name, section in DASHBOARD_SECTIONS[1:]:
+        try:
+            conn = pool.getconn(timeout=0)
+        except PoolTimeout:
+            futures.append((name, section, None))
+            continue
+        futures.append((name, section, _dashboard_executor.submit(
+            contextvars.copy_context().run, run_pooled, pool, conn, section, limit
+        )))
+    name, section = DASHBOARD_SECTIONS[0]
+    parts = [(name, section(cursor, limit))]
+    for name, section, future in futures:
+        parts.append((name, future.result() if future is not None else section(cursor, limit)))
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'isBase64Encoded': False,
+        'body': '{' + ','.join(f'{dumps(name)}:{part}' for name, part in parts)
+                + f',"synced_at":{dumps(synced_at.isoformat())}}}'
+    }
+
+
+@traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: API для управления заявками клиентов зоотакси
@@ -20,7 +762,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id, Idempotency-Key',
                 'Access-Control-Max-Age': '86400'
             },
             'isBase64Encoded': False,
@@ -38,8 +780,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     try:
-        # Подключение к базе данных
-        conn = psycopg2.connect(database_url)
+        # Берём соединение из пула, который живёт между тёплыми вызовами функции
+        pool = get_pool()
+        conn = pool.getconn()
         cursor = conn.cursor()
         
         if method == 'GET':
@@ -48,71 +791,108 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             status_filter = query_params.get('status')
             limit = int(query_params.get('limit', 50))
             offset = int(query_params.get('offset', 0))
+            page_cursor = query_params.get('cursor')
+            
+            # Админка: заявки, отзывы и галерея со счётчиками одним запросом
+            if query_params.get('view') == 'dashboard':
+                return dashboard_response(pool, cursor, limit)
+            
+            # Лента новых заявок и смен статуса для диспетчеров (long-poll)
+            if query_params.get('view') == 'changes':
+                return changes_response(conn, query_params)
+            
+            # Дельта для админки: только изменения с прошлого опроса
+            if query_params.get('updated_since'):
+                return sync_orders(conn, cursor, query_params['updated_since'])
+            
+            # Выгрузка для бухгалтерии: все заявки за период потоком, без пагинации
+            export_format = query_params.get('export')
+            if export_format:
+                return export_orders(conn, query_params, export_format, status_filter)
+            
+            # Без cursor по умолчанию считаем точно (как раньше), при прокрутке по cursor — не считаем
+            count_mode = query_params.get('count') or ('none' if page_cursor else 'exact')
+            
+            if count_mode not in COUNT_MODES:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({'error': 'Параметр count должен быть exact, estimate или none'})
+                }
+            
+            seek_after = None
+            if page_cursor:
+                try:
+                    seek_after = decode_page_cursor(page_cursor)
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'isBase64Encoded': False,
+                        'body': json.dumps({'error': 'Некорректный cursor'})
+                    }
+            
+            search_query = (query_params.get('q') or '').strip()
+            if search_query:
+                return search_response(cursor, search_query, status_filter, limit, offset,
+                                       query_params.get('count') or 'none')
             
             # Базовый запрос
-            query = """
-                SELECT id, client_name, client_phone, client_email, pet_name, pet_type, 
-                       pet_breed, pet_weight, pet_special_needs, service_type, 
-                       pickup_address, destination_address, preferred_date, preferred_time,
-                       additional_services, comments, estimated_price, status,
-                       admin_notes, cancellation_reason,
-                       created_at, updated_at
-                FROM orders
-            """
+            query = f"SELECT {ORDER_COLUMNS} FROM orders"
             params = []
+            conditions = []
             
             # Добавляем фильтр по статусу
             if status_filter and status_filter != 'all':
-                query += " WHERE status = %s"
+                conditions.append("status = %s")
                 params.append(status_filter)
             
-            # Сортировка и пагинация
-            query += " ORDER BY created_at DESC LIMIT %s OFFSET %s"
-            params.extend([limit, offset])
+            # Keyset: продолжаем строго после последней строки предыдущей страницы.
+            # Условие created_at <= %s позволяет искать по idx_orders_created_at без фильтра по всей таблице
+            if seek_after:
+                conditions.append("created_at <= %s AND (created_at, id) < (%s, %s)")
+                params.extend([seek_after[0], seek_after[0], seek_after[1]])
+            
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            
+            # Сортировка и пагинация; лишняя строка показывает, есть ли следующая страница
+            query += " ORDER BY created_at DESC, id DESC LIMIT %s"
+            params.append(limit + 1)
+            if not seek_after and offset:
+                query += " OFFSET %s"
+                params.append(offset)
             
             cursor.execute(query, params)
             orders = cursor.fetchall()
+            serializer = RowSerializer.from_cursor(cursor)
             
-            # Преобразуем результат в список словарей
-            columns = [desc[0] for desc in cursor.description]
-            orders_list = []
-            for order in orders:
-                order_dict = dict(zip(columns, order))
-                # Преобразуем datetime объекты в строки
-                if order_dict['created_at']:
-                    order_dict['created_at'] = order_dict['created_at'].isoformat()
-                if order_dict['updated_at']:
-                    order_dict['updated_at'] = order_dict['updated_at'].isoformat()
-                if order_dict['preferred_date']:
-                    order_dict['preferred_date'] = order_dict['preferred_date'].strftime('%Y-%m-%d')
-                if order_dict['preferred_time']:
-                    order_dict['preferred_time'] = str(order_dict['preferred_time'])
-                if order_dict['pet_weight']:
-                    order_dict['pet_weight'] = float(order_dict['pet_weight'])
-                if order_dict['estimated_price']:
-                    order_dict['estimated_price'] = float(order_dict['estimated_price'])
-                orders_list.append(order_dict)
-            
-            # Получаем общее количество заявок для пагинации
-            count_query = "SELECT COUNT(*) FROM orders"
-            count_params = []
-            if status_filter and status_filter != 'all':
-                count_query += " WHERE status = %s"
-                count_params.append(status_filter)
+            next_cursor = None
+            if len(orders) > limit:
+                orders = orders[:limit]
+                last = orders[-1]
+                created_at = last[serializer.columns.index('created_at')]
+                next_cursor = encode_page_cursor(created_at.isoformat(), last[serializer.columns.index('id')])
             
-            cursor.execute(count_query, count_params)
-            total_count = cursor.fetchone()[0]
+            # Общее количество заявок — только если клиент его запросил
+            total_count = count_orders(cursor, count_mode, status_filter)
+            
+            # Строки сериализуются сразу в JSON конвертерами по типам колонок
+            with span('serialize'):
+                response_body = json_object('orders', serializer.to_json(orders), {
+                    'total': total_count,
+                    'count': count_mode,
+                    'limit': limit,
+                    'offset': offset,
+                    'next_cursor': next_cursor
+                })
             
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'isBase64Encoded': False,
-                'body': json.dumps({
-                    'orders': orders_list,
-                    'total': total_count,
-                    'limit': limit,
-                    'offset': offset
-                })
+                'body': response_body
             }
         
         elif method == 'POST':
@@ -132,6 +912,23 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': f'Поле {field} обязательно для заполнения'})
                     }
             
+            # Повтор запроса с тем же Idempotency-Key возвращает сохранённый ответ, не трогая orders
+            try:
+                idempotency_key = get_idempotency_key(event)
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({'error': str(e)})
+                }
+            if idempotency_key:
+                request_hash = request_fingerprint(body_data)
+                stored = claim_idempotency_key(cursor, idempotency_key, request_hash)
+                if stored is not None:
+                    conn.rollback()
+                    return replay_idempotent(stored, request_hash)
+            
             # Вставка новой заявки
             insert_query = """
                 INSERT INTO orders (
@@ -165,32 +962,79 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             ])
             
             new_order_id = cursor.fetchone()[0]
+            response_body = json.dumps({
+                'id': new_order_id,
+                'message': 'Заявка успешно создана',
+                'status': 'new'
+            })
+            
+            # Ответ сохраняется в той же транзакции, что и заявка: либо есть оба, либо ничего
+            if idempotency_key:
+                cursor.execute(
+                    "UPDATE idempotency_keys SET status_code = %s, response_body = %s WHERE idempotency_key = %s",
+                    [201, response_body, idempotency_key]
+                )
             conn.commit()
             
             return {
                 'statusCode': 201,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'isBase64Encoded': False,
-                'body': json.dumps({
-                    'id': new_order_id,
-                    'message': 'Заявка успешно создана',
-                    'status': 'new'
-                })
+                'body': response_body
             }
         
         elif method == 'PUT':
             # Обновление заявки (статус и/или цена)
             body_data = json.loads(event.get('body', '{}'))
-            order_id = body_data.get('id')
-            new_status = body_data.get('status')
-            estimated_price = body_data.get('estimated_price')
+            if not isinstance(body_data, dict):
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({'error': 'Тело запроса должно быть объектом'})
+                }
             
-            # Проверяем наличие полей в body_data, а не только их значение
-            has_admin_notes = 'admin_notes' in body_data
-            has_cancellation_reason = 'cancellation_reason' in body_data
-            admin_notes = body_data.get('admin_notes') if has_admin_notes else None
-            cancellation_reason = body_data.get('cancellation_reason') if has_cancellation_reason else None
+            # Пакетное обновление: {"ids": [...], ...поля} или {"updates": [{"id": ..., ...поля}]}
+            if 'ids' in body_data or 'updates' in body_data:
+                try:
+                    if 'updates' in body_data:
+                        updates = body_data['updates']
+                        if not isinstance(updates, list) or not updates:
+                            raise ValueError('updates должен быть непустым списком')
+                        patches = [(parse_order_ids([item.get('id')]), item) for item in updates]
+                        requested = parse_order_ids([ids[0] for ids, _ in patches])
+                    else:
+                        requested = parse_order_ids(body_data['ids'])
+                        patch = {k: v for k, v in body_data.items() if k != 'ids'}
+                        patches = [(requested, patch)]
+                    updated = bulk_update_orders(cursor, patches)
+                except (ValueError, AttributeError) as e:
+                    conn.rollback()
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'isBase64Encoded': False,
+                        'body': json.dumps({'error': str(e) if isinstance(e, ValueError) else 'Некорректный элемент updates'})
+                    }
+                conn.commit()
+                
+                results = [
+                    {'id': order_id, 'result': 'updated', 'order': updated[order_id]} if order_id in updated
+                    else {'id': order_id, 'result': 'not_found'}
+                    for order_id in requested
+                ]
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({
+                        'results': results,
+                        'updated': len(updated),
+                        'not_found': len(requested) - len(updated)
+                    })
+                }
             
+            order_id = body_data.get('id')
             if not order_id:
                 return {
                     'statusCode': 400,
@@ -199,47 +1043,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'ID заявки обязателен'})
                 }
             
-            # Проверяем, что есть хотя бы одно поле для обновления
-            if not new_status and estimated_price is None and not has_admin_notes and not has_cancellation_reason:
+            try:
+                update_fields, update_params = parse_order_patch(body_data)
+            except ValueError as e:
                 return {
                     'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                     'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'Необходимо указать данные для обновления'})
+                    'body': json.dumps({'error': str(e)})
                 }
-            
-            # Проверяем валидность статуса, если он указан
-            if new_status:
-                valid_statuses = ['new', 'confirmed', 'in_progress', 'completed', 'cancelled']
-                if new_status not in valid_statuses:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'isBase64Encoded': False,
-                        'body': json.dumps({'error': 'Некорректный статус'})
-                    }
-            
-            # Формируем динамический запрос обновления
-            update_fields = []
-            update_params = []
-            
-            if new_status:
-                update_fields.append('status = %s')
-                update_params.append(new_status)
-            
-            if estimated_price is not None:
-                update_fields.append('estimated_price = %s')
-                update_params.append(estimated_price)
-            
-            if has_admin_notes:
-                update_fields.append('admin_notes = %s')
-                update_params.append(admin_notes)
-            
-            if has_cancellation_reason:
-                update_fields.append('cancellation_reason = %s')
-                update_params.append(cancellation_reason)
-            
-            update_fields.append('updated_at = CURRENT_TIMESTAMP')
             update_params.append(order_id)
             
             update_query = f"""
@@ -281,6 +1093,50 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             query_params = event.get('queryStringParameters') or {}
             order_id = query_params.get('id')
             
+            # Пакетное удаление: ?ids=1,2,3 или тело {"ids": [...]}
+            raw_ids = query_params.get('ids')
+            if raw_ids is None and event.get('body'):
+                try:
+                    body_data = json.loads(event['body'])
+                except ValueError:
+                    body_data = None
+                if not isinstance(body_data, dict):
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'isBase64Encoded': False,
+                        'body': json.dumps({'error': 'Тело запроса должно быть объектом {"ids": [...]}'})
+                    }
+                raw_ids = body_data.get('ids')
+            if raw_ids is not None:
+                try:
+                    requested = parse_order_ids(raw_ids)
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'isBase64Encoded': False,
+                        'body': json.dumps({'error': str(e)})
+                    }
+                
+                cursor.execute("DELETE FROM orders WHERE id = ANY(%s) RETURNING id", [requested])
+                deleted = {row[0] for row in cursor.fetchall()}
+                conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({
+                        'results': [
+                            {'id': order_id, 'result': 'deleted' if order_id in deleted else 'not_found'}
+                            for order_id in requested
+                        ],
+                        'deleted': len(deleted),
+                        'not_found': len(requested) - len(deleted)
+                    })
+                }
+            
             if not order_id:
                 return {
                     'statusCode': 400,
@@ -350,4 +1206,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if 'cursor' in locals():
             cursor.close()
         if 'conn' in locals():
-            conn.close()
\ No newline at end of file
+            pool.putconn(conn)
\ No newline at end of file
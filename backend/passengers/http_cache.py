@@ -0,0 +1,75 @@
+'''
+HTTP caching helpers for public read endpoints.
+
+The version token comes from table_versions, a row per table that a
+statement-level trigger bumps on every INSERT/UPDATE/DELETE, so checking
+freshness is a single primary-key lookup. This module is copied into every
+function that serves cacheable reads; keep the copies identical.
+'''
+import json
+import os
+import zlib
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from typing import Any, Dict, Optional, Tuple
+
+MAX_AGE = int(os.environ.get('PUBLIC_CACHE_MAX_AGE', '60'))
+STALE_WHILE_REVALIDATE = int(os.environ.get('PUBLIC_CACHE_SWR', '600'))
+
+
+def table_version(cursor: Any, table: str) -> Tuple[int, Optional[datetime]]:
+    cursor.execute('SELECT version, changed_at FROM table_versions WHERE table_name = %s', (table,))
+    row = cursor.fetchone()
+    if row is None:
+        return 0, None
+    if isinstance(row, dict):
+        return row['version'], row['changed_at']
+    return row[0], row[1]
+
+
+def make_etag(table: str, version: int, params: Dict[str, Any], context: Any = None) -> str:
+    '''
+    Weak ETag over the table version, the query parameters and the deployed
+    function version (a new deploy may change the response shape).
+    '''
+    function_version = getattr(context, 'function_version', '') or ''
+    key = json.dumps([sorted((params or {}).items()), function_version], ensure_ascii=False)
+    return f'W/"{table}-{version}-{zlib.crc32(key.encode("utf-8")):08x}"'
+
+
+def not_modified(event: Dict[str, Any], etag: str) -> bool:
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    if_none_match = headers.get('if-none-match')
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # Weak comparison (RFC 9110): the W/ prefix is ignored
+    wanted = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith('W/') else candidate) == wanted:
+            return True
+    return False
+
+
+def cache_headers(etag: str, last_modified: Optional[datetime]) -> Dict[str, str]:
+    headers = {
+        'ETag': etag,
+        'Cache-Control': f'public, max-age={MAX_AGE}, stale-while-revalidate={STALE_WHILE_REVALIDATE}',
+        'Access-Control-Expose-Headers': 'ETag, Last-Modified, X-Cache'
+    }
+    if last_modified is not None:
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        headers['Last-Modified'] = format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+
+def not_modified_response(headers: Dict[str, str]) -> Dict[str, Any]:
+    return {
+        'statusCode': 304,
+        'headers': {**headers, 'Access-Control-Allow-Origin': '*'},
+        'isBase64Encoded': False,
+        'body': ''
+    }
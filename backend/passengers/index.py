@@ -1,9 +1,108 @@
+import base64
 import json
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
 
+from cache import response_cache
+from db import get_pool
+from http_cache import cache_headers, make_etag, not_modified, not_modified_response, table_version
+from sync import SyncExpired, changed_rows, deleted_since, parse_updated_since
+from timing import TimedRealDictCursor, span, traced
+
+DEFAULT_PAGE_SIZE = int(os.environ.get('PASSENGERS_PAGE_SIZE', '50'))
+MAX_PAGE_SIZE = int(os.environ.get('PASSENGERS_MAX_PAGE_SIZE', '200'))
+
+# Columns a client may ask for with ?fields=; id is always returned
+GALLERY_FIELDS = ('id', 'pet_name', 'pet_type', 'photo_url', 'thumbnail_url', 'description', 'is_published', 'created_at')
+
+
+def encode_page_cursor(created_at: str, passenger_id: int) -> str:
+    '''Opaque page cursor: the (created_at, id) position of the last returned row'''
+    raw = json.dumps([created_at, passenger_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_page_cursor(token: str) -> Tuple[str, int]:
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        created_at, passenger_id = json.loads(raw)
+        datetime.fromisoformat(created_at)
+        return created_at, int(passenger_id)
+    except (ValueError, TypeError):
+        raise ValueError('invalid page cursor')
+
+
+def parse_fields(raw: Optional[str]) -> List[str]:
+    '''?fields=pet_name,thumbnail_url -> requested columns in canonical order; raises ValueError on unknown ones'''
+    if not raw:
+        return list(GALLERY_FIELDS)
+    requested = {name.strip() for name in raw.split(',') if name.strip()}
+    unknown = requested.difference(GALLERY_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+    requested.add('id')
+    return [name for name in GALLERY_FIELDS if name in requested]
+
+
+def parse_page_size(raw: Optional[str]) -> int:
+    if raw is None or raw == '':
+        return min(DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    size = int(raw)
+    if size < 1:
+        raise ValueError('limit must be positive')
+    return min(size, MAX_PAGE_SIZE)
+
+
+def serialize_passenger(p: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    item = {}
+    for name in fields:
+        if name == 'thumbnail_url':
+            item[name] = p['thumbnail_url'] or p['photo_url']
+        elif name == 'created_at':
+            item[name] = p['created_at'].isoformat() if p['created_at'] else None
+        else:
+            item[name] = p[name]
+    return item
+
+
+def sync_passengers(conn: Any, cur: Any, raw_since: str) -> Dict[str, Any]:
+    '''?updated_since=: rows changed after the previous poll plus ids deleted since then'''
+    try:
+        since = parse_updated_since(raw_since)
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'invalid updated_since'})
+        }
+    try:
+        synced_at, deleted = deleted_since(conn, 'passengers_gallery', since)
+        rows = changed_rows(cur, 'passengers_gallery', ', '.join(GALLERY_FIELDS), since)
+    except SyncExpired as e:
+        # No delta possible: the client reloads the whole list
+        return {
+            'statusCode': 410,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': str(e)})
+        }
+    
+    with span('serialize'):
+        response_body = json.dumps({
+            'passengers': [serialize_passenger(p, list(GALLERY_FIELDS)) for p in rows],
+            'deleted': deleted,
+            'synced_at': synced_at.isoformat()
+        })
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'isBase64Encoded': False,
+        'body': response_body
+    }
+
+@traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Управление галереей фото пассажиров (питомцев)
@@ -18,7 +117,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -33,48 +132,104 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     try:
-        conn = psycopg2.connect(dsn)
-        cur = conn.cursor(cursor_factory=RealDictCursor)
+        pool = get_pool()
+        conn = pool.getconn()
+        cur = conn.cursor(cursor_factory=TimedRealDictCursor)
         
         if method == 'GET':
             params = event.get('queryStringParameters') or {}
             published_only = params.get('published', 'false').lower() == 'true'
             
+            if params.get('cache_stats', 'false').lower() == 'true':
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps(response_cache.stats())
+                }
+            
+            try:
+                fields = parse_fields(params.get('fields'))
+                page_size = parse_page_size(params.get('limit'))
+                if params.get('cursor'):
+                    decode_page_cursor(params['cursor'])
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({'error': str(e)})
+                }
+            
+            # Admin delta poll: only what changed since the previous one
+            if params.get('updated_since'):
+                return sync_passengers(conn, cur, params['updated_since'])
+            
+            # Public gallery is cacheable by browsers and the CDN until an admin changes something
+            public_cache = {}
             if published_only:
-                cur.execute('''
-                    SELECT id, pet_name, pet_type, photo_url, description, is_published, created_at
-                    FROM passengers_gallery
-                    WHERE is_published = true
-                    ORDER BY created_at DESC
-                ''')
-            else:
-                cur.execute('''
-                    SELECT id, pet_name, pet_type, photo_url, description, is_published, created_at
-                    FROM passengers_gallery
-                    ORDER BY created_at DESC
-                ''')
+                version, changed_at = table_version(cur, 'passengers_gallery')
+                etag = make_etag('passengers_gallery', version, params, context)
+                public_cache = cache_headers(etag, changed_at)
+                if not_modified(event, etag):
+                    return not_modified_response(public_cache)
+                
+                # Serialized body from this instance's memory, valid while the version is unchanged
+                cache_key = response_cache.key(params)
+                cached = response_cache.get(cache_key, version)
+                if cached is not None:
+                    cached_body, page_headers = cached
+                    return {
+                        'statusCode': 200,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*',
+                                    **public_cache, **page_headers, 'X-Cache': 'HIT'},
+                        'isBase64Encoded': False,
+                        'body': cached_body
+                    }
+            
+            where = ['is_published = true'] if published_only else []
+            query_params: List[Any] = []
+            page_cursor = params.get('cursor')
+            if page_cursor:
+                # Keyset seek: the leading created_at bound lets the index range scan start at the cursor
+                created_at, last_id = decode_page_cursor(page_cursor)
+                where.append('created_at <= %s AND (created_at, id) < (%s, %s)')
+                query_params.extend([created_at, created_at, last_id])
+            
+            # created_at is always read for the next cursor; thumbnail_url falls back to photo_url
+            columns = set(fields) | {'created_at'}
+            if 'thumbnail_url' in columns:
+                columns.add('photo_url')
+            select_list = ', '.join(name for name in GALLERY_FIELDS if name in columns)
+            
+            query = f'SELECT {select_list} FROM passengers_gallery'
+            if where:
+                query += ' WHERE ' + ' AND '.join(where)
+            query += ' ORDER BY created_at DESC, id DESC LIMIT %s'
+            query_params.append(page_size + 1)
+            cur.execute(query, query_params)
             
             passengers = cur.fetchall()
-            result = []
-            for p in passengers:
-                result.append({
-                    'id': p['id'],
-                    'pet_name': p['pet_name'],
-                    'pet_type': p['pet_type'],
-                    'photo_url': p['photo_url'],
-                    'description': p['description'],
-                    'is_published': p['is_published'],
-                    'created_at': p['created_at'].isoformat() if p['created_at'] else None
-                })
+            # The body stays a plain array; the next page is advertised in a header
+            page_headers = {'Access-Control-Expose-Headers': 'ETag, Last-Modified, X-Cache, X-Next-Cursor'}
+            if len(passengers) > page_size:
+                passengers = passengers[:page_size]
+                last = passengers[-1]
+                page_headers['X-Next-Cursor'] = encode_page_cursor(last['created_at'].isoformat(), last['id'])
             
-            cur.close()
-            conn.close()
+            with span('serialize'):
+                response_body = json.dumps([serialize_passenger(p, fields) for p in passengers])
+            
+            if published_only:
+                response_cache.put(cache_key, version, response_body, page_headers)
+                public_cache['X-Cache'] = 'MISS'
             
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*',
+                            **public_cache, **page_headers},
                 'isBase64Encoded': False,
-                'body': json.dumps(result)
+                'body': response_body
             }
         
         elif method == 'POST':
@@ -83,12 +238,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             pet_name = body_data.get('pet_name', '')
             pet_type = body_data.get('pet_type', '')
             photo_url = body_data.get('photo_url', '')
+            thumbnail_url = body_data.get('thumbnail_url')
             description = body_data.get('description', '')
             is_published = body_data.get('is_published', False)
             
             if not photo_url:
-                cur.close()
-                conn.close()
                 return {
                     'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -96,15 +250,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             cur.execute('''
-                INSERT INTO passengers_gallery (pet_name, pet_type, photo_url, description, is_published)
-                VALUES (%s, %s, %s, %s, %s)
+                INSERT INTO passengers_gallery (pet_name, pet_type, photo_url, thumbnail_url, description, is_published)
+                VALUES (%s, %s, %s, %s, %s, %s)
                 RETURNING id
-            ''', (pet_name, pet_type, photo_url, description, is_published))
+            ''', (pet_name, pet_type, photo_url, thumbnail_url, description, is_published))
             
             new_id = cur.fetchone()['id']
             conn.commit()
-            cur.close()
-            conn.close()
+            response_cache.invalidate()
             
             return {
                 'statusCode': 201,
@@ -118,8 +271,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             passenger_id = params.get('id')
             
             if not passenger_id:
-                cur.close()
-                conn.close()
                 return {
                     'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -131,6 +282,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             pet_name = body_data.get('pet_name')
             pet_type = body_data.get('pet_type')
             photo_url = body_data.get('photo_url')
+            thumbnail_url = body_data.get('thumbnail_url')
             description = body_data.get('description')
             is_published = body_data.get('is_published')
             
@@ -146,6 +298,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             if photo_url is not None:
                 update_fields.append('photo_url = %s')
                 values.append(photo_url)
+            if thumbnail_url is not None:
+                update_fields.append('thumbnail_url = %s')
+                values.append(thumbnail_url)
+            elif photo_url is not None:
+                # A thumbnail of the previous photo must not outlive it; the gallery falls back to photo_url
+                update_fields.append('thumbnail_url = CASE WHEN photo_url IS DISTINCT FROM %s THEN NULL ELSE thumbnail_url END')
+                values.append(photo_url)
             if description is not None:
                 update_fields.append('description = %s')
                 values.append(description)
@@ -159,9 +318,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             query = f"UPDATE passengers_gallery SET {', '.join(update_fields)} WHERE id = %s"
             cur.execute(query, values)
             conn.commit()
-            
-            cur.close()
-            conn.close()
+            response_cache.invalidate()
             
             return {
                 'statusCode': 200,
@@ -175,8 +332,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             passenger_id = params.get('id')
             
             if not passenger_id:
-                cur.close()
-                conn.close()
                 return {
                     'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -185,9 +340,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             cur.execute('DELETE FROM passengers_gallery WHERE id = %s', (int(passenger_id),))
             conn.commit()
-            
-            cur.close()
-            conn.close()
+            response_cache.invalidate()
             
             return {
                 'statusCode': 200,
@@ -197,8 +350,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
         
         else:
-            cur.close()
-            conn.close()
             return {
                 'statusCode': 405,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -212,3 +363,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False,
             'body': json.dumps({'error': str(e)})
         }
+    
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            pool.putconn(conn)
\ No newline at end of file
@@ -0,0 +1,96 @@
+'''
+In-process read-through cache for serialized public responses.
+
+Entries live for at most CACHE_TTL seconds, are evicted least-recently-used
+once CACHE_MAX_BYTES is exceeded and are tagged with the table_versions
+version they were built from: a write on any instance bumps the version, so
+a stale entry is never served. Writes handled by this instance also clear
+the cache right away. Copied into every function that caches reads.
+'''
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+CACHE_TTL = float(os.environ.get('CACHE_TTL', '300'))
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', str(8 * 1024 * 1024)))
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, ttl: float = CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (version, expires_at, body, headers, size)
+        self._entries: 'OrderedDict[str, Tuple[int, float, str, Dict[str, str], int]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(params: Dict[str, Any]) -> str:
+        return json.dumps(sorted((params or {}).items()), ensure_ascii=False)
+
+    def get(self, key: str, version: int) -> Optional[Tuple[str, Dict[str, str]]]:
+        '''Returns (body, headers) or None; headers are the response-specific ones stored by put()'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry_version, expires_at, body, headers, _ = entry
+            if entry_version != version or expires_at <= time.monotonic():
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body, headers
+
+    def put(self, key: str, version: int, body: str, headers: Optional[Dict[str, str]] = None) -> None:
+        size = len(body.encode('utf-8'))
+        # A single huge response must not evict the whole cache
+        if size > self.max_bytes // 4:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            while self._entries and self._bytes + size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+            self._entries[key] = (version, time.monotonic() + self.ttl, body, dict(headers or {}), size)
+            self._bytes += size
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[4]
+
+
+response_cache = ResponseCache()
@@ -4,6 +4,57 @@ import psycopg2
 from datetime import datetime
 from typing import Dict, Any, List, Optional
 
+from cache import response_cache
+from db import get_pool
+from http_cache import cache_headers, make_etag, not_modified, not_modified_response, table_version
+from serializer import RowSerializer, json_object
+from sync import SyncExpired, changed_rows, deleted_since, parse_updated_since
+from timing import span, traced
+
+REVIEW_COLUMNS = """
+    id, client_name, client_email, client_phone, rating, title, content,
+    service_type, trip_date, is_published, is_featured, moderator_notes,
+    admin_reply, reply_author, replied_at,
+    created_at, published_at, updated_at
+"""
+
+
+def sync_reviews(conn: Any, cursor: Any, raw_since: str) -> Dict[str, Any]:
+    '''?updated_since= — отзывы, изменённые после прошлого опроса, и id удалённых'''
+    try:
+        since = parse_updated_since(raw_since)
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Некорректный updated_since'}),
+            'isBase64Encoded': False
+        }
+    try:
+        synced_at, deleted = deleted_since(conn, 'reviews', since)
+        rows = changed_rows(cursor, 'reviews', REVIEW_COLUMNS, since)
+    except SyncExpired as e:
+        # Дельту отдать нельзя — клиент перезагружает список целиком
+        return {
+            'statusCode': 410,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    
+    with span('serialize'):
+        response_body = json_object('reviews', RowSerializer.from_cursor(cursor).to_json(rows), {
+            'deleted': deleted,
+            'synced_at': synced_at.isoformat()
+        })
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': response_body,
+        'isBase64Encoded': False
+    }
+
+@traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: API для управления отзывами клиентов зоотакси
@@ -20,7 +71,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -38,8 +89,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     try:
-        # Подключение к базе данных
-        conn = psycopg2.connect(database_url)
+        # Берём соединение из пула, который живёт между тёплыми вызовами функции
+        pool = get_pool()
+        conn = pool.getconn()
         cursor = conn.cursor()
         
         if method == 'GET':
@@ -50,14 +102,67 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             offset = int(query_params.get('offset', 0))
             public_only = query_params.get('public_only', 'false').lower() == 'true'
             
+            # Статистика in-process кэша для настройки его размера и TTL
+            if query_params.get('cache_stats', 'false').lower() == 'true':
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps(response_cache.stats()),
+                    'isBase64Encoded': False
+                }
+            
+            # Средняя оценка и распределение по опубликованным отзывам — из сводной строки review_stats
+            if query_params.get('stats', 'false').lower() == 'true':
+                version, changed_at = table_version(cursor, 'reviews')
+                etag = make_etag('reviews', version, query_params, context)
+                stats_cache = cache_headers(etag, changed_at)
+                if not_modified(event, etag):
+                    return not_modified_response(stats_cache)
+                
+                cursor.execute("""
+                    SELECT published_count, rating_sum, rating_1, rating_2, rating_3, rating_4, rating_5
+                    FROM review_stats WHERE id = 1
+                """)
+                row = cursor.fetchone() or (0, 0, 0, 0, 0, 0, 0)
+                published_count, rating_sum = row[0], row[1]
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **stats_cache},
+                    'body': json.dumps({
+                        'count': published_count,
+                        'average': round(rating_sum / published_count, 2) if published_count else None,
+                        'distribution': {str(stars): row[stars + 1] for stars in range(1, 6)}
+                    }),
+                    'isBase64Encoded': False
+                }
+            
+            # Дельта для админки: только изменения с прошлого опроса
+            if query_params.get('updated_since'):
+                return sync_reviews(conn, cursor, query_params['updated_since'])
+            
+            # Публичный список кэшируется браузером и CDN; версия таблицы — один lookup по ключу
+            public_cache = {}
+            if public_only:
+                version, changed_at = table_version(cursor, 'reviews')
+                etag = make_etag('reviews', version, query_params, context)
+                public_cache = cache_headers(etag, changed_at)
+                if not_modified(event, etag):
+                    return not_modified_response(public_cache)
+                
+                # Готовый JSON из памяти этого экземпляра, если таблица с тех пор не менялась
+                cache_key = response_cache.key(query_params)
+                cached = response_cache.get(cache_key, version)
+                if cached is not None:
+                    return {
+                        'statusCode': 200,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*',
+                                    **public_cache, 'X-Cache': 'HIT'},
+                        'body': cached[0],
+                        'isBase64Encoded': False
+                    }
+            
             # Базовый запрос
-            query = """
-                SELECT id, client_name, client_email, client_phone, rating, title, content,
-                       service_type, trip_date, is_published, is_featured, moderator_notes,
-                       admin_reply, reply_author, replied_at,
-                       created_at, published_at, updated_at
-                FROM reviews
-            """
+            query = f"SELECT {REVIEW_COLUMNS} FROM reviews"
             params = []
             conditions = []
             
@@ -84,25 +189,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             params.extend([limit, offset])
             
             cursor.execute(query, params)
-            reviews = cursor.fetchall()
-            
-            # Преобразуем результат в список словарей
-            columns = [desc[0] for desc in cursor.description]
-            reviews_list = []
-            for review in reviews:
-                review_dict = dict(zip(columns, review))
-                # Преобразуем datetime объекты в строки
-                if review_dict['created_at']:
-                    review_dict['created_at'] = review_dict['created_at'].isoformat()
-                if review_dict['updated_at']:
-                    review_dict['updated_at'] = review_dict['updated_at'].isoformat()
-                if review_dict['published_at']:
-                    review_dict['published_at'] = review_dict['published_at'].isoformat()
-                if review_dict['replied_at']:
-                    review_dict['replied_at'] = review_dict['replied_at'].isoformat()
-                if review_dict['trip_date']:
-                    review_dict['trip_date'] = review_dict['trip_date'].strftime('%Y-%m-%d')
-                reviews_list.append(review_dict)
+            # Строки сериализуются сразу в JSON конвертерами по типам колонок
+            rows = cursor.fetchall()
+            with span('serialize'):
+                reviews_json = RowSerializer.from_cursor(cursor).to_json(rows)
             
             # Получаем общее количество отзывов для пагинации
             count_query = "SELECT COUNT(*) FROM reviews"
@@ -124,15 +214,19 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             cursor.execute(count_query, count_params)
             total_count = cursor.fetchone()[0]
             
+            response_body = json_object('reviews', reviews_json, {
+                'total': total_count,
+                'limit': limit,
+                'offset': offset
+            })
+            if public_only:
+                response_cache.put(cache_key, version, response_body)
+                public_cache['X-Cache'] = 'MISS'
+            
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'reviews': reviews_list,
-                    'total': total_count,
-                    'limit': limit,
-                    'offset': offset
-                }),
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **public_cache},
+                'body': response_body,
                 'isBase64Encoded': False
             }
         
@@ -188,6 +282,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             new_review_id = cursor.fetchone()[0]
             conn.commit()
+            response_cache.invalidate()
             
             return {
                 'statusCode': 201,
@@ -272,6 +367,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             conn.commit()
+            response_cache.invalidate()
             
             return {
                 'statusCode': 200,
@@ -314,6 +410,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             conn.commit()
+            response_cache.invalidate()
             
             return {
                 'statusCode': 200,
@@ -361,4 +458,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if 'cursor' in locals():
             cursor.close()
         if 'conn' in locals():
-            conn.close()
\ No newline at end of file
+            pool.putconn(conn)
\ No newline at end of file
@@ -0,0 +1,76 @@
+'''
+Delta sync for admin lists: ?updated_since=<synced_at from the previous response>.
+
+A poll returns the rows whose updated_at is newer than updated_since (served
+by the updated_at index) and the ids deleted since then, taken from the
+deleted_rows log that an AFTER DELETE trigger fills. The returned synced_at
+is the database clock minus SYNC_OVERLAP_SECONDS: a transaction that stamped
+updated_at before the poll but committed after it is still picked up by the
+next one, at the cost of re-sending a few rows the client merges by id.
+
+When the answer cannot be a delta (updated_since predates the tombstone
+retention, or more than SYNC_MAX_ROWS rows changed) SyncExpired is raised
+and the client reloads the full list. Copied into every function with a
+synced list; keep the copies identical.
+'''
+import os
+from datetime import datetime
+from typing import Any, List, Tuple
+
+SYNC_OVERLAP_SECONDS = float(os.environ.get('SYNC_OVERLAP_SECONDS', '5'))
+SYNC_MAX_ROWS = int(os.environ.get('SYNC_MAX_ROWS', '500'))
+# Должно совпадать со сроком хранения в log_deleted_row() (V0016)
+TOMBSTONE_RETENTION_DAYS = 30
+# Параметр как TIMESTAMP в поясе сессии, как и updated_at (LOCALTIMESTAMP):
+# значение со смещением переводится в этот пояс, без смещения берётся как есть
+DB_LOCAL_TIME = "(%s::timestamptz AT TIME ZONE current_setting('TimeZone'))"
+
+
+class SyncExpired(Exception):
+    pass
+
+
+def parse_updated_since(raw: str) -> datetime:
+    '''
+    Смещение сохраняется: updated_at хранится как TIMESTAMP без пояса, и в
+    запросах since переводится в пояс сессии через DB_LOCAL_TIME
+    '''
+    return datetime.fromisoformat(raw.replace('Z', '+00:00') if raw.endswith('Z') else raw)
+
+
+def sync_watermark(conn: Any) -> datetime:
+    '''synced_at for a response whose rows are read after this call'''
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT LOCALTIMESTAMP - make_interval(secs => %s)", [SYNC_OVERLAP_SECONDS])
+        return cursor.fetchone()[0]
+
+
+def deleted_since(conn: Any, table: str, since: datetime) -> Tuple[datetime, List[int]]:
+    '''(synced_at, ids deleted from table after since); raises SyncExpired past the retention'''
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT LOCALTIMESTAMP - make_interval(secs => %s),
+                   {DB_LOCAL_TIME} < LOCALTIMESTAMP - make_interval(days => %s)
+        """, [SYNC_OVERLAP_SECONDS, since, TOMBSTONE_RETENTION_DAYS])
+        synced_at, expired = cursor.fetchone()
+        if expired:
+            raise SyncExpired(f'updated_since is older than {TOMBSTONE_RETENTION_DAYS} days; reload the full list')
+        cursor.execute(
+            f"SELECT DISTINCT row_id FROM deleted_rows WHERE table_name = %s AND deleted_at > {DB_LOCAL_TIME} ORDER BY row_id",
+            [table, since]
+        )
+        return synced_at, [row[0] for row in cursor.fetchall()]
+
+
+def changed_rows(cursor: Any, table: str, columns: str, since: datetime) -> List[Any]:
+    '''Rows of table updated after since, oldest change first; raises SyncExpired past SYNC_MAX_ROWS'''
+    cursor.execute(f"""
+        SELECT {columns} FROM {table}
+        WHERE updated_at > {DB_LOCAL_TIME}
+        ORDER BY updated_at, id
+        LIMIT %s
+    """, [since, SYNC_MAX_ROWS + 1])
+    rows = cursor.fetchall()
+    if len(rows) > SYNC_MAX_ROWS:
+        raise SyncExpired(f'more than {SYNC_MAX_ROWS} rows changed; reload the full list')
+    return rows
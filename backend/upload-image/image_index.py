@@ -0,0 +1,145 @@
+'''
+Content-addressed index of stored images (table uploaded_images).
+
+Every upload is keyed by the SHA-256 of its decoded bytes, so a repeated
+upload is answered from the index without storing or re-encoding anything.
+ref_count is maintained by a trigger on passengers_gallery; rows that no
+gallery entry references any more are removed by collect_garbage(), which
+runs from cron rather than from a public endpoint:
+
+    python image_index.py [--grace-hours N]
+'''
+import argparse
+import os
+from typing import Any, Dict, List, Optional
+
+import psycopg2
+from psycopg2.extras import Json
+
+from storage import Storage, get_storage
+from timing import log_event
+
+# 8-bit bands of the 64-bit dHash as stored in uploaded_images.phash_bands (V0024):
+# hashes closer than PHASH_BANDS bits apart share at least one band
+PHASH_BANDS = 8
+PHASH_MAX_DISTANCE = min(int(os.environ.get('PHASH_MAX_DISTANCE', '6')), PHASH_BANDS - 1)
+NEAR_DUPLICATE_CANDIDATES = 500
+GC_GRACE_HOURS = int(os.environ.get('IMAGE_GC_GRACE_HOURS', '24'))
+GC_BATCH = 100
+
+_MASK64 = (1 << 64) - 1
+
+
+def find(cursor: Any, digest: str) -> Optional[Dict[str, Any]]:
+    '''
+    Returns the stored image and marks it used, so collect_garbage() keeps it
+    for another grace period while the client attaches it; the caller commits.
+    '''
+    cursor.execute(
+        '''
+        UPDATE uploaded_images SET last_used_at = CURRENT_TIMESTAMP
+        WHERE sha256 = %s
+        RETURNING url, thumbnail_url, thumbnails, size
+        ''',
+        (digest,)
+    )
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return {'url': row[0], 'thumbnail_url': row[1], 'thumbnails': row[2] or {}, 'size': row[3]}
+
+
+def register(cursor: Any, digest: str, url: str, thumbnail_url: str, thumbnails: Dict[str, str],
+             size: int, content_type: str, phash: Optional[int], object_keys: List[str]) -> None:
+    # A concurrent upload of the same bytes may have inserted an identical row already
+    cursor.execute('''
+        INSERT INTO uploaded_images (sha256, url, thumbnail_url, thumbnails, size, content_type, phash, object_keys)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (sha256) DO UPDATE SET last_used_at = CURRENT_TIMESTAMP
+    ''', (digest, url, thumbnail_url, Json(thumbnails), size, content_type, phash, object_keys))
+
+
+def phash_bands(phash: int) -> List[int]:
+    return [band * 256 + ((phash >> (56 - 8 * band)) & 255) for band in range(PHASH_BANDS)]
+
+
+def near_duplicates(cursor: Any, phash: int, digest: str,
+                    max_distance: int = PHASH_MAX_DISTANCE) -> List[Dict[str, int]]:
+    '''
+    Gallery entries whose photo is perceptually close to the uploaded one.
+    Candidates sharing a dHash band come from the GIN index, at most
+    NEAR_DUPLICATE_CANDIDATES of them, so the cost does not grow with the gallery.
+    '''
+    cursor.execute('''
+        SELECT g.id, i.phash
+        FROM uploaded_images i
+        JOIN passengers_gallery g ON g.photo_url = i.url
+        WHERE i.phash_bands && %s::smallint[] AND i.ref_count > 0 AND i.sha256 <> %s
+        LIMIT %s
+    ''', (phash_bands(phash), digest, NEAR_DUPLICATE_CANDIDATES))
+    matches = []
+    for gallery_id, other in cursor.fetchall():
+        distance = bin((phash ^ other) & _MASK64).count('1')
+        if distance <= max_distance:
+            matches.append({'id': gallery_id, 'distance': distance})
+    return sorted(matches, key=lambda m: m['distance'])
+
+
+def collect_garbage(conn: Any, storage: Storage, grace_hours: int = GC_GRACE_HOURS) -> int:
+    '''
+    Deletes one batch of unreferenced images not handed out to a client within
+    the grace period (fresh and deduplicated uploads are not attached to a
+    gallery row yet).
+
+    Objects are deleted while the deleted rows are still locked and the rows
+    go when the transaction commits. An upload of the same bytes meanwhile
+    waits in find() for the commit, finds no row and stores its objects
+    again, so GC never deletes an object a new row points to. An object that
+    fails to delete is only logged: its row goes anyway, leaving an orphaned
+    object rather than a row whose link is broken.
+    '''
+    with conn.cursor() as cursor:
+        cursor.execute('''
+            DELETE FROM uploaded_images
+            WHERE sha256 IN (
+                SELECT sha256 FROM uploaded_images
+                WHERE ref_count = 0 AND last_used_at < NOW() - %s * INTERVAL '1 hour'
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ) AND ref_count = 0
+            RETURNING object_keys
+        ''', (grace_hours, GC_BATCH))
+        removed = cursor.fetchall()
+
+        for (object_keys,) in removed:
+            for key in object_keys or []:
+                try:
+                    storage.delete(key)
+                except Exception as e:
+                    log_event('image_gc_delete_failed', error=e, key=key)
+    conn.commit()
+    return len(removed)
+
+
+def is_available() -> bool:
+    return bool(os.environ.get('DATABASE_URL'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Delete stored images no gallery entry references')
+    parser.add_argument('--grace-hours', type=int, default=GC_GRACE_HOURS,
+                        help='keep images handed out to a client within this many hours')
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        total = 0
+        while True:
+            removed = collect_garbage(connection, get_storage(), args.grace_hours)
+            total += removed
+            if removed < GC_BATCH:
+                break
+        print(f'removed={total}')
+    finally:
+        connection.close()
+
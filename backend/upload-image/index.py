@@ -1,9 +1,120 @@
 import json
-import base64
-import uuid
+import binascii
+import hashlib
+import io
+import tempfile
 import os
-from typing import Dict, Any
+from typing import BinaryIO, Dict, Any, List, Optional, Tuple
 
+import image_index
+from db import get_pool
+from storage import get_storage
+from timing import span, traced
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # без Pillow загрузка работает, но миниатюры не создаются
+    Image = None
+
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(10 * 1024 * 1024)))
+THUMBNAIL_MAX_SIZE = int(os.environ.get('THUMBNAIL_MAX_SIZE', '480'))
+THUMBNAIL_FORMATS = [f.strip() for f in os.environ.get('THUMBNAIL_FORMATS', 'webp,jpeg').split(',') if f.strip()]
+# Размер порции base64 при декодировании (кратен 4)
+DECODE_CHUNK_CHARS = 256 * 1024
+
+CONTENT_TYPES = {
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'webp': 'image/webp'
+}
+# формат миниатюры -> (формат Pillow, Content-Type, расширение)
+THUMBNAIL_ENCODERS = {
+    'webp': ('WEBP', 'image/webp', 'webp'),
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg')
+}
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def decode_base64_into(data: str, start: int, out: BinaryIO, hasher: Any) -> int:
+    '''
+    Декодирует base64 из data[start:] порциями прямо в файл, не создавая
+    полную копию строки и байтов в памяти, и попутно считает хеш содержимого.
+    Возвращает размер в байтах.
+    '''
+    carry = ''
+    size = 0
+    for pos in range(start, len(data), DECODE_CHUNK_CHARS):
+        chunk = carry + ''.join(data[pos:pos + DECODE_CHUNK_CHARS].split())
+        usable = len(chunk) - len(chunk) % 4
+        carry = chunk[usable:]
+        decoded = binascii.a2b_base64(chunk[:usable])
+        size += len(decoded)
+        if size > MAX_UPLOAD_BYTES:
+            raise UploadTooLarge()
+        hasher.update(decoded)
+        out.write(decoded)
+    if carry:
+        raise binascii.Error('Incorrect padding')
+    return size
+
+
+def make_thumbnails(image_file: BinaryIO, name: str) -> Dict[str, Tuple[bytes, str, str]]:
+    '''Возвращает {формат: (байты, Content-Type, ключ)} уменьшенных копий изображения'''
+    if Image is None:
+        return {}
+    
+    image_file.seek(0)
+    with Image.open(image_file) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((THUMBNAIL_MAX_SIZE, THUMBNAIL_MAX_SIZE))
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        
+        thumbnails = {}
+        for fmt in THUMBNAIL_FORMATS:
+            pil_format, content_type, _ = THUMBNAIL_ENCODERS[fmt]
+            frame = image.convert('RGB') if pil_format == 'JPEG' else image
+            buffer = io.BytesIO()
+            frame.save(buffer, pil_format, quality=80)
+            thumbnails[fmt] = (buffer.getvalue(), content_type, thumbnail_key(name, fmt))
+        return thumbnails
+
+
+def perceptual_hash(image_file: BinaryIO) -> Optional[int]:
+    '''
+    dHash: 64 бита «соседний пиксель светлее» по уменьшенной до 9x8 серой копии.
+    Похожие фото отличаются в нескольких битах. Знаковое, чтобы влезть в BIGINT.
+    '''
+    if Image is None:
+        return None
+    
+    image_file.seek(0)
+    with Image.open(image_file) as image:
+        small = ImageOps.exif_transpose(image).convert('L').resize((9, 8), Image.LANCZOS)
+    pixels = list(small.getdata())
+    
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | int(pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits - (1 << 64) if bits >= 1 << 63 else bits
+
+
+def detect_image_format(image_file: BinaryIO) -> Optional[str]:
+    '''Проверяет, что файл — изображение; None, если Pillow не установлен'''
+    if Image is None:
+        return None
+    image_file.seek(0)
+    with Image.open(image_file) as image:
+        image.verify()
+        return (image.format or '').lower()
+
+@traced
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Загрузка изображений и возврат публичного URL
@@ -32,6 +143,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     try:
+        # Индекс загруженных файлов живёт в БД; без неё дедупликация идёт по наличию объекта в хранилище
+        pool = get_pool() if image_index.is_available() else None
+        conn = pool.getconn() if pool else None
+        
         body_data = json.loads(event.get('body', '{}'))
         
         image_base64 = body_data.get('image')
@@ -44,38 +159,91 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'image field is required (base64 encoded)'})
             }
         
-        # Удаляем префикс data:image/...;base64, если есть
-        if ',' in image_base64:
-            image_base64 = image_base64.split(',')[1]
+        # Пропускаем префикс data:image/...;base64, если есть (без копирования строки)
+        data_start = image_base64.find(',') + 1 if image_base64.startswith('data:') else 0
         
-        # Декодируем base64
-        try:
-            image_bytes = base64.b64decode(image_base64)
-        except Exception as e:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': f'Invalid base64 image: {str(e)}'})
-            }
+        file_extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else 'jpg'
+        if file_extension not in CONTENT_TYPES:
+            file_extension = 'jpg'
         
-        # Генерируем уникальное имя файла
-        file_extension = filename.split('.')[-1] if '.' in filename else 'jpg'
-        unique_filename = f"{uuid.uuid4()}.{file_extension}"
+        with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as image_file:
+            # Декодируем base64 потоково, одновременно считая SHA-256
+            hasher = hashlib.sha256()
+            try:
+                with span('decode'):
+                    size = decode_base64_into(image_base64, data_start, image_file, hasher)
+            except UploadTooLarge:
+                return {
+                    'statusCode': 413,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': f'Image is larger than {MAX_UPLOAD_BYTES} bytes'})
+                }
+            except binascii.Error as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': f'Invalid base64 image: {str(e)}'})
+                }
+            digest = hasher.hexdigest()
+            storage = get_storage()
+            
+            # Тот же файл уже загружали — отдаём существующие ссылки без записи и перекодирования.
+            # find() продлевает файлу срок до сборки мусора, поэтому фиксируем транзакцию
+            if conn is not None:
+                with conn.cursor() as cursor:
+                    existing = image_index.find(cursor, digest)
+                conn.commit()
+                if existing:
+                    return upload_response(existing['url'], existing['thumbnail_url'], existing['thumbnails'],
+                                           digest, existing['size'], deduplicated=True)
+            
+            try:
+                detected = detect_image_format(image_file)
+            except Exception:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Uploaded file is not a supported image'})
+                }
+            if detected in CONTENT_TYPES:
+                file_extension = detected
+            
+            # Имя файла — хеш содержимого, одинаковые фото попадают в один объект
+            unique_filename = f"{digest}.{file_extension}"
+            image_key = f'passengers/{unique_filename}'
+            
+            if conn is None and storage.exists(image_key):
+                thumbnails = {fmt: storage.url(thumbnail_key(digest, fmt)) for fmt in THUMBNAIL_FORMATS} if Image else {}
+                return upload_response(storage.url(image_key), next(iter(thumbnails.values()), storage.url(image_key)),
+                                       thumbnails, digest, size, deduplicated=True)
+            
+            image_file.seek(0)
+            with span('storage'):
+                image_url = storage.put(image_key, image_file, CONTENT_TYPES[file_extension])
+            object_keys: List[str] = [image_key]
+            
+            with span('thumbnails'):
+                rendered = make_thumbnails(image_file, digest)
+            thumbnails = {}
+            for fmt, (data, content_type, key) in rendered.items():
+                with span('storage'):
+                    thumbnails[fmt] = storage.put(key, io.BytesIO(data), content_type)
+                object_keys.append(key)
+            thumbnail_url = next(iter(thumbnails.values()), image_url)
+            
+            with span('phash'):
+                phash = perceptual_hash(image_file)
         
-        # В реальном проекте здесь была бы загрузка в S3/Cloud Storage
-        # Для демо возвращаем base64 как data URL
-        image_url = f"data:image/{file_extension};base64,{image_base64}"
+        near = []
+        if conn is not None:
+            with conn.cursor() as cursor:
+                image_index.register(cursor, digest, image_url, thumbnail_url, thumbnails, size,
+                                     CONTENT_TYPES[file_extension], phash, object_keys)
+                if phash is not None:
+                    near = image_index.near_duplicates(cursor, phash, digest)
+            conn.commit()
         
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({
-                'url': image_url,
-                'filename': unique_filename,
-                'size': len(image_bytes)
-            })
-        }
+        return upload_response(image_url, thumbnail_url, thumbnails, digest, size, near_duplicates=near)
     
     except Exception as e:
         return {
@@ -84,3 +252,30 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False,
             'body': json.dumps({'error': str(e)})
         }
+    
+    finally:
+        if 'conn' in locals() and conn is not None:
+            pool.putconn(conn)
+
+
+def thumbnail_key(name: str, fmt: str) -> str:
+    return f'passengers/thumbs/{name}.{THUMBNAIL_ENCODERS[fmt][2]}'
+
+
+def upload_response(url: str, thumbnail_url: str, thumbnails: Dict[str, str], digest: str, size: int,
+                    deduplicated: bool = False, near_duplicates: Optional[List[Dict[str, int]]] = None) -> Dict[str, Any]:
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'isBase64Encoded': False,
+        'body': json.dumps({
+            'url': url,
+            'thumbnail_url': thumbnail_url,
+            'thumbnails': thumbnails,
+            'filename': url.rsplit('/', 1)[-1],
+            'sha256': digest,
+            'size': size,
+            'deduplicated': deduplicated,
+            'near_duplicates': near_duplicates or []
+        })
+    }
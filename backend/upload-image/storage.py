@@ -0,0 +1,122 @@
+'''
+Pluggable object storage for uploaded images.
+
+STORAGE_BACKEND=s3 writes to an S3-compatible bucket through boto3;
+STORAGE_BACKEND=local writes to a directory and is meant for local runs and
+tests. Objects are addressed by key and served from STORAGE_PUBLIC_URL/<key>.
+'''
+import os
+import shutil
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Optional
+
+
+class Storage(ABC):
+    def __init__(self, public_url: str):
+        self.public_url = public_url.rstrip('/')
+
+    def url(self, key: str) -> str:
+        return f'{self.public_url}/{key}'
+
+    @abstractmethod
+    def put(self, key: str, data: BinaryIO, content_type: str) -> str:
+        ...
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+
+class S3Storage(Storage):
+    def __init__(self, bucket: str, public_url: str, endpoint_url: Optional[str] = None):
+        import boto3
+
+        super().__init__(public_url)
+        self.bucket = bucket
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
+            aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY')
+        )
+
+    def put(self, key: str, data: BinaryIO, content_type: str) -> str:
+        # upload_fileobj streams in parts instead of reading the whole object into memory
+        self.client.upload_fileobj(data, self.bucket, key, ExtraArgs={
+            'ContentType': content_type,
+            'CacheControl': 'public, max-age=31536000, immutable'
+        })
+        return self.url(key)
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+
+class LocalStorage(Storage):
+    def __init__(self, root: str, public_url: str):
+        super().__init__(public_url)
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f'invalid storage key: {key}')
+        return path
+
+    def put(self, key: str, data: BinaryIO, content_type: str) -> str:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.part'
+        with open(tmp_path, 'wb') as f:
+            shutil.copyfileobj(data, f)
+        os.replace(tmp_path, path)
+        return self.url(key)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+_storage: Optional[Storage] = None
+
+
+def get_storage() -> Storage:
+    '''Returns the storage backend configured by environment variables.'''
+    global _storage
+    if _storage is None:
+        backend = os.environ.get('STORAGE_BACKEND', 's3')
+        if backend == 'local':
+            _storage = LocalStorage(
+                os.environ.get('LOCAL_STORAGE_DIR', '/tmp/zoo-taxi-uploads'),
+                os.environ.get('STORAGE_PUBLIC_URL', '/uploads')
+            )
+        elif backend == 's3':
+            access_key = os.environ.get('AWS_ACCESS_KEY_ID', '')
+            _storage = S3Storage(
+                os.environ.get('S3_BUCKET', 'files'),
+                os.environ.get('STORAGE_PUBLIC_URL', f'https://cdn.poehali.dev/projects/{access_key}/bucket'),
+                os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+            )
+        else:
+            raise ValueError(f'unknown STORAGE_BACKEND: {backend}')
+    return _storage
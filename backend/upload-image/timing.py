@@ -0,0 +1,289 @@
+'''
+Per-invocation timing spans, Server-Timing headers and SQL fingerprint stats.
+
+A handler decorated with @traced is sampled with probability
+TRACE_SAMPLE_RATE (0 disables tracing, the default). A sampled invocation
+collects spans from span() blocks and from TimedCursor, which db.py installs
+as the default cursor of every pooled connection. The spans are emitted as
+one JSON log line tagged with context.request_id and function_name and
+summarised in a Server-Timing response header. Executed statements are
+normalised to fingerprints and aggregated per process; the slowest ones are
+logged every TRACE_STATS_EVERY sampled invocations.
+
+When an invocation is not sampled, span() returns a shared no-op and the
+cursor hooks cost one context variable lookup per call. Copied into every
+function; keep the copies identical.
+'''
+import contextvars
+import json
+import os
+import random
+import re
+import threading
+import time
+import traceback
+import zlib
+from functools import lru_cache, wraps
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor
+
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0'))
+TRACE_STATS_EVERY = int(os.environ.get('TRACE_STATS_EVERY', '100'))
+TRACE_STATS_TOP = int(os.environ.get('TRACE_STATS_TOP', '10'))
+MAX_SPANS = 500
+
+_current: 'contextvars.ContextVar[Optional[Trace]]' = contextvars.ContextVar('trace', default=None)
+
+
+class Trace:
+    def __init__(self, request_id: str, function_name: str):
+        self.request_id = request_id
+        self.function_name = function_name
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.dropped = 0
+
+    def add(self, name: str, started: float, duration: float, **tags: Any) -> None:
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped += 1
+            return
+        self.spans.append({
+            'name': name,
+            'start_ms': round((started - self.started) * 1000, 3),
+            'duration_ms': round(duration * 1000, 3),
+            **tags
+        })
+
+    def server_timing(self, total: float) -> str:
+        # Одна метрика на тип спана: длительность суммируется, количество — в описании
+        totals: Dict[str, List[float]] = {}
+        for s in self.spans:
+            entry = totals.setdefault(s['name'], [0.0, 0])
+            entry[0] += s['duration_ms']
+            entry[1] += 1
+        metrics = [f'{name};dur={dur:.1f};desc="{count}x"' for name, (dur, count) in totals.items()]
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'tags', 'started')
+
+    def __init__(self, trace: Trace, name: str, tags: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.tags = tags
+
+    def __enter__(self) -> '_Span':
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.trace.add(self.name, self.started, time.perf_counter() - self.started, **self.tags)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc: Any) -> None:
+        return None
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str, **tags: Any) -> Any:
+    '''with span('serialize'): ... — a timed block in the current trace, a no-op when not sampled'''
+    trace = _current.get()
+    if trace is None:
+        return _NULL_SPAN
+    return _Span(trace, name, tags)
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+# --- SQL fingerprints -----------------------------------------------------
+
+_COMMENTS = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r'(?<![\w$])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDERS = re.compile(r'%\(\w+\)s|%s')
+_TUPLE = r'\(\s*\?(?:\s*,\s*\?)*\s*\)'
+_TUPLE_LISTS = re.compile(_TUPLE + r'(?:\s*,\s*' + _TUPLE + r')+')
+_IN_LISTS = re.compile(r'\bIN\s*' + _TUPLE, re.I)
+_SPACES = re.compile(r'\s+')
+
+_stats_lock = threading.Lock()
+# fingerprint id -> [statement, calls, total_ms, max_ms, rows]
+_query_stats: Dict[str, List[Any]] = {}
+_traced_invocations = 0
+
+
+@lru_cache(maxsize=512)
+def fingerprint(sql: str) -> Tuple[str, str]:
+    '''(id, normalised statement) with literals, placeholders and VALUES lists collapsed'''
+    text = _COMMENTS.sub(' ', sql)
+    text = _STRINGS.sub('?', text)
+    text = _PLACEHOLDERS.sub('?', text)
+    text = _NUMBERS.sub('?', text)
+    text = _TUPLE_LISTS.sub('(...)', text)
+    text = _IN_LISTS.sub('IN (...)', text)
+    text = _SPACES.sub(' ', text).strip()
+    return f'{zlib.crc32(text.encode("utf-8")):08x}', text
+
+
+def _record_query(sql: Any, duration: float, rows: int) -> Tuple[str, str]:
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    elif not isinstance(sql, str):
+        sql = str(sql)
+    # execute_values присылает уже подставленные значения — нормализуем только начало
+    fp_id, statement = fingerprint(sql[:4000])
+    ms = duration * 1000
+    with _stats_lock:
+        entry = _query_stats.get(fp_id)
+        if entry is None:
+            _query_stats[fp_id] = [statement, 1, ms, ms, rows]
+        else:
+            entry[1] += 1
+            entry[2] += ms
+            entry[3] = max(entry[3], ms)
+            entry[4] += rows
+    return fp_id, statement
+
+
+def query_stats(top: int = TRACE_STATS_TOP) -> List[Dict[str, Any]]:
+    '''Aggregated statements of this process, slowest total time first'''
+    with _stats_lock:
+        entries = sorted(_query_stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+    return [{
+        'fingerprint': fp_id,
+        'statement': statement[:500],
+        'calls': calls,
+        'total_ms': round(total, 3),
+        'mean_ms': round(total / calls, 3),
+        'max_ms': round(max_ms, 3),
+        'rows': rows
+    } for fp_id, (statement, calls, total, max_ms, rows) in entries]
+
+
+# --- cursors --------------------------------------------------------------
+
+class TimedCursorMixin:
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        trace = _current.get()
+        if trace is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            duration = time.perf_counter() - started
+            fp_id, _ = _record_query(query, duration, max(self.rowcount, 0))
+            trace.add('sql', started, duration, fingerprint=fp_id, rows=self.rowcount)
+
+    def executemany(self, query: Any, vars_list: Any) -> Any:
+        trace = _current.get()
+        if trace is None:
+            return super().executemany(query, vars_list)
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            duration = time.perf_counter() - started
+            fp_id, _ = _record_query(query, duration, max(self.rowcount, 0))
+            trace.add('sql', started, duration, fingerprint=fp_id, rows=self.rowcount)
+
+    def copy_expert(self, sql: Any, file: Any, size: int = 8192) -> Any:
+        trace = _current.get()
+        if trace is None:
+            return super().copy_expert(sql, file, size)
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            duration = time.perf_counter() - started
+            fp_id, _ = _record_query(sql, duration, max(self.rowcount, 0))
+            trace.add('sql', started, duration, fingerprint=fp_id, rows=self.rowcount)
+
+    def fetchone(self) -> Any:
+        with span('fetch'):
+            return super().fetchone()
+
+    def fetchmany(self, size: Optional[int] = None) -> Any:
+        with span('fetch'):
+            return super().fetchmany(size) if size is not None else super().fetchmany()
+
+    def fetchall(self) -> Any:
+        with span('fetch'):
+            return super().fetchall()
+
+
+class TimedCursor(TimedCursorMixin, psycopg2.extensions.cursor):
+    pass
+
+
+class TimedRealDictCursor(TimedCursorMixin, RealDictCursor):
+    pass
+
+
+# --- handler wrapper ------------------------------------------------------
+
+def _log(record: Dict[str, Any]) -> None:
+    print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
+
+
+def log_event(event: str, error: Optional[BaseException] = None, **fields: Any) -> None:
+    '''One JSON log line in the same stream as traces; error adds its type, message and traceback'''
+    record: Dict[str, Any] = {'type': 'event', 'event': event, **fields}
+    if error is not None:
+        record['error'] = f'{type(error).__name__}: {error}'
+        record['traceback'] = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+    _log(record)
+
+
+def traced(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable[[Dict[str, Any], Any], Dict[str, Any]]:
+    '''Samples invocations of a cloud function handler into traces'''
+    @wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        if TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE:
+            return handler(event, context)
+
+        global _traced_invocations
+        trace = Trace(getattr(context, 'request_id', None) or '', getattr(context, 'function_name', None) or '')
+        token = _current.set(trace)
+        response: Optional[Dict[str, Any]] = None
+        try:
+            response = handler(event, context)
+            return response
+        finally:
+            _current.reset(token)
+            total = time.perf_counter() - trace.started
+            if isinstance(response, dict):
+                headers = response.setdefault('headers', {})
+                headers['Server-Timing'] = trace.server_timing(total)
+                headers['Timing-Allow-Origin'] = '*'
+            _log({
+                'type': 'trace',
+                'request_id': trace.request_id,
+                'function_name': trace.function_name,
+                'method': event.get('httpMethod'),
+                'status': response.get('statusCode') if isinstance(response, dict) else None,
+                'duration_ms': round(total * 1000, 3),
+                'spans': trace.spans,
+                'dropped_spans': trace.dropped
+            })
+            with _stats_lock:
+                _traced_invocations += 1
+                report = TRACE_STATS_EVERY > 0 and _traced_invocations % TRACE_STATS_EVERY == 0
+            if report:
+                _log({'type': 'sql_stats', 'function_name': trace.function_name,
+                      'invocations': _traced_invocations, 'statements': query_stats()})
+    return wrapper
@@ -0,0 +1,3 @@
+-- Составной индекс для keyset-пагинации заявок с фильтром по статусу:
+-- WHERE status = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_orders_status_created_at_id ON orders(status, created_at DESC, id DESC);
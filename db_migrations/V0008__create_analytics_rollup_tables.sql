@@ -0,0 +1,54 @@
+-- Rollups for the analytics dashboard, maintained on ingest (see backend/analytics/rollups.py)
+CREATE TABLE IF NOT EXISTS analytics_hourly (
+    hour TIMESTAMP NOT NULL,
+    page_path VARCHAR(500) NOT NULL,
+    visits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, page_path)
+);
+
+CREATE TABLE IF NOT EXISTS analytics_daily (
+    day DATE NOT NULL,
+    page_path VARCHAR(500) NOT NULL,
+    visits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, page_path)
+);
+
+-- visitors: zlib-compressed HyperLogLog sketch of the day's visitor IPs
+CREATE TABLE IF NOT EXISTS analytics_daily_totals (
+    day DATE PRIMARY KEY,
+    visits INTEGER NOT NULL DEFAULT 0,
+    visitors BYTEA
+);
+
+CREATE TABLE IF NOT EXISTS analytics_path_totals (
+    page_path VARCHAR(500) PRIMARY KEY,
+    visits BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_analytics_path_totals_visits ON analytics_path_totals(visits DESC);
+
+CREATE TABLE IF NOT EXISTS analytics_totals (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    visits BIGINT NOT NULL DEFAULT 0,
+    visitors BYTEA
+);
+
+-- Counters are backfilled here; visitor sketches stay NULL until `python rollups.py` runs
+INSERT INTO analytics_hourly (hour, page_path, visits)
+SELECT date_trunc('hour', visited_at), COALESCE(page_path, '/'), COUNT(*)
+FROM analytics WHERE visited_at IS NOT NULL
+GROUP BY 1, 2;
+
+INSERT INTO analytics_daily (day, page_path, visits)
+SELECT visited_at::date, COALESCE(page_path, '/'), COUNT(*)
+FROM analytics WHERE visited_at IS NOT NULL
+GROUP BY 1, 2;
+
+INSERT INTO analytics_daily_totals (day, visits)
+SELECT day, SUM(visits) FROM analytics_daily GROUP BY day;
+
+INSERT INTO analytics_path_totals (page_path, visits)
+SELECT page_path, SUM(visits) FROM analytics_daily GROUP BY page_path;
+
+INSERT INTO analytics_totals (id, visits)
+SELECT 1, COALESCE(SUM(visits), 0) FROM analytics_daily_totals;
@@ -0,0 +1,2 @@
+-- Ссылка на уменьшенную копию фото (создаётся функцией upload-image)
+ALTER TABLE passengers_gallery ADD COLUMN IF NOT EXISTS thumbnail_url TEXT;
@@ -0,0 +1,33 @@
+-- Индекс загруженных изображений по SHA-256 содержимого (дедупликация в upload-image)
+CREATE TABLE IF NOT EXISTS uploaded_images (
+    sha256 CHAR(64) PRIMARY KEY,
+    url TEXT NOT NULL,
+    thumbnail_url TEXT,
+    thumbnails JSONB,
+    size INTEGER NOT NULL,
+    content_type VARCHAR(50),
+    phash BIGINT, -- перцептивный хеш (dHash) для поиска почти одинаковых фото
+    object_keys TEXT[] NOT NULL DEFAULT '{}', -- ключи оригинала и миниатюр в хранилище
+    ref_count INTEGER NOT NULL DEFAULT 0, -- сколько фото галереи ссылаются на файл
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_uploaded_images_url ON uploaded_images(url);
+CREATE INDEX IF NOT EXISTS idx_uploaded_images_unreferenced ON uploaded_images(created_at) WHERE ref_count = 0;
+
+-- Счётчик ссылок поддерживается триггером, чтобы его не обходил ни один путь записи в галерею
+CREATE OR REPLACE FUNCTION passengers_gallery_image_refs() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE uploaded_images SET ref_count = GREATEST(ref_count - 1, 0) WHERE url = OLD.photo_url;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE uploaded_images SET ref_count = ref_count + 1 WHERE url = NEW.photo_url;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_passengers_gallery_image_refs
+AFTER INSERT OR DELETE OR UPDATE OF photo_url ON passengers_gallery
+FOR EACH ROW EXECUTE FUNCTION passengers_gallery_image_refs();
@@ -0,0 +1,27 @@
+-- Счётчик версий таблиц для ETag и инвалидации кэшей: одна строка на таблицу,
+-- увеличивается триггером на любую запись в таблицу
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name VARCHAR(63) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO table_versions (table_name) VALUES ('reviews'), ('passengers_gallery')
+ON CONFLICT (table_name) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE table_versions
+    SET version = version + 1, changed_at = CURRENT_TIMESTAMP
+    WHERE table_name = TG_TABLE_NAME;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_reviews_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON reviews
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+CREATE TRIGGER trg_passengers_gallery_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON passengers_gallery
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
@@ -0,0 +1,4 @@
+-- Публичная галерея листается по idx_passengers_published (is_published, created_at DESC).
+-- Для списка в админке (без фильтра) нужен свой индекс под
+-- ORDER BY created_at DESC, id DESC LIMIT n и (created_at, id) < (?, ?)
+CREATE INDEX IF NOT EXISTS idx_passengers_created_at_id ON passengers_gallery(created_at DESC, id DESC);
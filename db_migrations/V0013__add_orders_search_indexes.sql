@@ -0,0 +1,21 @@
+-- Поиск заявок в админке: полнотекстовый по имени клиента, питомцу, адресам и
+-- комментариям плюс триграммы для частичных совпадений по телефону и адресам.
+-- Конфигурация 'simple' без стемминга: имена и адреса ищутся по префиксам слов.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple'::regconfig, coalesce(client_name, '') || ' ' || coalesce(pet_name, '')), 'A') ||
+    setweight(to_tsvector('simple'::regconfig, coalesce(pickup_address, '') || ' ' || coalesce(destination_address, '')), 'B') ||
+    setweight(to_tsvector('simple'::regconfig, coalesce(pet_type, '') || ' ' || coalesce(pet_breed, '') || ' ' ||
+                                               coalesce(comments, '') || ' ' || coalesce(admin_notes, '')), 'C')
+) STORED;
+
+-- Только цифры телефона: "+7 (968) 522-72-72" находится по "5227"
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS client_phone_digits VARCHAR(20)
+    GENERATED ALWAYS AS (regexp_replace(client_phone, '\D', '', 'g')) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_orders_search_vector ON orders USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_orders_phone_digits_trgm ON orders USING GIN (client_phone_digits gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_orders_client_name_trgm ON orders USING GIN (client_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_orders_pickup_address_trgm ON orders USING GIN (pickup_address gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_orders_destination_address_trgm ON orders USING GIN (destination_address gin_trgm_ops);
@@ -0,0 +1,92 @@
+-- Сводка по опубликованным отзывам: средняя оценка и распределение 1–5 читаются
+-- одной строкой, а не считаются по всей таблице. Строку поддерживает триггер
+-- в той же транзакции, что и изменение отзыва
+CREATE TABLE IF NOT EXISTS review_stats (
+    id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    published_count INTEGER NOT NULL DEFAULT 0,
+    rating_sum BIGINT NOT NULL DEFAULT 0,
+    rating_1 INTEGER NOT NULL DEFAULT 0,
+    rating_2 INTEGER NOT NULL DEFAULT 0,
+    rating_3 INTEGER NOT NULL DEFAULT 0,
+    rating_4 INTEGER NOT NULL DEFAULT 0,
+    rating_5 INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION update_review_stats() RETURNS trigger AS $$
+DECLARE
+    old_rating INTEGER;
+    new_rating INTEGER;
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        UPDATE review_stats
+        SET published_count = 0, rating_sum = 0,
+            rating_1 = 0, rating_2 = 0, rating_3 = 0, rating_4 = 0, rating_5 = 0,
+            updated_at = CURRENT_TIMESTAMP;
+        RETURN NULL;
+    END IF;
+
+    -- Вклад строки в сводку до и после изменения (NULL — не опубликована)
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        IF OLD.is_published THEN
+            old_rating := OLD.rating;
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        IF NEW.is_published THEN
+            new_rating := NEW.rating;
+        END IF;
+    END IF;
+
+    IF old_rating IS NOT DISTINCT FROM new_rating THEN
+        RETURN NULL;
+    END IF;
+
+    UPDATE review_stats SET
+        published_count = published_count
+            + (CASE WHEN new_rating IS NULL THEN 0 ELSE 1 END)
+            - (CASE WHEN old_rating IS NULL THEN 0 ELSE 1 END),
+        rating_sum = rating_sum + COALESCE(new_rating, 0) - COALESCE(old_rating, 0),
+        rating_1 = rating_1 + (CASE WHEN new_rating = 1 THEN 1 ELSE 0 END) - (CASE WHEN old_rating = 1 THEN 1 ELSE 0 END),
+        rating_2 = rating_2 + (CASE WHEN new_rating = 2 THEN 1 ELSE 0 END) - (CASE WHEN old_rating = 2 THEN 1 ELSE 0 END),
+        rating_3 = rating_3 + (CASE WHEN new_rating = 3 THEN 1 ELSE 0 END) - (CASE WHEN old_rating = 3 THEN 1 ELSE 0 END),
+        rating_4 = rating_4 + (CASE WHEN new_rating = 4 THEN 1 ELSE 0 END) - (CASE WHEN old_rating = 4 THEN 1 ELSE 0 END),
+        rating_5 = rating_5 + (CASE WHEN new_rating = 5 THEN 1 ELSE 0 END) - (CASE WHEN old_rating = 5 THEN 1 ELSE 0 END),
+        updated_at = CURRENT_TIMESTAMP
+    WHERE id = 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Пока строим сводку, отзывы не меняются: иначе правка между подсчётом и
+-- созданием триггера в сводку не попадёт
+LOCK TABLE reviews IN SHARE ROW EXCLUSIVE MODE;
+
+INSERT INTO review_stats (id, published_count, rating_sum, rating_1, rating_2, rating_3, rating_4, rating_5)
+SELECT 1,
+       COUNT(*),
+       COALESCE(SUM(rating), 0),
+       COUNT(*) FILTER (WHERE rating = 1),
+       COUNT(*) FILTER (WHERE rating = 2),
+       COUNT(*) FILTER (WHERE rating = 3),
+       COUNT(*) FILTER (WHERE rating = 4),
+       COUNT(*) FILTER (WHERE rating = 5)
+FROM reviews
+WHERE is_published = true
+ON CONFLICT (id) DO UPDATE SET
+    published_count = EXCLUDED.published_count,
+    rating_sum = EXCLUDED.rating_sum,
+    rating_1 = EXCLUDED.rating_1,
+    rating_2 = EXCLUDED.rating_2,
+    rating_3 = EXCLUDED.rating_3,
+    rating_4 = EXCLUDED.rating_4,
+    rating_5 = EXCLUDED.rating_5,
+    updated_at = CURRENT_TIMESTAMP;
+
+CREATE TRIGGER trg_reviews_stats
+AFTER INSERT OR UPDATE OF rating, is_published OR DELETE ON reviews
+FOR EACH ROW EXECUTE FUNCTION update_review_stats();
+
+CREATE TRIGGER trg_reviews_stats_truncate
+AFTER TRUNCATE ON reviews
+FOR EACH STATEMENT EXECUTE FUNCTION update_review_stats();
@@ -0,0 +1,60 @@
+-- Дельта-синхронизация админки (?updated_since=): изменённые строки ищутся по
+-- индексу updated_at, удалённые — по журналу deleted_rows
+
+CREATE INDEX IF NOT EXISTS idx_orders_updated_at ON orders (updated_at);
+CREATE INDEX IF NOT EXISTS idx_reviews_updated_at ON reviews (updated_at);
+CREATE INDEX IF NOT EXISTS idx_passengers_gallery_updated_at ON passengers_gallery (updated_at);
+
+-- updated_at обновляется при любом UPDATE, даже если запрос его не выставил
+CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := LOCALTIMESTAMP;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_orders_touch_updated_at
+BEFORE UPDATE ON orders
+FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+CREATE TRIGGER trg_reviews_touch_updated_at
+BEFORE UPDATE ON reviews
+FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+CREATE TRIGGER trg_passengers_gallery_touch_updated_at
+BEFORE UPDATE ON passengers_gallery
+FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+-- Журнал удалений (tombstones): id удалённой строки и время удаления
+CREATE TABLE IF NOT EXISTS deleted_rows (
+    id BIGSERIAL PRIMARY KEY,
+    table_name VARCHAR(63) NOT NULL,
+    row_id INTEGER NOT NULL,
+    deleted_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_deleted_rows_table_deleted_at ON deleted_rows (table_name, deleted_at);
+
+-- Записи старше 30 дней удаляются изредка, попутно с новыми удалениями;
+-- срок совпадает с TOMBSTONE_RETENTION_DAYS в sync.py
+CREATE OR REPLACE FUNCTION log_deleted_row() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO deleted_rows (table_name, row_id) VALUES (TG_TABLE_NAME, OLD.id);
+    IF random() < 0.01 THEN
+        DELETE FROM deleted_rows WHERE deleted_at < LOCALTIMESTAMP - INTERVAL '30 days';
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_orders_log_deleted
+AFTER DELETE ON orders
+FOR EACH ROW EXECUTE FUNCTION log_deleted_row();
+
+CREATE TRIGGER trg_reviews_log_deleted
+AFTER DELETE ON reviews
+FOR EACH ROW EXECUTE FUNCTION log_deleted_row();
+
+CREATE TRIGGER trg_passengers_gallery_log_deleted
+AFTER DELETE ON passengers_gallery
+FOR EACH ROW EXECUTE FUNCTION log_deleted_row();
@@ -0,0 +1,34 @@
+-- Лента изменений заявок (?view=changes): о новой заявке и о смене статуса
+-- сообщается через NOTIFY orders_changes; уведомление уходит при COMMIT
+CREATE OR REPLACE FUNCTION notify_order_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        IF OLD.status IS NOT DISTINCT FROM NEW.status THEN
+            RETURN NULL;
+        END IF;
+        PERFORM pg_notify('orders_changes', json_build_object(
+            'op', 'status',
+            'id', NEW.id,
+            'status', NEW.status,
+            'old_status', OLD.status,
+            'at', NEW.updated_at
+        )::text);
+    ELSE
+        PERFORM pg_notify('orders_changes', json_build_object(
+            'op', 'insert',
+            'id', NEW.id,
+            'status', NEW.status,
+            'at', NEW.created_at
+        )::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_orders_notify_insert
+AFTER INSERT ON orders
+FOR EACH ROW EXECUTE FUNCTION notify_order_change();
+
+CREATE TRIGGER trg_orders_notify_status
+AFTER UPDATE OF status ON orders
+FOR EACH ROW EXECUTE FUNCTION notify_order_change();
@@ -0,0 +1,99 @@
+-- Raw visits are range-partitioned by month on visited_at. Old months are
+-- removed by dropping their partition (no DELETE, no vacuum debt), and
+-- queries with a visited_at range only touch the matching partitions.
+-- Partitions are created ahead by analytics_ensure_partitions(), which the
+-- analytics function calls periodically (see backend/analytics/partitions.py).
+
+ALTER TABLE analytics RENAME TO analytics_legacy;
+ALTER INDEX IF EXISTS analytics_pkey RENAME TO analytics_legacy_pkey;
+ALTER INDEX IF EXISTS idx_analytics_visited_at RENAME TO idx_analytics_legacy_visited_at;
+ALTER INDEX IF EXISTS idx_analytics_visitor_ip RENAME TO idx_analytics_legacy_visitor_ip;
+ALTER INDEX IF EXISTS idx_analytics_page_path RENAME TO idx_analytics_legacy_page_path;
+-- The id sequence outlives the old table
+ALTER SEQUENCE analytics_id_seq OWNED BY NONE;
+
+CREATE TABLE analytics (
+    id INTEGER NOT NULL DEFAULT nextval('analytics_id_seq'),
+    visitor_ip VARCHAR(100),
+    user_agent TEXT,
+    page_path VARCHAR(500),
+    referrer VARCHAR(1000),
+    visited_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, visited_at)
+) PARTITION BY RANGE (visited_at);
+
+ALTER SEQUENCE analytics_id_seq OWNED BY analytics.id;
+
+-- Only visited_at is ever filtered on; the visitor_ip and page_path indexes
+-- were pure write cost (rollups aggregate them with full scans)
+CREATE INDEX IF NOT EXISTS idx_analytics_visited_at ON analytics (visited_at);
+
+-- Catches rows outside every monthly partition so an insert never fails;
+-- analytics_ensure_partitions() moves such rows out when it creates their month
+CREATE TABLE IF NOT EXISTS analytics_default PARTITION OF analytics DEFAULT;
+
+-- Creates the monthly partitions analytics_YYYY_MM covering [from_month, to_month]
+CREATE OR REPLACE FUNCTION analytics_ensure_partitions(from_month DATE, to_month DATE) RETURNS INTEGER AS $$
+DECLARE
+    month_start TIMESTAMP := date_trunc('month', from_month);
+    month_end TIMESTAMP;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= to_month LOOP
+        month_end := month_start + INTERVAL '1 month';
+        partition_name := 'analytics_' || to_char(month_start, 'YYYY_MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE analytics INCLUDING DEFAULTS)', partition_name);
+            -- Rows of this month that landed in the default partition move first,
+            -- otherwise ATTACH would refuse the new range
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM analytics_default WHERE visited_at >= %L AND visited_at < %L RETURNING *) '
+                'INSERT INTO %I SELECT * FROM moved',
+                month_start, month_end, partition_name
+            );
+            EXECUTE format(
+                'ALTER TABLE analytics ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, month_end
+            );
+            created := created + 1;
+        END IF;
+        month_start := month_end;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Drops monthly partitions that end before the first day of (current month - keep_months)
+CREATE OR REPLACE FUNCTION analytics_drop_partitions(keep_months INTEGER) RETURNS INTEGER AS $$
+DECLARE
+    cutoff TIMESTAMP := date_trunc('month', LOCALTIMESTAMP) - make_interval(months => keep_months);
+    child RECORD;
+    dropped INTEGER := 0;
+BEGIN
+    FOR child IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'analytics'::regclass AND c.relname ~ '^analytics_\d{4}_\d{2}$'
+    LOOP
+        IF to_timestamp(substr(child.relname, 11), 'YYYY_MM')::timestamp + INTERVAL '1 month' <= cutoff THEN
+            EXECUTE format('DROP TABLE %I', child.relname);
+            dropped := dropped + 1;
+        END IF;
+    END LOOP;
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Partitions for the existing history plus the next two months, then the copy
+SELECT analytics_ensure_partitions(
+    COALESCE((SELECT MIN(visited_at) FROM analytics_legacy)::date, CURRENT_DATE),
+    (CURRENT_DATE + INTERVAL '2 months')::date
+);
+
+INSERT INTO analytics (id, visitor_ip, user_agent, page_path, referrer, visited_at)
+SELECT id, visitor_ip, user_agent, page_path, referrer, COALESCE(visited_at, NOW())
+FROM analytics_legacy;
+
+DROP TABLE analytics_legacy;
@@ -0,0 +1,3 @@
+-- Repeat page views dropped by ingest-side dedup (backend/analytics/dedup.py);
+-- they are not in visits, this only records how many were suppressed
+ALTER TABLE analytics_totals ADD COLUMN IF NOT EXISTS suppressed BIGINT NOT NULL DEFAULT 0;
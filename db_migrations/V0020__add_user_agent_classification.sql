@@ -0,0 +1,18 @@
+-- User-agent class of each visit as small integer codes, see backend/analytics/useragent.py
+-- (positions in DEVICES / OPERATING_SYSTEMS / BROWSERS; device 4 = bot).
+-- NULL means not classified yet: the analytics function fills them at ingest and
+-- rollups.py classifies older rows, so run it once after migrating.
+-- Columns added to the partitioned parent propagate to every partition.
+ALTER TABLE analytics ADD COLUMN IF NOT EXISTS ua_device SMALLINT;
+ALTER TABLE analytics ADD COLUMN IF NOT EXISTS ua_os SMALLINT;
+ALTER TABLE analytics ADD COLUMN IF NOT EXISTS ua_browser SMALLINT;
+
+-- Visits per day and user-agent class, bots included; the other rollups count humans only
+CREATE TABLE IF NOT EXISTS analytics_ua_daily (
+    day DATE NOT NULL,
+    device SMALLINT NOT NULL,
+    os SMALLINT NOT NULL,
+    browser SMALLINT NOT NULL,
+    visits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, device, os, browser)
+);
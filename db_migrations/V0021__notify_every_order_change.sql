@@ -0,0 +1,21 @@
+-- Лента изменений заявок (?view=changes) сообщает о любом изменении заявки,
+-- а не только о смене статуса: догоняющая выборка по updated_at видит любые
+-- правки, и оба пути должны отдавать одни и те же события.
+-- at — updated_at с микросекундами в том же формате, что отдаёт функция orders
+CREATE OR REPLACE FUNCTION notify_order_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('orders_changes', json_build_object(
+        'op', CASE WHEN TG_OP = 'INSERT' THEN 'insert' ELSE 'update' END,
+        'id', NEW.id,
+        'status', NEW.status,
+        'at', to_char(NEW.updated_at, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_orders_notify_status ON orders;
+
+CREATE TRIGGER trg_orders_notify_update
+AFTER UPDATE ON orders
+FOR EACH ROW EXECUTE FUNCTION notify_order_change();
@@ -0,0 +1,30 @@
+-- Ingest no longer rewrites HyperLogLog sketches (backend/analytics/rollups.py):
+-- it records (day, visitor) pairs here, a cheap insert with no shared hot row,
+-- and fold_visitors() periodically merges them into analytics_daily_totals.visitors
+-- and analytics_totals.visitors and deletes them. Reads merge pairs not folded yet.
+CREATE TABLE IF NOT EXISTS analytics_daily_visitors (
+    day DATE NOT NULL,
+    visitor VARCHAR(100) NOT NULL,
+    PRIMARY KEY (day, visitor)
+);
+
+-- Dedup suppression is counted per day like visits, so ingest never updates the
+-- singleton analytics_totals row; the all-time count so far moves to today
+ALTER TABLE analytics_daily_totals ADD COLUMN IF NOT EXISTS suppressed BIGINT NOT NULL DEFAULT 0;
+
+INSERT INTO analytics_daily_totals AS t (day, suppressed)
+SELECT CURRENT_DATE, suppressed FROM analytics_totals WHERE id = 1 AND suppressed > 0
+ON CONFLICT (day) DO UPDATE SET suppressed = t.suppressed + EXCLUDED.suppressed;
+
+UPDATE analytics_totals SET suppressed = 0 WHERE id = 1;
+
+-- Sketches V0008 left NULL are built by the first fold from these pairs, so the
+-- dashboard never falls back to scanning the raw table. Without an all-time
+-- sketch every day is backfilled; merging a day into its sketch twice is harmless.
+INSERT INTO analytics_daily_visitors (day, visitor)
+SELECT DISTINCT a.visited_at::date, COALESCE(a.visitor_ip, 'unknown')
+FROM analytics a
+JOIN analytics_daily_totals t ON t.day = a.visited_at::date
+WHERE (t.visitors IS NULL OR NOT EXISTS (SELECT 1 FROM analytics_totals WHERE id = 1 AND visitors IS NOT NULL))
+  AND a.ua_device IS DISTINCT FROM 4
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,8 @@
+-- Срок ожидания перед сборкой мусора отсчитывается от последней выдачи файла
+-- клиенту, а не от первой загрузки: повторная загрузка старого файла без ссылок
+-- (дедупликация) продлевает ему жизнь, пока фото галереи не сохранено
+ALTER TABLE uploaded_images ADD COLUMN IF NOT EXISTS last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+UPDATE uploaded_images SET last_used_at = created_at WHERE created_at IS NOT NULL;
+
+DROP INDEX IF EXISTS idx_uploaded_images_unreferenced;
+CREATE INDEX IF NOT EXISTS idx_uploaded_images_unreferenced ON uploaded_images(last_used_at) WHERE ref_count = 0;
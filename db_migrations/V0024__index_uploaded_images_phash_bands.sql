@@ -0,0 +1,22 @@
+-- Поиск почти одинаковых фото без перебора всей галереи: 64-битный dHash
+-- режется на 8 полос по 8 бит, элемент массива — номер полосы * 256 + её
+-- значение. Хеши на расстоянии Хэмминга меньше 8 совпадают хотя бы в одной
+-- полосе, поэтому кандидатов находит GIN-индекс по пересечению массивов
+-- (image_index.near_duplicates, полосы считаются там так же)
+ALTER TABLE uploaded_images ADD COLUMN IF NOT EXISTS phash_bands SMALLINT[] GENERATED ALWAYS AS (
+    CASE WHEN phash IS NULL THEN NULL ELSE ARRAY[
+        ((phash >> 56) & 255)::smallint,
+        (256 + ((phash >> 48) & 255))::smallint,
+        (512 + ((phash >> 40) & 255))::smallint,
+        (768 + ((phash >> 32) & 255))::smallint,
+        (1024 + ((phash >> 24) & 255))::smallint,
+        (1280 + ((phash >> 16) & 255))::smallint,
+        (1536 + ((phash >> 8) & 255))::smallint,
+        (1792 + (phash & 255))::smallint
+    ] END
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_uploaded_images_phash_bands ON uploaded_images USING GIN (phash_bands);
+
+-- Кандидаты сопоставляются с фото галереи по ссылке
+CREATE INDEX IF NOT EXISTS idx_passengers_gallery_photo_url ON passengers_gallery (photo_url);
@@ -0,0 +1,111 @@
+'''
+Benchmark: HyperLogLog visitor sketches vs exact distinct counting.
+
+Without --dsn it simulates N days of visits in memory and compares, for each
+precision, the sketch estimate against an exact set: add throughput, merge
+and count latency for a 30-day range, stored size and observed error.
+
+With --dsn it also times the production queries against a real database:
+SELECT COUNT(DISTINCT visitor_ip) FROM analytics versus merging the per-day
+sketches from analytics_daily_totals.
+
+    python scripts/bench_hll.py --visitors 200000 --days 30
+    python scripts/bench_hll.py --dsn postgresql://localhost/zoo_taxi
+'''
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'analytics'))
+
+from hll import HyperLogLog, merge_all  # noqa: E402
+
+
+def simulate(precision: int, visitors: int, days: int, visits_per_day: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    # Returning visitors are skewed: a few IPs account for most visits
+    population = [f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}' for i in range(visitors)]
+
+    exact = set()
+    daily = []
+    add_seconds = 0.0
+    for _ in range(days):
+        day_ips = [population[min(int(rng.paretovariate(1.2)) - 1, visitors - 1) if rng.random() < 0.5
+                              else rng.randrange(visitors)] for _ in range(visits_per_day)]
+        exact.update(day_ips)
+        sketch = HyperLogLog(precision)
+        started = time.perf_counter()
+        sketch.update(day_ips)
+        add_seconds += time.perf_counter() - started
+        daily.append(sketch.to_bytes())
+
+    started = time.perf_counter()
+    merged = merge_all((HyperLogLog.from_bytes(data) for data in daily), precision)
+    merge_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    estimate = merged.count()
+    count_seconds = time.perf_counter() - started
+
+    return {
+        'precision': precision,
+        'exact': len(exact),
+        'estimate': estimate,
+        'error_pct': 100.0 * (estimate - len(exact)) / len(exact),
+        'expected_std_error_pct': 100.0 * merged.relative_error,
+        'adds_per_sec': days * visits_per_day / add_seconds,
+        'merge_ms': merge_seconds * 1000,
+        'count_ms': count_seconds * 1000,
+        'avg_sketch_bytes': sum(map(len, daily)) / len(daily),
+    }
+
+
+def bench_database(dsn: str) -> None:
+    import psycopg2
+
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            started = time.perf_counter()
+            cursor.execute('SELECT COUNT(DISTINCT visitor_ip) FROM analytics')
+            exact = cursor.fetchone()[0]
+            exact_ms = (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            cursor.execute('SELECT visitors FROM analytics_daily_totals WHERE visitors IS NOT NULL')
+            estimate = merge_all(HyperLogLog.from_bytes(row[0]) for row in cursor.fetchall()).count()
+            sketch_ms = (time.perf_counter() - started) * 1000
+    finally:
+        conn.close()
+
+    print(f'\nexact COUNT(DISTINCT): {exact:>10}  {exact_ms:9.1f} ms')
+    print(f'merged daily sketches: {estimate:>10}  {sketch_ms:9.1f} ms'
+          f'  ({100.0 * (estimate - exact) / max(exact, 1):+.2f}%)')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--visitors', type=int, default=200000, help='distinct IPs in the population')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--visits-per-day', type=int, default=20000)
+    parser.add_argument('--precision', type=int, action='append', help='repeatable; default 12, 14, 16')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--dsn', help='also benchmark against this database')
+    args = parser.parse_args()
+
+    print(f"{'p':>3} {'exact':>9} {'estimate':>9} {'error':>8} {'±1σ':>7} "
+          f"{'adds/s':>10} {'merge':>9} {'count':>8} {'bytes/day':>10}")
+    for precision in args.precision or [12, 14, 16]:
+        r = simulate(precision, args.visitors, args.days, args.visits_per_day, args.seed)
+        print(f"{r['precision']:>3} {r['exact']:>9} {r['estimate']:>9} {r['error_pct']:>+7.2f}% "
+              f"{r['expected_std_error_pct']:>6.2f}% {r['adds_per_sec']:>10.0f} "
+              f"{r['merge_ms']:>7.1f}ms {r['count_ms']:>6.1f}ms {r['avg_sketch_bytes']:>10.0f}")
+
+    if args.dsn:
+        bench_database(args.dsn)
+
+
+if __name__ == '__main__':
+    main()
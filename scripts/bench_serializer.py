@@ -0,0 +1,116 @@
+'''
+Benchmark: orders list serialization, legacy per-row loop vs RowSerializer.
+
+Builds a synthetic page of order rows shaped like the orders GET result
+(same columns and PostgreSQL type OIDs) and reports rows/sec for:
+the old dict(zip()) + per-column if/isoformat loop with json.dumps, the
+type-driven serializer on stdlib json and, when installed, on orjson.
+
+    python scripts/bench_serializer.py --rows 50000 --repeat 5
+'''
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date, datetime, time as dtime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'orders'))
+
+import serializer  # noqa: E402
+
+# (name, type OID) as in cursor.description of the orders SELECT
+ORDER_COLUMNS = [
+    ('id', 23), ('client_name', 1043), ('client_phone', 1043), ('client_email', 1043),
+    ('pet_name', 1043), ('pet_type', 1043), ('pet_breed', 1043), ('pet_weight', 1700),
+    ('pet_special_needs', 25), ('service_type', 1043), ('pickup_address', 25),
+    ('destination_address', 25), ('preferred_date', 1082), ('preferred_time', 1083),
+    ('additional_services', 25), ('comments', 25), ('estimated_price', 1700), ('status', 1043),
+    ('admin_notes', 25), ('cancellation_reason', 25), ('created_at', 1114), ('updated_at', 1114),
+]
+
+
+def make_rows(count: int) -> list:
+    started = datetime(2024, 1, 1, 9, 0, 0, 123456)
+    rows = []
+    for i in range(count):
+        created = started + timedelta(minutes=7 * i)
+        rows.append((
+            i + 1, f'Клиент {i}', f'+7900{i:07d}', f'client{i}@example.com',
+            'Барсик' if i % 3 else None, 'cat' if i % 2 else 'dog', None,
+            Decimal(f'{3 + i % 40}.{i % 10}0'), None if i % 4 else 'Боится громких звуков',
+            'vet', f'ул. Ленина, {i % 200}', f'ул. Пушкина, {i % 150}',
+            created.date() + timedelta(days=2), dtime(8 + i % 12, (i * 5) % 60),
+            '["carrier"]' if i % 5 == 0 else None, 'Позвонить заранее' if i % 2 else None,
+            Decimal(f'{1000 + i % 3000}.00'), ('new', 'confirmed', 'completed')[i % 3],
+            None, None, created, created + timedelta(hours=1),
+        ))
+    return rows
+
+
+def legacy(rows: list) -> str:
+    '''The loop the orders GET used before the serializer'''
+    columns = [name for name, _ in ORDER_COLUMNS]
+    orders_list = []
+    for order in rows:
+        order_dict = dict(zip(columns, order))
+        if order_dict['created_at']:
+            order_dict['created_at'] = order_dict['created_at'].isoformat()
+        if order_dict['updated_at']:
+            order_dict['updated_at'] = order_dict['updated_at'].isoformat()
+        if order_dict['preferred_date']:
+            order_dict['preferred_date'] = order_dict['preferred_date'].strftime('%Y-%m-%d')
+        if order_dict['preferred_time']:
+            order_dict['preferred_time'] = str(order_dict['preferred_time'])
+        if order_dict['pet_weight']:
+            order_dict['pet_weight'] = float(order_dict['pet_weight'])
+        if order_dict['estimated_price']:
+            order_dict['estimated_price'] = float(order_dict['estimated_price'])
+        orders_list.append(order_dict)
+    return json.dumps({'orders': orders_list})
+
+
+def typed(rows: list) -> str:
+    row_serializer = serializer.RowSerializer(ORDER_COLUMNS)
+    return serializer.json_object('orders', row_serializer.to_json(rows))
+
+
+def measure(fn, rows: list, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(rows)
+        best = min(best, time.perf_counter() - started)
+    return len(rows) / best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=5, help='best of N runs is reported')
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    fast_json = serializer.orjson
+
+    # Both paths must describe the same data
+    serializer.orjson = None
+    assert json.loads(legacy(rows)) == json.loads(typed(rows))
+
+    results = [('legacy loop + json', measure(legacy, rows, args.repeat))]
+    results.append(('RowSerializer + json', measure(typed, rows, args.repeat)))
+    if fast_json is not None:
+        serializer.orjson = fast_json
+        results.append(('RowSerializer + orjson', measure(typed, rows, args.repeat)))
+    else:
+        print('orjson is not installed; skipping the fast backend')
+
+    baseline = results[0][1]
+    print(f"{'variant':<24} {'rows/s':>12} {'speedup':>8}")
+    for name, rate in results:
+        print(f'{name:<24} {rate:>12.0f} {rate / baseline:>7.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,405 @@
+'''
+Local benchmark and load-test harness for the backend functions.
+
+Every backend/<function>/tests.json entry becomes an endpoint: its handler is
+imported directly (no HTTP), called with a synthetic event built from the
+test, and timed. The database is a throwaway one with db_migrations applied:
+by default a temporary cluster started with initdb/pg_ctl from PATH, or a
+fresh database created on the server given by --dsn (dropped afterwards
+unless --keep-db).
+
+Each endpoint is driven --requests times serially or through a thread or
+process pool of --concurrency workers. The report gives p50/p95/p99 latency,
+throughput, status mismatches and, from a separate serial pass under
+tracemalloc, peak and retained allocations per request. --output saves the
+results as JSON; --compare flags endpoints slower than a saved baseline.
+
+    python scripts/loadtest.py --requests 200 --output before.json
+    python scripts/loadtest.py --executor process --concurrency 4 --compare before.json
+    python scripts/loadtest.py --dsn postgresql://postgres@localhost/postgres --function orders
+'''
+import argparse
+import importlib.util
+import json
+import math
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+BACKEND_DIR = os.path.join(ROOT, 'backend')
+MIGRATIONS_DIR = os.path.join(ROOT, 'db_migrations')
+
+# Environment the handlers see; the throwaway DATABASE_URL is added at runtime
+FUNCTION_ENV = {
+    'ANALYTICS_INGEST_MODE': 'sync',
+    'STORAGE_BACKEND': 'local',
+    'STORAGE_PUBLIC_URL': '/uploads',
+}
+
+Handler = Callable[[Dict[str, Any], Any], Dict[str, Any]]
+
+
+class Context:
+    '''The subset of the cloud function context the handlers read'''
+
+    def __init__(self, function_name: str):
+        self.request_id = uuid.uuid4().hex
+        self.function_name = function_name
+        self.function_version = 'loadtest'
+        self.memory_limit_in_mb = 128
+
+
+def discover(selected: Optional[List[str]] = None) -> List[str]:
+    names = []
+    for name in sorted(os.listdir(BACKEND_DIR)):
+        directory = os.path.join(BACKEND_DIR, name)
+        if os.path.isfile(os.path.join(directory, 'index.py')) and os.path.isfile(os.path.join(directory, 'tests.json')):
+            if not selected or name in selected:
+                names.append(name)
+    return names
+
+
+def load_handler(function: str) -> Handler:
+    '''
+    Imports backend/<function>/index.py with its sibling modules. Every function
+    ships its own db.py, cache.py and so on under the same module names, so
+    those names are evicted from sys.modules before and after the import; the
+    loaded modules stay reachable through the handler's globals.
+    '''
+    directory = os.path.join(BACKEND_DIR, function)
+    local_names = {entry[:-3] for entry in os.listdir(directory) if entry.endswith('.py')}
+    for name in local_names:
+        sys.modules.pop(name, None)
+
+    sys.path.insert(0, directory)
+    try:
+        spec = importlib.util.spec_from_file_location(f'loadtest_{function.replace("-", "_")}', os.path.join(directory, 'index.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(directory)
+        for name in local_names:
+            sys.modules.pop(name, None)
+    return module.handler
+
+
+def load_tests(function: str) -> List[Dict[str, Any]]:
+    with open(os.path.join(BACKEND_DIR, function, 'tests.json'), encoding='utf-8') as f:
+        return json.load(f).get('tests', [])
+
+
+def build_event(test: Dict[str, Any], sequence: int = 0) -> Dict[str, Any]:
+    url = urlsplit(test.get('path') or '/')
+    body = test.get('body')
+    headers = {'Content-Type': 'application/json', 'User-Agent': 'zoo-taxi-loadtest/1.0'}
+    headers.update(test.get('headers') or {})
+    return {
+        'httpMethod': test.get('method', 'GET'),
+        'path': url.path or '/',
+        'queryStringParameters': dict(parse_qsl(url.query, keep_blank_values=True)) or None,
+        'headers': headers,
+        'body': body if isinstance(body, str) or body is None else json.dumps(body, ensure_ascii=False),
+        'isBase64Encoded': False,
+        # A spread of client addresses so per-visitor paths are exercised realistically
+        'requestContext': {
+            'requestId': uuid.uuid4().hex,
+            'identity': {'sourceIp': f'10.0.{sequence // 256 % 256}.{sequence % 256}', 'userAgent': headers['User-Agent']},
+        },
+    }
+
+
+def endpoint_key(function: str, test: Dict[str, Any]) -> str:
+    return f"{function} :: {test.get('name') or test.get('method', 'GET') + ' ' + test.get('path', '/')}"
+
+
+def call(handler: Handler, function: str, test: Dict[str, Any], sequence: int) -> Tuple[float, int]:
+    event = build_event(test, sequence)
+    started = time.perf_counter()
+    try:
+        status = handler(event, Context(function)).get('statusCode', 0)
+    except Exception:
+        status = -1
+    return time.perf_counter() - started, status
+
+
+# --- process pool workers -------------------------------------------------
+
+_worker_handlers: Dict[str, Handler] = {}
+
+
+def _init_worker(env: Dict[str, str]) -> None:
+    os.environ.update(env)
+
+
+def _run_chunk(function: str, test: Dict[str, Any], start: int, count: int) -> List[Tuple[float, int]]:
+    handler = _worker_handlers.get(function)
+    if handler is None:
+        handler = _worker_handlers[function] = load_handler(function)
+    return [call(handler, function, test, start + i) for i in range(count)]
+
+
+# --- measurement ----------------------------------------------------------
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    '''Nearest-rank percentile of an ascending list'''
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def measure_allocations(handler: Handler, function: str, test: Dict[str, Any], samples: int) -> Dict[str, float]:
+    '''Peak and retained traced memory per call, averaged over a few serial calls'''
+    peaks, retained = [], []
+    tracemalloc.start()
+    try:
+        for i in range(samples):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            call(handler, function, test, i)
+            after, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained.append(after - before)
+    finally:
+        tracemalloc.stop()
+    return {
+        'alloc_peak_kib': round(statistics.mean(peaks) / 1024, 1),
+        'alloc_retained_kib': round(statistics.mean(retained) / 1024, 1),
+    }
+
+
+def run_endpoint(handler: Handler, function: str, test: Dict[str, Any], args: argparse.Namespace,
+                 pool: Any) -> Dict[str, Any]:
+    for i in range(args.warmup):
+        call(handler, function, test, i)
+
+    started = time.perf_counter()
+    if args.executor == 'serial':
+        samples = [call(handler, function, test, i) for i in range(args.requests)]
+    elif args.executor == 'thread':
+        futures = [pool.submit(call, handler, function, test, i) for i in range(args.requests)]
+        samples = [future.result() for future in futures]
+    else:
+        chunk = max(1, args.requests // (args.concurrency * 4))
+        futures = [pool.submit(_run_chunk, function, test, start, min(chunk, args.requests - start))
+                   for start in range(0, args.requests, chunk)]
+        samples = [sample for future in futures for sample in future.result()]
+    wall = time.perf_counter() - started
+
+    latencies = sorted(seconds * 1000 for seconds, _ in samples)
+    expected = test.get('expectedStatus')
+    statuses: Dict[str, int] = {}
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    result = {
+        'function': function,
+        'test': test.get('name'),
+        'method': test.get('method', 'GET'),
+        'path': test.get('path', '/'),
+        'requests': len(samples),
+        'mismatches': sum(1 for _, status in samples if expected is not None and status != expected),
+        'statuses': statuses,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(statistics.mean(latencies), 3) if latencies else 0.0,
+        'max_ms': round(latencies[-1], 3) if latencies else 0.0,
+        'throughput_rps': round(len(samples) / wall, 1) if wall else 0.0,
+    }
+    if args.alloc_samples:
+        result.update(measure_allocations(handler, function, test, args.alloc_samples))
+    return result
+
+
+# --- throwaway database ---------------------------------------------------
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class ThrowawayDatabase:
+    '''A temporary cluster (initdb + pg_ctl) or a temporary database on --dsn'''
+
+    def __init__(self, server_dsn: Optional[str], keep: bool):
+        self.server_dsn = server_dsn
+        self.keep = keep
+        self.data_dir: Optional[str] = None
+        self.db_name: Optional[str] = None
+        self.dsn = ''
+
+    def __enter__(self) -> 'ThrowawayDatabase':
+        import psycopg2
+
+        if self.server_dsn:
+            self.db_name = f'zoo_taxi_loadtest_{uuid.uuid4().hex[:8]}'
+            admin = psycopg2.connect(self.server_dsn)
+            admin.autocommit = True
+            with admin.cursor() as cursor:
+                cursor.execute(f'CREATE DATABASE {self.db_name}')
+            admin.close()
+            self.dsn = psycopg2.extensions.make_dsn(self.server_dsn, dbname=self.db_name)
+        else:
+            if not shutil.which('initdb') or not shutil.which('pg_ctl'):
+                raise SystemExit('initdb/pg_ctl not found on PATH; pass --dsn to use an existing server')
+            self.data_dir = tempfile.mkdtemp(prefix='zoo-taxi-pg-')
+            port = _free_port()
+            subprocess.run(['initdb', '-D', self.data_dir, '-U', 'postgres', '-A', 'trust', '--no-sync'],
+                           check=True, stdout=subprocess.DEVNULL)
+            subprocess.run(['pg_ctl', '-D', self.data_dir, '-w', '-l', os.path.join(self.data_dir, 'server.log'),
+                            '-o', f'-p {port} -k {self.data_dir} -c listen_addresses=127.0.0.1 -c fsync=off',
+                            'start'], check=True, stdout=subprocess.DEVNULL)
+            self.dsn = f'postgresql://postgres@127.0.0.1:{port}/postgres'
+        self.migrate()
+        return self
+
+    def migrate(self) -> None:
+        import psycopg2
+
+        conn = psycopg2.connect(self.dsn)
+        try:
+            with conn.cursor() as cursor:
+                for name in sorted(os.listdir(MIGRATIONS_DIR), key=lambda n: int(n[1:].split('__')[0])):
+                    if name.endswith('.sql'):
+                        with open(os.path.join(MIGRATIONS_DIR, name), encoding='utf-8') as f:
+                            cursor.execute(f.read())
+            conn.commit()
+        finally:
+            conn.close()
+
+    def __exit__(self, *exc: Any) -> None:
+        if self.keep:
+            print(f'database kept: {self.dsn}')
+            return
+        if self.db_name:
+            import psycopg2
+
+            admin = psycopg2.connect(self.server_dsn)
+            admin.autocommit = True
+            with admin.cursor() as cursor:
+                cursor.execute(f'DROP DATABASE IF EXISTS {self.db_name} WITH (FORCE)')
+            admin.close()
+        if self.data_dir:
+            subprocess.run(['pg_ctl', '-D', self.data_dir, '-m', 'immediate', 'stop'],
+                           check=False, stdout=subprocess.DEVNULL)
+            shutil.rmtree(self.data_dir, ignore_errors=True)
+
+
+# --- reporting ------------------------------------------------------------
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', '-C', ROOT, 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results: List[Dict[str, Any]]) -> None:
+    print(f"{'endpoint':<58} {'n':>5} {'bad':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>8} {'peak KiB':>9}")
+    for r in results:
+        name = f"{r['function']} :: {r['test']}"
+        print(f"{name[:58]:<58} {r['requests']:>5} {r['mismatches']:>4} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} "
+              f"{r['p99_ms']:>8.2f} {r['throughput_rps']:>8.1f} {r.get('alloc_peak_kib', 0):>9.1f}")
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, threshold: float) -> bool:
+    '''Prints per-endpoint deltas against a saved run; True if any p50/p95 regressed beyond threshold'''
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {f"{r['function']} :: {r['test']}": r for r in json.load(f)['results']}
+
+    regressed = False
+    print(f"\ncompared with {baseline_path} (threshold {threshold:.0%})")
+    for r in results:
+        key = f"{r['function']} :: {r['test']}"
+        before = baseline.get(key)
+        if before is None:
+            print(f'  new       {key}')
+            continue
+        changes = [(metric, (r[metric] - before[metric]) / before[metric])
+                   for metric in ('p50_ms', 'p95_ms') if before[metric] > 0]
+        slower = any(change > threshold for _, change in changes)
+        regressed = regressed or slower
+        print(f"  {'REGRESSED' if slower else 'ok':<9} {key}  "
+              + '  '.join(f'{metric[:3]} {change:+.1%}' for metric, change in changes))
+    return regressed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--function', action='append', help='repeatable; default every function with tests.json')
+    parser.add_argument('--match', help='only tests whose name contains this substring')
+    parser.add_argument('--requests', type=int, default=200, help='timed calls per endpoint')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--executor', choices=('serial', 'thread', 'process'), default='serial')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--alloc-samples', type=int, default=20, help='serial calls under tracemalloc; 0 disables')
+    parser.add_argument('--dsn', help='server to create the throwaway database on instead of a temporary cluster')
+    parser.add_argument('--keep-db', action='store_true')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--compare', help='baseline JSON from an earlier --output')
+    parser.add_argument('--threshold', type=float, default=0.10, help='relative slowdown counted as a regression')
+    args = parser.parse_args()
+
+    functions = discover(args.function)
+    if not functions:
+        raise SystemExit('no functions with tests.json found')
+
+    results = []
+    with ThrowawayDatabase(args.dsn, args.keep_db) as database:
+        env = dict(FUNCTION_ENV, DATABASE_URL=database.dsn,
+                   LOCAL_STORAGE_DIR=tempfile.mkdtemp(prefix='zoo-taxi-uploads-'))
+        os.environ.update(env)
+
+        pool: Any = None
+        if args.executor == 'thread':
+            pool = ThreadPoolExecutor(max_workers=args.concurrency)
+        elif args.executor == 'process':
+            pool = ProcessPoolExecutor(max_workers=args.concurrency, initializer=_init_worker, initargs=(env,))
+        try:
+            for function in functions:
+                handler = load_handler(function)
+                for test in load_tests(function):
+                    if args.match and args.match not in (test.get('name') or ''):
+                        continue
+                    print(f'running {endpoint_key(function, test)}', file=sys.stderr)
+                    results.append(run_endpoint(handler, function, test, args, pool))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            shutil.rmtree(env['LOCAL_STORAGE_DIR'], ignore_errors=True)
+
+    print_report(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'revision': git_revision(),
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'config': {k: getattr(args, k) for k in ('requests', 'warmup', 'executor', 'concurrency', 'alloc_samples')},
+                'results': results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f'\nsaved {args.output}')
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+'''
+Deterministic synthetic data for orders, reviews, passengers_gallery and analytics.
+
+Rows come from seeded generators and are streamed into PostgreSQL with COPY
+in batches of --batch-rows, so memory stays flat at any target size. Each
+table has its own random stream derived from --seed, and rows are spread
+over the --days days before --end-date (today unless given): the same seed,
+sizes and end date always produce the same data, whatever tables are selected. Run it against a
+database with db_migrations applied (for example one kept by
+scripts/loadtest.py --keep-db). Visits are copied without a user-agent
+class; classes, analytics rollups and visitor sketches are rebuilt from the
+raw visits afterwards.
+
+    python scripts/seed_data.py --dsn postgresql://postgres@localhost/zoo_taxi_bench
+    python scripts/seed_data.py --dsn ... --visits 5000000 --orders 500000 --truncate
+    python scripts/seed_data.py --dsn ... --only analytics --visits 200000
+    python scripts/seed_data.py --dsn ... --end-date 2025-01-01
+'''
+import argparse
+import io
+import os
+import random
+import sys
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any, Iterable, Iterator, List, Sequence
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'analytics'))
+
+TABLES = ('orders', 'reviews', 'passengers_gallery', 'analytics')
+
+ORDER_STATUSES = ('new', 'confirmed', 'in_progress', 'completed', 'cancelled')
+ORDER_STATUS_WEIGHTS = (8, 7, 3, 70, 12)
+PET_TYPES = ('собака', 'кошка', 'птица', 'грызун', 'рептилия')
+PET_TYPE_WEIGHTS = (50, 38, 6, 5, 1)
+BREEDS = ('лабрадор', 'такса', 'мейн-кун', 'британская', 'корги', 'шпиц', 'дворняжка', None)
+PET_NAMES = ('Барсик', 'Мурка', 'Рекс', 'Бобик', 'Кеша', 'Симба', 'Луна', 'Тоша', 'Грей', 'Пушок')
+SERVICE_TYPES = ('к ветеринару', 'в гостиницу', 'домой', 'на груминг', 'в аэропорт', 'экстренная помощь')
+FIRST_NAMES = ('Анна', 'Михаил', 'Елена', 'Дмитрий', 'Ольга', 'Сергей', 'Мария', 'Алексей', 'Ирина', 'Павел')
+LAST_NAMES = ('Петрова', 'Сидоров', 'Козлова', 'Волков', 'Иванова', 'Смирнов', 'Кузнецова', 'Попов')
+STREETS = ('ул. Ленина', 'ул. Пушкина', 'пр. Мира', 'ул. Гагарина', 'Садовая ул.', 'ул. Победы')
+CANCEL_REASONS = ('Клиент передумал', 'Питомец заболел', 'Перенос на другую дату', 'Нет свободных машин')
+REVIEW_TITLES = ('Отличный сервис!', 'Всё прошло хорошо', 'Рекомендую', 'Немного опоздали', 'Спасибо водителю')
+REVIEW_PHRASES = (
+    'Водитель приехал вовремя, автомобиль чистый.', 'Питомец перенёс дорогу спокойно.',
+    'Помогли донести переноску до двери.', 'Цена адекватная.', 'Немного задержались, но предупредили.',
+    'Обязательно обратимся снова.', 'Кошка даже не мяукала всю дорогу.', 'Очень бережно обращались с собакой.',
+)
+
+# Skewed site traffic: the home page and a few landing pages get most visits
+PAGE_PATHS = ('/', '/#services', '/#prices', '/#calculator', '/#reviews', '/#passengers', '/#contacts',
+              '/admin', '/privacy', '/#order')
+PAGE_WEIGHTS = tuple(1.0 / (rank + 1) ** 1.1 for rank in range(len(PAGE_PATHS)))
+REFERRERS = ('', '', '', 'https://yandex.ru/', 'https://www.google.com/', 'https://vk.com/', 'https://t.me/',
+             'https://2gis.ru/')
+USER_AGENTS = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_2 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.2 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (Linux; Android 14; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Mobile Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 14_2) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.2 Safari/605.1.15',
+    'Mozilla/5.0 (compatible; YandexBot/3.0; +http://yandex.com/bots)',
+)
+USER_AGENT_WEIGHTS = (35, 30, 25, 8, 2)
+
+
+def rng_for(seed: int, table: str) -> random.Random:
+    '''An independent, reproducible stream per table'''
+    return random.Random(seed * 1000003 + zlib.crc32(table.encode('utf-8')))
+
+
+# --- COPY plumbing --------------------------------------------------------
+
+def copy_value(value: Any) -> str:
+    '''One field in COPY text format'''
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    text = str(value)
+    if any(c in text for c in '\\\t\n\r'):
+        text = text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    return text
+
+
+class RowStream(io.TextIOBase):
+    '''A read()-able view of a row generator, encoded as COPY text lines on demand'''
+
+    def __init__(self, rows: Iterable[Sequence[Any]]):
+        self._rows = iter(rows)
+        self._buffer = ''
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._buffer += '\t'.join(copy_value(v) for v in row) + '\n'
+        if size < 0:
+            chunk, self._buffer = self._buffer, ''
+        else:
+            chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+def batched(rows: Iterator[Sequence[Any]], size: int) -> Iterator[Iterator[Sequence[Any]]]:
+    '''Splits a stream into consecutive lazy batches without materialising them'''
+    while True:
+        first = next(rows, None)
+        if first is None:
+            return
+        yield _take(first, rows, size)
+
+
+def _take(first: Sequence[Any], rows: Iterator[Sequence[Any]], size: int) -> Iterator[Sequence[Any]]:
+    yield first
+    for _ in range(size - 1):
+        row = next(rows, None)
+        if row is None:
+            return
+        yield row
+
+
+def copy_rows(conn: Any, table: str, columns: Sequence[str], rows: Iterator[Sequence[Any]],
+              total: int, batch_rows: int) -> None:
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    started = time.perf_counter()
+    loaded = 0
+    with conn.cursor() as cursor:
+        for batch in batched(rows, batch_rows):
+            cursor.copy_expert(sql, RowStream(batch), size=1 << 16)
+            conn.commit()
+            loaded += min(batch_rows, total - loaded)
+            elapsed = time.perf_counter() - started
+            print(f'\r{table:<20} {loaded:>10}/{total}  {loaded / max(elapsed, 1e-9):>9.0f} rows/s',
+                  end='', file=sys.stderr)
+    print(file=sys.stderr)
+
+
+# --- generators -----------------------------------------------------------
+
+def moment(rng: random.Random, start: datetime, days: int) -> datetime:
+    # Traffic grows over the period and follows the daily rhythm (peak in the evening)
+    day = int(days * rng.random() ** 0.7)
+    hour = min(23, max(0, int(rng.gauss(15, 4.5))))
+    return start + timedelta(days=day, hours=hour, minutes=rng.randrange(60), seconds=rng.randrange(60),
+                             microseconds=rng.randrange(1000000))
+
+
+def person(rng: random.Random) -> str:
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+
+
+def phone(rng: random.Random) -> str:
+    return f'+79{rng.randrange(10 ** 9):09d}'
+
+
+def address(rng: random.Random) -> str:
+    return f'{rng.choice(STREETS)}, {rng.randint(1, 180)}, кв. {rng.randint(1, 300)}'
+
+
+def order_rows(rng: random.Random, count: int, start: datetime, days: int) -> Iterator[tuple]:
+    for i in range(count):
+        created = moment(rng, start, days)
+        status = rng.choices(ORDER_STATUSES, ORDER_STATUS_WEIGHTS)[0]
+        pet_type = rng.choices(PET_TYPES, PET_TYPE_WEIGHTS)[0]
+        weight = Decimal(rng.randint(5, 800)) / 10 if pet_type == 'собака' else Decimal(rng.randint(5, 90)) / 10
+        yield (
+            person(rng), phone(rng), f'client{i}@example.com' if rng.random() < 0.6 else None,
+            rng.choice(PET_NAMES) if rng.random() < 0.8 else None, pet_type, rng.choice(BREEDS), weight,
+            'Боится громких звуков' if rng.random() < 0.1 else None, rng.choice(SERVICE_TYPES),
+            address(rng), address(rng), (created + timedelta(days=rng.randint(0, 14))).date(),
+            f'{rng.randint(7, 22):02d}:{rng.choice((0, 15, 30, 45)):02d}:00',
+            'переноска, сопровождение' if rng.random() < 0.2 else None,
+            'Позвоните за час' if rng.random() < 0.3 else None,
+            Decimal(rng.randint(80, 900) * 10), status,
+            'Постоянный клиент' if rng.random() < 0.05 else None,
+            rng.choice(CANCEL_REASONS) if status == 'cancelled' else None,
+            created, created + timedelta(minutes=rng.randint(0, 60 * 48)) if status != 'new' else created,
+        )
+
+
+ORDER_COLUMNS = ('client_name', 'client_phone', 'client_email', 'pet_name', 'pet_type', 'pet_breed', 'pet_weight',
+                 'pet_special_needs', 'service_type', 'pickup_address', 'destination_address', 'preferred_date',
+                 'preferred_time', 'additional_services', 'comments', 'estimated_price', 'status', 'admin_notes',
+                 'cancellation_reason', 'created_at', 'updated_at')
+
+
+def review_rows(rng: random.Random, count: int, start: datetime, days: int) -> Iterator[tuple]:
+    for _ in range(count):
+        created = moment(rng, start, days)
+        rating = rng.choices((1, 2, 3, 4, 5), (2, 3, 8, 25, 62))[0]
+        published = rng.random() < 0.75
+        replied = rng.random() < 0.3
+        yield (
+            person(rng), None, phone(rng) if rng.random() < 0.4 else None, rating, rng.choice(REVIEW_TITLES),
+            ' '.join(rng.sample(REVIEW_PHRASES, rng.randint(1, 4))), rng.choice(SERVICE_TYPES),
+            (created - timedelta(days=rng.randint(0, 10))).date(), published,
+            published and rating == 5 and rng.random() < 0.1, None,
+            'Спасибо за отзыв!' if replied else None, 'Администратор' if replied else None,
+            created + timedelta(hours=rng.randint(1, 72)) if replied else None,
+            created, created + timedelta(hours=rng.randint(1, 48)) if published else None, created,
+        )
+
+
+REVIEW_COLUMNS = ('client_name', 'client_email', 'client_phone', 'rating', 'title', 'content', 'service_type',
+                  'trip_date', 'is_published', 'is_featured', 'moderator_notes', 'admin_reply', 'reply_author',
+                  'replied_at', 'created_at', 'published_at', 'updated_at')
+
+
+def passenger_rows(rng: random.Random, count: int, start: datetime, days: int) -> Iterator[tuple]:
+    for i in range(count):
+        created = moment(rng, start, days)
+        digest = f'{zlib.crc32(f"passenger-{i}".encode()):08x}{i:056x}'
+        yield (
+            rng.choice(PET_NAMES), rng.choices(PET_TYPES, PET_TYPE_WEIGHTS)[0],
+            f'https://cdn.example.com/seed/passengers/{digest}.jpg',
+            f'https://cdn.example.com/seed/passengers/{digest}.thumb.webp' if rng.random() < 0.9 else None,
+            'Доехал(а) с комфортом' if rng.random() < 0.5 else None, rng.random() < 0.8, created, created,
+        )
+
+
+PASSENGER_COLUMNS = ('pet_name', 'pet_type', 'photo_url', 'thumbnail_url', 'description', 'is_published',
+                     'created_at', 'updated_at')
+
+
+def visit_rows(rng: random.Random, count: int, start: datetime, days: int) -> Iterator[tuple]:
+    # Roughly one visitor per five visits; a small core of returning visitors dominates
+    population = max(1, count // 5)
+    for _ in range(count):
+        if rng.random() < 0.6:
+            visitor = min(int(rng.paretovariate(1.16)) - 1, population - 1)
+        else:
+            visitor = rng.randrange(population)
+        yield (
+            f'{10 + (visitor >> 24) % 200}.{visitor >> 16 & 255}.{visitor >> 8 & 255}.{visitor & 255}',
+            rng.choices(USER_AGENTS, USER_AGENT_WEIGHTS)[0],
+            rng.choices(PAGE_PATHS, PAGE_WEIGHTS)[0], rng.choice(REFERRERS), moment(rng, start, days),
+        )
+
+
+VISIT_COLUMNS = ('visitor_ip', 'user_agent', 'page_path', 'referrer', 'visited_at')
+
+
+# --- main -----------------------------------------------------------------
+
+def seed(conn: Any, args: argparse.Namespace, tables: List[str]) -> None:
+    start = datetime.combine(args.end_date - timedelta(days=args.days), datetime.min.time())
+    plan: List[tuple] = [
+        ('orders', ORDER_COLUMNS, order_rows, args.orders),
+        ('reviews', REVIEW_COLUMNS, review_rows, args.reviews),
+        ('passengers_gallery', PASSENGER_COLUMNS, passenger_rows, args.passengers),
+        ('analytics', VISIT_COLUMNS, visit_rows, args.visits),
+    ]
+    for table, columns, generator, count in plan:
+        if table not in tables or count <= 0:
+            continue
+        if table == 'analytics':
+            # Monthly partitions for the whole range, otherwise COPY fills analytics_default
+            import partitions
+
+            partitions.ensure(conn, start.date(), args.end_date)
+            conn.commit()
+        copy_rows(conn, table, columns, generator(rng_for(args.seed, table), count, start, args.days),
+                  count, args.batch_rows)
+
+    if 'analytics' in tables and args.visits > 0 and not args.skip_rollups:
+        import rollups
+
+        started = time.perf_counter()
+        rollups.rebuild(conn)
+        print(f'analytics rollups rebuilt in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+
+    with conn.cursor() as cursor:
+        for table in tables:
+            cursor.execute(f'ANALYZE {table}')
+    conn.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'), help='default: $DATABASE_URL')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--orders', type=int, default=300000)
+    parser.add_argument('--reviews', type=int, default=5000)
+    parser.add_argument('--passengers', type=int, default=3000)
+    parser.add_argument('--visits', type=int, default=2000000)
+    parser.add_argument('--days', type=int, default=365, help='rows are spread over this many days up to --end-date')
+    parser.add_argument('--end-date', type=date.fromisoformat, default=date.today(),
+                        help='YYYY-MM-DD, default today; pass it to reproduce a data set on another day')
+    parser.add_argument('--batch-rows', type=int, default=50000, help='rows per COPY and per commit')
+    parser.add_argument('--only', action='append', choices=TABLES, help='repeatable; default all tables')
+    parser.add_argument('--truncate', action='store_true', help='empty the selected tables first')
+    parser.add_argument('--skip-rollups', action='store_true', help='do not rebuild analytics rollups')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('--dsn or DATABASE_URL is required')
+
+    import psycopg2
+
+    tables = args.only or list(TABLES)
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if args.truncate:
+            with conn.cursor() as cursor:
+                cursor.execute(f"TRUNCATE {', '.join(tables)} RESTART IDENTITY")
+            conn.commit()
+        seed(conn, args, tables)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useRef, useState } from 'react';
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
@@ -24,6 +24,34 @@ interface OrderFormData {
   comments: string;
 }
 
+const ORDERS_URL = 'https://functions.poehali.dev/1c0b122d-a5b5-4727-aaa6-681c30e9f3f3';
+const SUBMIT_ATTEMPTS = 3;
+
+// Повторяет POST при сетевой ошибке, 5xx и 409 (заявка с этим ключом ещё создаётся).
+// Все попытки идут с одним Idempotency-Key, поэтому дубликатов заявки не будет
+const postOrder = async (body: string, idempotencyKey: string): Promise<Response> => {
+  for (let attempt = 1; ; attempt++) {
+    try {
+      const response = await fetch(ORDERS_URL, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'Idempotency-Key': idempotencyKey,
+        },
+        body
+      });
+      if ((response.status < 500 && response.status !== 409) || attempt >= SUBMIT_ATTEMPTS) {
+        return response;
+      }
+    } catch (error) {
+      if (attempt >= SUBMIT_ATTEMPTS) {
+        throw error;
+      }
+    }
+    await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+  }
+};
+
 const OrderForm: React.FC = () => {
   const { toast } = useToast();
   const [formData, setFormData] = useState<OrderFormData>({
@@ -45,9 +73,12 @@ const OrderForm: React.FC = () => {
   });
 
   const [isSubmitting, setIsSubmitting] = useState(false);
+  // Один ключ на одну заявку: живёт до успешной отправки или до изменения данных формы
+  const idempotencyKey = useRef<string | null>(null);
 
   const handleChange = (e: React.ChangeEvent<HTMLInputElement | HTMLTextAreaElement | HTMLSelectElement>) => {
     const { name, value } = e.target;
+    idempotencyKey.current = null;
     setFormData(prev => ({
       ...prev,
       [name]: value
@@ -59,33 +90,31 @@ const OrderForm: React.FC = () => {
     setIsSubmitting(true);
 
     try {
-      const response = await fetch('https://functions.poehali.dev/1c0b122d-a5b5-4727-aaa6-681c30e9f3f3', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          client_name: formData.clientName,
-          client_phone: formData.clientPhone,
-          client_email: formData.clientEmail,
-          pet_name: formData.petName,
-          pet_type: formData.petType,
-          pet_breed: formData.petBreed,
-          pet_weight: formData.petWeight ? parseFloat(formData.petWeight) : null,
-          pet_special_needs: formData.petSpecialNeeds,
-          service_type: formData.serviceType,
-          pickup_address: formData.pickupAddress,
-          destination_address: formData.destinationAddress,
-          preferred_date: formData.preferredDate,
-          preferred_time: formData.preferredTime,
-          additional_services: formData.additionalServices,
-          comments: formData.comments
-        })
-      });
+      if (!idempotencyKey.current) {
+        idempotencyKey.current = crypto.randomUUID();
+      }
+      const response = await postOrder(JSON.stringify({
+        client_name: formData.clientName,
+        client_phone: formData.clientPhone,
+        client_email: formData.clientEmail,
+        pet_name: formData.petName,
+        pet_type: formData.petType,
+        pet_breed: formData.petBreed,
+        pet_weight: formData.petWeight ? parseFloat(formData.petWeight) : null,
+        pet_special_needs: formData.petSpecialNeeds,
+        service_type: formData.serviceType,
+        pickup_address: formData.pickupAddress,
+        destination_address: formData.destinationAddress,
+        preferred_date: formData.preferredDate,
+        preferred_time: formData.preferredTime,
+        additional_services: formData.additionalServices,
+        comments: formData.comments
+      }), idempotencyKey.current);
 
       const result = await response.json();
 
       if (response.ok) {
+        idempotencyKey.current = null;
         toast({
           title: '✅ Заявка успешно отправлена!',
           description: 'Мы свяжемся с вами в течение 15 минут для подтверждения заказа.',
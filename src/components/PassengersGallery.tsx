@@ -1,30 +1,51 @@
 import React, { useState, useEffect } from 'react';
 import { Card, CardContent } from '@/components/ui/card';
+import { Button } from '@/components/ui/button';
 import Icon from '@/components/ui/icon';
 
+const PASSENGERS_URL = 'https://functions.poehali.dev/9b67e555-8059-4828-adf9-09677d9dacd0';
+// Для карточек нужны только превью и подписи — полноразмерное фото не запрашиваем
+const GALLERY_FIELDS = 'id,pet_name,pet_type,thumbnail_url,description';
+const PAGE_SIZE = 24;
+
 interface Passenger {
   id: number;
   pet_name?: string;
   pet_type?: string;
-  photo_url: string;
+  photo_url?: string;
+  thumbnail_url?: string;
   description?: string;
-  is_published: boolean;
-  created_at: string;
+  is_published?: boolean;
+  created_at?: string;
 }
 
 const PassengersGallery: React.FC = () => {
   const [passengers, setPassengers] = useState<Passenger[]>([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     fetchPassengers();
   }, []);
 
+  const fetchPage = async (cursor: string | null) => {
+    const url = new URL(PASSENGERS_URL);
+    url.searchParams.set('published', 'true');
+    url.searchParams.set('fields', GALLERY_FIELDS);
+    url.searchParams.set('limit', String(PAGE_SIZE));
+    if (cursor) {
+      url.searchParams.set('cursor', cursor);
+    }
+    const response = await fetch(url.toString());
+    const data: Passenger[] = await response.json();
+    setNextCursor(response.headers.get('X-Next-Cursor'));
+    return data;
+  };
+
   const fetchPassengers = async () => {
     try {
-      const response = await fetch('https://functions.poehali.dev/9b67e555-8059-4828-adf9-09677d9dacd0?published=true');
-      const data = await response.json();
-      setPassengers(data);
+      setPassengers(await fetchPage(null));
     } catch (error) {
       console.error('Ошибка загрузки галереи:', error);
     } finally {
@@ -32,6 +53,19 @@ const PassengersGallery: React.FC = () => {
     }
   };
 
+  const loadMore = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const more = await fetchPage(nextCursor);
+      setPassengers((prev) => [...prev, ...more]);
+    } catch (error) {
+      console.error('Ошибка загрузки галереи:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   if (loading) {
     return (
       <section className="py-16 bg-white">
@@ -66,8 +100,9 @@ const PassengersGallery: React.FC = () => {
             <Card key={passenger.id} className="overflow-hidden hover:shadow-lg transition-shadow">
               <div className="aspect-square relative">
                 <img 
-                  src={passenger.photo_url} 
+                  src={passenger.thumbnail_url || passenger.photo_url} 
                   alt={passenger.pet_name || 'Пассажир'} 
+                  loading="lazy"
                   className="w-full h-full object-cover"
                 />
               </div>
@@ -89,6 +124,14 @@ const PassengersGallery: React.FC = () => {
             </Card>
           ))}
         </div>
+
+        {nextCursor && (
+          <div className="text-center mt-8">
+            <Button variant="outline" onClick={loadMore} disabled={loadingMore}>
+              {loadingMore ? 'Загрузка...' : 'Показать ещё'}
+            </Button>
+          </div>
+        )}
       </div>
     </section>
   );
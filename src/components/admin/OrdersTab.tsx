@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Badge } from '@/components/ui/badge';
@@ -27,6 +27,9 @@ interface OrdersTabProps {
   onDelete: (orderId: number) => void;
 }
 
+const ORDERS_URL = 'https://functions.poehali.dev/1c0b122d-a5b5-4727-aaa6-681c30e9f3f3';
+const SEARCH_MIN_LENGTH = 2;
+
 const OrdersTab: React.FC<OrdersTabProps> = ({ orders, onUpdateStatus, onUpdatePrice, onUpdateNotes, onDelete }) => {
   const [orderStatusFilter, setOrderStatusFilter] = useState<string>('all');
   const [orderSearchQuery, setOrderSearchQuery] = useState<string>('');
@@ -36,6 +39,42 @@ const OrdersTab: React.FC<OrdersTabProps> = ({ orders, onUpdateStatus, onUpdateP
   const [detailsDialogOpen, setDetailsDialogOpen] = useState(false);
   const [notesDialogOpen, setNotesDialogOpen] = useState(false);
   const [notesDialogMode, setNotesDialogMode] = useState<'notes' | 'cancel'>('notes');
+  const [searchResults, setSearchResults] = useState<Order[] | null>(null);
+
+  // Поиск выполняется на сервере (полнотекстовый индекс и триграммы), с задержкой на ввод
+  useEffect(() => {
+    const query = orderSearchQuery.trim();
+    if (query.length < SEARCH_MIN_LENGTH) {
+      setSearchResults(null);
+      return;
+    }
+    const controller = new AbortController();
+    const timer = setTimeout(async () => {
+      try {
+        const url = new URL(ORDERS_URL);
+        url.searchParams.set('q', query);
+        url.searchParams.set('limit', '100');
+        if (orderStatusFilter !== 'all') {
+          url.searchParams.set('status', orderStatusFilter);
+        }
+        const response = await fetch(url.toString(), { signal: controller.signal });
+        const data = await response.json();
+        if (response.ok) {
+          setSearchResults(data.orders || []);
+        } else {
+          console.error('Ошибка поиска заявок:', data.error);
+        }
+      } catch (error) {
+        if ((error as Error).name !== 'AbortError') {
+          console.error('Ошибка сети при поиске заявок:', error);
+        }
+      }
+    }, 300);
+    return () => {
+      clearTimeout(timer);
+      controller.abort();
+    };
+  }, [orderSearchQuery, orderStatusFilter]);
 
   const getStatusBadge = (status: Order['status']) => {
     const styles = {
@@ -61,15 +100,11 @@ const OrdersTab: React.FC<OrdersTabProps> = ({ orders, onUpdateStatus, onUpdateP
     );
   };
 
-  const filteredOrders = orders.filter(order => {
-    const matchesStatus = orderStatusFilter === 'all' || order.status === orderStatusFilter;
-    const matchesSearch = orderSearchQuery === '' || 
-      order.client_name.toLowerCase().includes(orderSearchQuery.toLowerCase()) ||
-      order.client_phone.includes(orderSearchQuery) ||
-      order.pet_name?.toLowerCase().includes(orderSearchQuery.toLowerCase()) ||
-      order.id.toString().includes(orderSearchQuery);
-    return matchesStatus && matchesSearch;
-  });
+  // Результаты поиска берём из загруженного списка, чтобы видеть локальные изменения статуса и цены
+  const ordersById = new Map(orders.map(order => [order.id, order]));
+  const filteredOrders = searchResults !== null
+    ? searchResults.map(order => ordersById.get(order.id) ?? order)
+    : orders.filter(order => orderStatusFilter === 'all' || order.status === orderStatusFilter);
 
   return (
     <Card>
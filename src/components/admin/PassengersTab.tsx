@@ -21,14 +21,14 @@ import type { Passenger } from './types';
 
 interface PassengersTabProps {
   passengers: Passenger[];
-  onAdd: (passenger: { pet_name: string; pet_type: string; photo_url: string; description: string }) => Promise<void>;
+  onAdd: (passenger: { pet_name: string; pet_type: string; photo_url: string; thumbnail_url?: string; description: string }) => Promise<void>;
   onTogglePublish: (passengerId: number, isPublished: boolean) => void;
   onDelete: (passengerId: number) => void;
 }
 
 const PassengersTab: React.FC<PassengersTabProps> = ({ passengers, onAdd, onTogglePublish, onDelete }) => {
   const { toast } = useToast();
-  const [newPassenger, setNewPassenger] = useState({ pet_name: '', pet_type: '', photo_url: '', description: '' });
+  const [newPassenger, setNewPassenger] = useState<{ pet_name: string; pet_type: string; photo_url: string; thumbnail_url?: string; description: string }>({ pet_name: '', pet_type: '', photo_url: '', description: '' });
   const [isAddingPassenger, setIsAddingPassenger] = useState(false);
   const [uploadingImage, setUploadingImage] = useState(false);
 
@@ -76,7 +76,7 @@ const PassengersTab: React.FC<PassengersTabProps> = ({ passengers, onAdd, onTogg
           const result = await response.json();
           
           if (response.ok) {
-            setNewPassenger({...newPassenger, photo_url: result.url});
+            setNewPassenger({...newPassenger, photo_url: result.url, thumbnail_url: result.thumbnail_url});
             toast({
               title: 'Фото загружено',
               description: `Размер: ${(result.size / 1024).toFixed(1)} KB`,
@@ -185,7 +185,7 @@ const PassengersTab: React.FC<PassengersTabProps> = ({ passengers, onAdd, onTogg
               <Input
                 placeholder="URL фотографии"
                 value={newPassenger.photo_url}
-                onChange={(e) => setNewPassenger({...newPassenger, photo_url: e.target.value})}
+                onChange={(e) => setNewPassenger({...newPassenger, photo_url: e.target.value, thumbnail_url: undefined})}
                 className="text-sm"
               />
               
@@ -228,8 +228,9 @@ const PassengersTab: React.FC<PassengersTabProps> = ({ passengers, onAdd, onTogg
             <Card key={passenger.id} className="overflow-hidden">
               <div className="aspect-square relative">
                 <img 
-                  src={passenger.photo_url} 
+                  src={passenger.thumbnail_url || passenger.photo_url} 
                   alt={passenger.pet_name || 'Пассажир'} 
+                  loading="lazy"
                   className="w-full h-full object-cover"
                 />
                 {!passenger.is_published && (
@@ -49,6 +49,7 @@ export interface Passenger {
   pet_name?: string;
   pet_type?: string;
   photo_url: string;
+  thumbnail_url?: string;
   description?: string;
   is_published: boolean;
   created_at: string;
@@ -21,6 +21,12 @@ interface Review {
   replied_at?: string;
 }
 
+interface ReviewStats {
+  count: number;
+  average: number | null;
+  distribution: Record<string, number>;
+}
+
 const ReviewsSection = () => {
   const { toast } = useToast();
   const [reviewName, setReviewName] = useState('');
@@ -33,6 +39,7 @@ const ReviewsSection = () => {
   const [touchEnd, setTouchEnd] = useState(0);
   const [reviews, setReviews] = useState<Review[]>([]);
   const [reviewsLoading, setReviewsLoading] = useState(true);
+  const [reviewStats, setReviewStats] = useState<ReviewStats | null>(null);
 
   useEffect(() => {
     const fetchReviews = async () => {
@@ -49,7 +56,20 @@ const ReviewsSection = () => {
       }
     };
 
+    // Средняя оценка по всем опубликованным отзывам, а не по 20 загруженным
+    const fetchStats = async () => {
+      try {
+        const response = await fetch('https://functions.poehali.dev/84a1dd5d-042b-48e9-89cf-dc09b9361aed?stats=true');
+        if (response.ok) {
+          setReviewStats(await response.json());
+        }
+      } catch (error) {
+        console.error('Ошибка загрузки рейтинга:', error);
+      }
+    };
+
     fetchReviews();
+    fetchStats();
   }, []);
 
   const nextSlide = () => {
@@ -169,6 +189,13 @@ const ReviewsSection = () => {
     <section id="reviews" className="py-12 md:py-16 bg-gray-50">
       <div className="container mx-auto">
         <h3 className="text-2xl md:text-3xl font-bold text-center mb-8 md:mb-12">Отзывы клиентов</h3>
+        {reviewStats && reviewStats.count > 0 && reviewStats.average !== null && (
+          <div className="flex items-center justify-center gap-2 -mt-4 md:-mt-8 mb-8 text-gray-600">
+            <Icon name="Star" size={20} className="text-yellow-400 fill-current" />
+            <span className="text-lg font-semibold text-gray-900">{reviewStats.average.toFixed(1)}</span>
+            <span>· {reviewStats.count} оценок</span>
+          </div>
+        )}
         
         <div className="max-w-4xl mx-auto relative">
           <div 
@@ -1,11 +1,42 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import type { Order, Review, Passenger } from '@/components/admin/types';
 
+const ORDERS_URL = 'https://functions.poehali.dev/1c0b122d-a5b5-4727-aaa6-681c30e9f3f3';
+const REVIEWS_URL = 'https://functions.poehali.dev/84a1dd5d-042b-48e9-89cf-dc09b9361aed';
+const PASSENGERS_URL = 'https://functions.poehali.dev/9b67e555-8059-4828-adf9-09677d9dacd0';
+
+interface SyncMarks {
+  orders: string;
+  reviews: string;
+  passengers: string;
+}
+
+// Применяет дельту к списку (новые сверху): изменённые строки заменяются, удалённые убираются
+const mergeDelta = <T extends { id: number }>(list: T[], changed: T[], deleted: number[]): T[] => {
+  const removed = new Set(deleted);
+  const changedById = new Map(changed.map(item => [item.id, item]));
+  const known = new Set(list.map(item => item.id));
+  // Дельта упорядочена от старых изменений к новым
+  const added = changed.filter(item => !known.has(item.id) && !removed.has(item.id)).reverse();
+  const kept = list
+    .filter(item => !removed.has(item.id))
+    .map(item => changedById.get(item.id) ?? item);
+  return [...added, ...kept];
+};
+
+const withUpdatedSince = (url: string, since: string) => {
+  const deltaUrl = new URL(url);
+  deltaUrl.searchParams.set('updated_since', since);
+  return deltaUrl.toString();
+};
+
 export const useAdminData = () => {
   const [orders, setOrders] = useState<Order[]>([]);
   const [reviews, setReviews] = useState<Review[]>([]);
   const [passengers, setPassengers] = useState<Passenger[]>([]);
   const [loading, setLoading] = useState(true);
+  // synced_at из последнего ответа каждого списка — отсюда продолжается дельта-синхронизация
+  const syncMarks = useRef<SyncMarks | null>(null);
   const [contacts, setContacts] = useState({ 
     phone: '79685227272', 
     telegram: 'zootaxi_uyut', 
@@ -30,50 +61,131 @@ export const useAdminData = () => {
     }
   }, []);
 
+  // Лента изменений заявок: запрос висит до новой заявки или смены статуса (до 25 с),
+  // после события подтягиваем дельту — без постоянного опроса списков
+  const syncDataRef = useRef<() => Promise<void>>();
+  useEffect(() => {
+    const controller = new AbortController();
+    const followChanges = async () => {
+      let cursor: string | null = null;
+      while (!controller.signal.aborted) {
+        try {
+          const changesUrl = new URL(ORDERS_URL);
+          changesUrl.searchParams.set('view', 'changes');
+          // Первый опрос — от synced_at загрузки, дальше — по cursor из ответа
+          if (cursor) {
+            changesUrl.searchParams.set('cursor', cursor);
+          } else if (syncMarks.current?.orders) {
+            changesUrl.searchParams.set('since', syncMarks.current.orders);
+          }
+          const response = await fetch(changesUrl.toString(), { signal: controller.signal });
+          if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+          }
+          const data = await response.json();
+          cursor = data.cursor;
+          if (data.events.length > 0) {
+            await syncDataRef.current?.();
+          }
+        } catch (error) {
+          if (controller.signal.aborted) {
+            return;
+          }
+          console.error('Ошибка ленты изменений заявок:', error);
+          await new Promise(resolve => setTimeout(resolve, 5000));
+        }
+      }
+    };
+    followChanges();
+    return () => controller.abort();
+  }, []);
+
   const loadData = async () => {
     setLoading(true);
     try {
-      const ordersResponse = await fetch('https://functions.poehali.dev/1c0b122d-a5b5-4727-aaa6-681c30e9f3f3', {
+      // Заявки, отзывы и первая страница галереи со счётчиками — одним запросом
+      const dashboardResponse = await fetch(`${ORDERS_URL}?view=dashboard`, {
         method: 'GET'
       });
       
-      const ordersData = await ordersResponse.json();
+      const dashboardData = await dashboardResponse.json();
       
-      if (ordersResponse.ok) {
-        setOrders(ordersData.orders || []);
-      } else {
-        console.error('Ошибка загрузки заявок:', ordersData.error);
+      if (!dashboardResponse.ok) {
+        console.error('Ошибка загрузки данных админки:', dashboardData.error);
         setOrders([]);
-      }
-      
-      const reviewsResponse = await fetch('https://functions.poehali.dev/84a1dd5d-042b-48e9-89cf-dc09b9361aed', {
-        method: 'GET'
-      });
-      
-      const reviewsData = await reviewsResponse.json();
-      
-      if (reviewsResponse.ok) {
-        setReviews(reviewsData.reviews || []);
-      } else {
-        console.error('Ошибка загрузки отзывов:', reviewsData.error);
         setReviews([]);
+        setPassengers([]);
+        setLoading(false);
+        return;
       }
       
-      const passengersResponse = await fetch('https://functions.poehali.dev/9b67e555-8059-4828-adf9-09677d9dacd0');
-      const passengersData = await passengersResponse.json();
+      setOrders(dashboardData.orders.items || []);
+      setReviews(dashboardData.reviews.items || []);
+      syncMarks.current = {
+        orders: dashboardData.synced_at,
+        reviews: dashboardData.synced_at,
+        passengers: dashboardData.synced_at
+      };
       
-      if (passengersResponse.ok) {
-        setPassengers(passengersData || []);
-      } else {
-        console.error('Ошибка загрузки галереи:', passengersData.error);
-        setPassengers([]);
+      // Остальные страницы галереи — по cursor, следующая страница в заголовке X-Next-Cursor
+      const allPassengers: Passenger[] = [...(dashboardData.passengers.items || [])];
+      let passengersCursor: string | null = dashboardData.passengers.next_cursor;
+      while (passengersCursor) {
+        const passengersUrl = new URL(PASSENGERS_URL);
+        passengersUrl.searchParams.set('limit', '200');
+        passengersUrl.searchParams.set('cursor', passengersCursor);
+        const passengersResponse = await fetch(passengersUrl.toString());
+        const passengersData = await passengersResponse.json();
+        
+        if (!passengersResponse.ok) {
+          console.error('Ошибка загрузки галереи:', passengersData.error);
+          break;
+        }
+        allPassengers.push(...(passengersData || []));
+        passengersCursor = passengersResponse.headers.get('X-Next-Cursor');
       }
+      setPassengers(allPassengers);
     } catch (error) {
       console.error('Ошибка загрузки данных:', error);
     }
     setLoading(false);
   };
 
+  // После действий в админке догружаем только изменения; если дельта недоступна (410) — полная загрузка
+  const syncData = async () => {
+    const marks = syncMarks.current;
+    if (!marks) {
+      await loadData();
+      return;
+    }
+    try {
+      const responses = await Promise.all([
+        fetch(withUpdatedSince(ORDERS_URL, marks.orders)),
+        fetch(withUpdatedSince(REVIEWS_URL, marks.reviews)),
+        fetch(withUpdatedSince(PASSENGERS_URL, marks.passengers))
+      ]);
+      if (responses.some(response => !response.ok)) {
+        await loadData();
+        return;
+      }
+      const [ordersDelta, reviewsDelta, passengersDelta] = await Promise.all(
+        responses.map(response => response.json())
+      );
+      setOrders(prev => mergeDelta(prev, ordersDelta.orders, ordersDelta.deleted));
+      setReviews(prev => mergeDelta(prev, reviewsDelta.reviews, reviewsDelta.deleted));
+      setPassengers(prev => mergeDelta(prev, passengersDelta.passengers, passengersDelta.deleted));
+      syncMarks.current = {
+        orders: ordersDelta.synced_at,
+        reviews: reviewsDelta.synced_at,
+        passengers: passengersDelta.synced_at
+      };
+    } catch (error) {
+      console.error('Ошибка синхронизации данных:', error);
+    }
+  };
+
+  syncDataRef.current = syncData;
+
   return {
     orders,
     setOrders,
@@ -86,6 +198,7 @@ export const useAdminData = () => {
     setContacts,
     notifications,
     setNotifications,
-    loadData
+    loadData,
+    syncData
   };
 };
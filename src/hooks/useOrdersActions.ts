@@ -192,9 +192,103 @@ export const useOrdersActions = (
     }
   };
 
+  // Пакетные операции: один запрос и одна транзакция на весь список заявок
+  const deleteOrders = async (orderIds: number[]) => {
+    try {
+      const response = await fetch('https://functions.poehali.dev/1c0b122d-a5b5-4727-aaa6-681c30e9f3f3', {
+        method: 'DELETE',
+        headers: {
+          'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ ids: orderIds })
+      });
+      
+      const result = await response.json();
+      
+      if (response.ok) {
+        const deletedIds = new Set<number>(
+          result.results
+            .filter((item: { id: number; result: string }) => item.result === 'deleted')
+            .map((item: { id: number }) => item.id)
+        );
+        setOrders(orders.filter(order => !deletedIds.has(order.id)));
+        toast({
+          title: 'Заявки удалены',
+          description: `Удалено заявок: ${result.deleted}`,
+        });
+      } else {
+        console.error('Ошибка удаления заявок:', result.error);
+        toast({
+          title: 'Ошибка',
+          description: 'Не удалось удалить заявки',
+          variant: 'destructive',
+        });
+      }
+    } catch (error) {
+      console.error('Ошибка сети при удалении заявок:', error);
+      toast({
+        title: 'Ошибка сети',
+        description: 'Не удалось подключиться к серверу',
+        variant: 'destructive',
+      });
+    }
+  };
+
+  const updateOrdersStatus = async (orderIds: number[], newStatus: Order['status']) => {
+    try {
+      const response = await fetch('https://functions.poehali.dev/1c0b122d-a5b5-4727-aaa6-681c30e9f3f3', {
+        method: 'PUT',
+        headers: {
+          'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({
+          ids: orderIds,
+          status: newStatus
+        })
+      });
+      
+      const result = await response.json();
+      
+      if (response.ok) {
+        const updatedById = new Map<number, Partial<Order>>();
+        for (const item of result.results) {
+          if (item.result === 'updated') {
+            updatedById.set(item.id, item.order);
+          }
+        }
+        setOrders(orders.map(order => 
+          updatedById.has(order.id)
+            ? { ...order, ...updatedById.get(order.id) }
+            : order
+        ));
+        
+        toast({
+          title: 'Статусы обновлены',
+          description: `Обновлено заявок: ${result.updated}`,
+        });
+      } else {
+        console.error('Ошибка обновления статусов заявок:', result.error);
+        toast({
+          title: 'Ошибка',
+          description: 'Не удалось обновить статусы заявок',
+          variant: 'destructive',
+        });
+      }
+    } catch (error) {
+      console.error('Ошибка сети при обновлении статусов:', error);
+      toast({
+        title: 'Ошибка сети',
+        description: 'Не удалось подключиться к серверу',
+        variant: 'destructive',
+      });
+    }
+  };
+
   return {
     deleteOrder,
+    deleteOrders,
     updateOrderStatus,
+    updateOrdersStatus,
     updateOrderPrice,
     updateOrderNotes
   };
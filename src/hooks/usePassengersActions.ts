@@ -12,6 +12,7 @@ export const usePassengersActions = (
     pet_name: string; 
     pet_type: string; 
     photo_url: string; 
+    thumbnail_url?: string;
     description: string 
   }) => {
     try {
@@ -24,6 +25,7 @@ export const usePassengersActions = (
           pet_name: passenger.pet_name,
           pet_type: passenger.pet_type,
           photo_url: passenger.photo_url,
+          thumbnail_url: passenger.thumbnail_url,
           description: passenger.description,
           is_published: true
         })
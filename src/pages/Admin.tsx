@@ -115,7 +115,8 @@ const Admin: React.FC = () => {
     setContacts,
     notifications,
     setNotifications,
-    loadData
+    loadData,
+    syncData
   } = useAdminData();
 
   const {
@@ -136,7 +137,7 @@ const Admin: React.FC = () => {
     addPassenger,
     deletePassenger,
     togglePassengerPublish
-  } = usePassengersActions(passengers, setPassengers, loadData);
+  } = usePassengersActions(passengers, setPassengers, syncData);
 
   const {
     handleSaveContacts,